@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import types
+from datetime import datetime
+from cassandra import cqltypes
+from cassandra.protocol import ColumnMetadata
+from cassandra.query import PreparedStatement
+from pymongo import uri_parser
+import conexiones
+import generador
+import ingesta
+import modelcassandra
+import modeldgraph
+import modelpython
+import populate
+
+# Set logger
+log = logging.getLogger()
+
+# Número de restaurantes de cada escala, llamadas medidas por consulta y veces que se repite cada carga
+ESCALAS = [1000, 100000, 1000000]
+REPETICIONES = 50
+REPETICIONES_CARGA = 5
+DATA_DIR = "bench_data"
+SALIDA = "benchmark_resultados.json"
+
+# Las cargas reales van a un keyspace y una base propios para no tocar los datos del sistema
+BENCH_KEYSPACE = "investments_bench"
+BENCH_DB = "PFmongodb_bench"
+
+# Un p95 (o un throughput de carga) que empeora más que este factor se marca como regresión
+UMBRAL_REGRESION = 1.2
+
+
+# Sustitutos locales: aceptan las llamadas del driver sin servidor, así se mide el trabajo del
+# cliente (lectura del CSV, armado de documentos, bind de sentencias, lotes y mutaciones)
+class _ResultadoVacio(list):
+    has_more_pages = False
+    was_applied = True
+
+    def one(self):
+        return None
+
+
+class _FutureInmediata:
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        callback(_ResultadoVacio(), *callback_args)
+
+    def result(self):
+        return _ResultadoVacio()
+
+
+class CassandraSustituta:
+    """
+    Sesión sin servidor. Las sentencias se preparan con metadatos reales de columnas (las de
+    un INSERT o las comparadas con ? en WHERE, más el LIMIT), de modo que bind() serializa
+    los valores igual que con el driver conectado. Las lecturas no devuelven filas.
+    """
+    keyspace = BENCH_KEYSPACE
+    TIPOS = {"total_sales": cqltypes.DecimalType, "version": cqltypes.Int32Type,
+             "generation": cqltypes.Int32Type, "[limit]": cqltypes.Int32Type}
+
+    def __init__(self):
+        self.cluster = types.SimpleNamespace(register_listener=lambda listener: None)
+        self.peticiones = 0
+
+    def _columna(self, tabla, nombre):
+        return ColumnMetadata(self.keyspace, tabla, nombre, self.TIPOS.get(nombre, cqltypes.UTF8Type))
+
+    def prepare(self, cql):
+        insert = re.search(r"INSERT INTO (\w+) \(([^)]*)\)", cql)
+        if insert:
+            tabla = insert.group(1)
+            columnas = [self._columna(tabla, nombre.strip()) for nombre in insert.group(2).split(",")]
+        else:
+            tabla = re.search(r"(?:FROM|UPDATE)\s+(\w+)", cql).group(1)
+            # token(month) <= ? se serializa como el token (bigint) de la partición
+            nombres = re.findall(r"(token\(\w+\)|\w+)\s*(?:=|<=|>=|<|>)\s*\?", cql)
+            columnas = [ColumnMetadata(self.keyspace, tabla, nombre, cqltypes.LongType) if nombre.startswith("token(")
+                        else self._columna(tabla, nombre) for nombre in nombres]
+            if re.search(r"LIMIT\s+\?", cql):
+                columnas.append(self._columna(tabla, "[limit]"))
+        return PreparedStatement(columnas, b"bench", None, cql, self.keyspace, 4, None, None)
+
+    def execute(self, query, parameters=None):
+        # Lectura del puntero de generación: sin filas, las sentencias usan la generación 0
+        self.peticiones += 1
+        return _ResultadoVacio()
+
+    def execute_async(self, stmt, values=None):
+        self.peticiones += 1
+        return _FutureInmediata()
+
+
+class _ColeccionSustituta:
+    def __init__(self, name, contador):
+        self.name = name
+        self._contador = contador
+
+    def bulk_write(self, operaciones, ordered=True):
+        self._contador["peticiones"] += 1
+        return types.SimpleNamespace(inserted_count=len(operaciones))
+
+    def insert_many(self, documentos):
+        self._contador["peticiones"] += 1
+        return types.SimpleNamespace(inserted_ids=[None] * len(documentos))
+
+    def __getattr__(self, metodo):
+        # delete_many, create_index, aggregate ($merge de las vistas), etc.
+        def llamada(*args, **kwargs):
+            self._contador["peticiones"] += 1
+        return llamada
+
+
+class MongoSustituta:
+    def __init__(self):
+        self.contador = {"peticiones": 0}
+
+    def __getitem__(self, name):
+        return _ColeccionSustituta(name, self.contador)
+
+    @property
+    def peticiones(self):
+        return self.contador["peticiones"]
+
+
+class _TxnSustituta:
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def mutate(self, commit_now=False, set_obj=None, set_nquads=None):
+        uids = {}
+        with self._cliente.lock:
+            self._cliente.peticiones += 1
+            for nodo in set_obj or []:
+                if str(nodo.get("uid", "")).startswith("_:"):
+                    self._cliente.siguiente_uid += 1
+                    uids[nodo["uid"][2:]] = hex(self._cliente.siguiente_uid)
+        return types.SimpleNamespace(uids=uids)
+
+    def create_mutation(self, **mutacion):
+        return mutacion
+
+    def create_request(self, query=None, variables=None, mutations=None, commit_now=None):
+        return {"mutations": mutations or []}
+
+    def do_request(self, request):
+        # Bloques upsert: todos los nodos se tratan como nuevos
+        uids = {}
+        with self._cliente.lock:
+            self._cliente.peticiones += 1
+            for mutacion in request["mutations"]:
+                for variable in re.findall(r"^(uid\(n\d+\)) <xid>", mutacion.get("set_nquads") or "", re.M):
+                    self._cliente.siguiente_uid += 1
+                    uids[variable] = hex(self._cliente.siguiente_uid)
+        return types.SimpleNamespace(uids=uids, json=b"{}")
+
+    def discard(self):
+        pass
+
+
+class DgraphSustituto:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peticiones = 0
+        self.siguiente_uid = 0
+
+    def txn(self, read_only=False):
+        return _TxnSustituta(self)
+
+
+# Métricas
+def percentil(valores, p):
+    """
+    Percentil p (0-100) por rango más cercano.
+    """
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[indice]
+
+
+def resumen(latencias, filas):
+    total = sum(latencias)
+    return {
+        "llamadas": len(latencias),
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "media_ms": total / len(latencias) * 1000,
+        "llamadas_por_seg": len(latencias) / total if total > 0 else None,
+        "filas_por_llamada": filas / len(latencias),
+    }
+
+
+def medir_consulta(consulta, repeticiones):
+    """
+    Llama consulta(i) `repeticiones` veces consumiendo todo el resultado en cada llamada.
+    """
+    latencias, filas = [], 0
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        filas += sum(1 for _ in consulta(i))
+        latencias.append(time.perf_counter() - inicio)
+    return resumen(latencias, filas)
+
+
+def medir_carga(carga, registros, modo, cliente, repeticiones=REPETICIONES_CARGA):
+    """
+    Ejecuta la carga `repeticiones` veces (cada una vacía antes la base) y resume los tiempos.
+    registros_por_seg se calcula con la mediana; peticiones son las de una sola carga.
+    """
+    segundos, peticiones = [], 0
+    for _ in range(repeticiones):
+        previas = cliente.peticiones if modo == "sustituto" else 0
+        inicio = time.perf_counter()
+        carga()
+        segundos.append(time.perf_counter() - inicio)
+        if modo == "sustituto":
+            peticiones = cliente.peticiones - previas
+    mediana = statistics.median(segundos)
+    resultado = {
+        "modo": modo,
+        "registros": registros,
+        "repeticiones": repeticiones,
+        "segundos": mediana,
+        "min_segundos": min(segundos),
+        "max_segundos": max(segundos),
+        "desviacion_segundos": statistics.stdev(segundos) if len(segundos) > 1 else 0.0,
+        "registros_por_seg": registros / mediana if mediana > 0 else None,
+    }
+    if modo == "sustituto":
+        resultado["peticiones"] = peticiones
+    return resultado
+
+
+# Servidores
+def _accesible(host, port, timeout=1.0):
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def servidores_disponibles(usar_dgraph=False):
+    """
+    Bases con servidor accesible. Dgraph solo se usa si se pide, porque la carga
+    ejecuta drop_all sobre el grafo.
+    """
+    mongo_host, mongo_port = uri_parser.parse_uri(conexiones.MONGODB_URI)["nodelist"][0]
+    dgraph_host, _, dgraph_port = conexiones.DGRAPH_URI.rpartition(":")
+    return {
+        "mongodb": _accesible(mongo_host, mongo_port),
+        "cassandra": _accesible(conexiones.CASSANDRA_CLUSTER_IPS.split(",")[0], 9042),
+        "dgraph": usar_dgraph and _accesible(dgraph_host, dgraph_port),
+    }
+
+
+def clientes(disponibles):
+    """
+    Cliente real (con el esquema al día y los datos de benchmark vacíos) o sustituto por base.
+    """
+    resultado = {}
+    if disponibles["mongodb"]:
+        database = conexiones.mongo_client()[BENCH_DB]
+        modelpython.ensure_schema(database)
+        resultado["mongodb"] = ("servidor", database)
+    else:
+        resultado["mongodb"] = ("sustituto", MongoSustituta())
+    if disponibles["cassandra"]:
+        session = conexiones.cassandra_session()
+        modelcassandra.ensure_schema(session, BENCH_KEYSPACE, 1)
+        resultado["cassandra"] = ("servidor", session)
+    else:
+        resultado["cassandra"] = ("sustituto", CassandraSustituta())
+    if disponibles["dgraph"]:
+        client = conexiones.dgraph_client()
+        resultado["dgraph"] = ("servidor", client)
+    else:
+        resultado["dgraph"] = ("sustituto", DgraphSustituto())
+    return resultado
+
+
+# Fases del benchmark
+def generar_datos(escala, data_dir, reusar=False):
+    """
+    Genera (o reutiliza) el conjunto de datos de una escala con la lógica de generador.
+    """
+    output_dir = os.path.join(data_dir, str(escala))
+    if reusar and os.path.isdir(output_dir) and generador.shard_files("restaurantes", output_dir):
+        return output_dir, None
+    usuarios = max(generador.NUM_USUARIOS, escala // 10)
+    zonas = max(generador.NUM_ZONAS, escala // 10000)
+    shards = max(1, min(os.cpu_count() or 1, escala // 50000))
+    inicio = time.perf_counter()
+    generador.generar(escala, usuarios, zonas, shards=shards, output_dir=output_dir)
+    segundos = time.perf_counter() - inicio
+    return output_dir, {"restaurantes": escala, "usuarios": usuarios, "zonas": zonas, "shards": shards,
+                        "segundos": segundos, "filas_por_seg": (escala + usuarios + zonas) / segundos}
+
+
+def medir_cargas(data_dir, escala, bases, repeticiones=REPETICIONES_CARGA):
+    restaurantes_csv = generador.shard_files("restaurantes", data_dir)
+    zonas = list(ingesta.leer_csv(os.path.join(data_dir, "zonas.csv")))
+    resultados = {}
+
+    modo, database = bases["mongodb"]
+    def cargar_mongo():
+        if modo == "servidor":
+            populate.clear_collections(database)
+        zona_ids = [zona["id"] for zona in populate.insert_zonas(database, zonas)]
+        populate.insert_restaurantes(database, ingesta.leer_csv(restaurantes_csv), zona_ids)
+    resultados["mongodb"] = medir_carga(cargar_mongo, escala, modo, database, repeticiones)
+
+    modo, session = bases["cassandra"]
+    def cargar_cassandra():
+        if modo == "servidor":
+            modelcassandra.drop_data(session)
+        records = ({"nombre": r["nombre"], "categoria": r["categoria"], "ventas": modelcassandra.parse_ventas(r["ventas"])}
+                   for r in ingesta.leer_csv(restaurantes_csv))
+        # Tablas recién vaciadas (o el sustituto, sin datos): no hay ventas anteriores que leer
+        modelcassandra.load_sales_records(session, records, fresh=True)
+    resultados["cassandra"] = medir_carga(cargar_cassandra, escala, modo, session, repeticiones)
+
+    modo, client = bases["dgraph"]
+    def cargar_dgraph():
+        if modo == "servidor":
+            modeldgraph.drop_all(client)
+            modeldgraph.ensure_schema(client)
+        usuarios = [modeldgraph.usuario_nodo(u) for u in ingesta.leer_csv(generador.shard_files("usuarios", data_dir))]
+        restaurantes = [modeldgraph.restaurante_nodo(ingesta.parse_restaurante(r)) for r in ingesta.leer_csv(restaurantes_csv)]
+        zonas_nodos = [modeldgraph.zona_nodo(z) for z in zonas]
+        aristas = modeldgraph.generar_aristas(usuarios, restaurantes, zonas_nodos)
+        modeldgraph.agregar_datos(client, usuarios, restaurantes, zonas_nodos, aristas=aristas)
+    resultados["dgraph"] = medir_carga(cargar_dgraph, escala, modo, client, repeticiones)
+    return resultados
+
+
+def consultas(data_dir, bases):
+    """
+    Consultas medidas por base. Se usan las versiones sin caché para medir la base y no la caché.
+    """
+    nombres = [r["nombre"] for r in itertools.islice(ingesta.leer_csv(generador.shard_files("restaurantes", data_dir)), 100)]
+    ciudades = [z["nombre"] for z in ingesta.leer_csv(os.path.join(data_dir, "zonas.csv"))]
+    meses = modelcassandra.MONTH_ORDER
+    _, database = bases["mongodb"]
+    _, session = bases["cassandra"]
+    _, client = bases["dgraph"]
+    return {
+        "mongodb": {
+            "top_restaurants_by_zone": lambda i: modelpython.query_top_restaurants_by_zone.uncached(database),
+            "leaderboard_by_zone": lambda i: modelpython.leaderboard_by_zone(database),
+            "top_restaurants_by_category": lambda i: modelpython.query_top_restaurants_by_category.uncached(
+                database, generador.CATEGORIAS[i % len(generador.CATEGORIAS)])[1],
+        },
+        "cassandra": {
+            "get_sales_by_month": lambda i: modelcassandra.query_sales_by_month.uncached(session, meses[i % 12]),
+            "get_sales_by_restaurant": lambda i: modelcassandra.get_sales_by_restaurant(session, nombres[i % len(nombres)]),
+            "get_sales_by_sales_range": lambda i: modelcassandra.get_sales_by_sales_range(
+                session, 100000, 500000, limit=100, order="desc"),
+            "get_monthly_totals": lambda i: modelcassandra.get_monthly_totals(session),
+        },
+        "dgraph": {
+            "get_restaurants_by_city": lambda i: modeldgraph.query_restaurants_by_city.uncached(
+                client, modeldgraph.normalizeString(ciudades[i % len(ciudades)])) or (),
+            "top_restaurants_by_followers": lambda i: modeldgraph.top_restaurants_by_followers(client, 3)["items"],
+        },
+    }
+
+
+def medir_consultas(data_dir, bases, repeticiones):
+    """
+    Percentiles de cada consulta contra los servidores. Los sustitutos no devuelven filas, así
+    que sus consultas no se miden (ejecutar solo lo permite para Dgraph sin --dgraph).
+    """
+    resultados = {}
+    for base, funciones in consultas(data_dir, bases).items():
+        modo, _ = bases[base]
+        for nombre, consulta in funciones.items():
+            if modo != "servidor":
+                resultados[f"{base}.{nombre}"] = {"omitida": "sin servidor"}
+                continue
+            print(f"  {base}.{nombre}...")
+            resultados[f"{base}.{nombre}"] = medir_consulta(consulta, repeticiones)
+    return resultados
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior, umbral=UMBRAL_REGRESION):
+    """
+    Devuelve las regresiones de actual frente a anterior: p95 de consultas que sube más
+    que umbral y throughput de cargas o generación que baja más que umbral.
+    """
+    regresiones = []
+    for escala, datos in actual["escalas"].items():
+        previos = anterior.get("escalas", {}).get(escala)
+        if not previos:
+            continue
+        for nombre, medida in datos["consultas"].items():
+            previa = previos.get("consultas", {}).get(nombre, {})
+            if "p95_ms" in medida and previa.get("p95_ms"):
+                factor = medida["p95_ms"] / previa["p95_ms"]
+                if factor > umbral:
+                    regresiones.append(f"{escala} {nombre}: p95 {previa['p95_ms']:.2f} -> {medida['p95_ms']:.2f} ms")
+        for nombre, medida in datos["cargas"].items():
+            previa = previos["cargas"].get(nombre, {})
+            if previa.get("modo") == medida["modo"] and previa.get("registros_por_seg"):
+                factor = previa["registros_por_seg"] / medida["registros_por_seg"]
+                if factor > umbral:
+                    regresiones.append(f"{escala} carga {nombre}: {previa['registros_por_seg']:.0f} -> "
+                                       f"{medida['registros_por_seg']:.0f} registros/seg")
+    return regresiones
+
+
+def ejecutar(escalas=ESCALAS, repeticiones=REPETICIONES, data_dir=DATA_DIR, reusar=False, usar_dgraph=False,
+             repeticiones_carga=REPETICIONES_CARGA, solo_cargas=False):
+    """
+    Mide cargas y consultas en cada escala. Sin solo_cargas, los percentiles de consultas
+    necesitan servidores en vivo: si falta alguno (Dgraph solo cuenta con usar_dgraph) se lanza
+    RuntimeError antes de generar datos.
+    """
+    disponibles = servidores_disponibles(usar_dgraph)
+    print("Servidor disponible: " + ", ".join(f"{base}={'sí' if ok else 'no'}" for base, ok in disponibles.items()))
+    requeridas = ["mongodb", "cassandra"] + (["dgraph"] if usar_dgraph else [])
+    sin_servidor = [base for base in requeridas if not disponibles[base]]
+    if sin_servidor and not solo_cargas:
+        raise RuntimeError(
+            f"Los percentiles de consultas necesitan servidores en vivo (sin servidor: {', '.join(sin_servidor)}). "
+            "Use --solo-cargas para medir solo las cargas con los sustitutos."
+        )
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "repeticiones": repeticiones,
+        "repeticiones_carga": repeticiones_carga,
+        "modos": {base: "servidor" if ok else "sustituto" for base, ok in disponibles.items()},
+        "escalas": {},
+    }
+    for escala in escalas:
+        # Sustitutos nuevos en cada escala para que sus contadores no se acumulen
+        bases = clientes(disponibles)
+        print(f"Escala {escala}: generando datos...")
+        directorio, generacion = generar_datos(escala, data_dir, reusar)
+        print(f"Escala {escala}: cargando...")
+        cargas = medir_cargas(directorio, escala, bases, repeticiones_carga)
+        resultado["escalas"][str(escala)] = {"generacion": generacion, "cargas": cargas, "consultas": {}}
+        if not solo_cargas:
+            print(f"Escala {escala}: consultando...")
+            resultado["escalas"][str(escala)]["consultas"] = medir_consultas(directorio, bases, repeticiones)
+    return resultado
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mide latencia y throughput de consultas y cargas a varias escalas.")
+    parser.add_argument("--escalas", default=",".join(map(str, ESCALAS)),
+                        help="Número de restaurantes por escala, separados por comas")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES, help="Llamadas medidas por consulta")
+    parser.add_argument("--repeticiones-carga", type=int, default=REPETICIONES_CARGA,
+                        help="Veces que se repite cada carga")
+    parser.add_argument("--solo-cargas", action="store_true",
+                        help="Medir solo las cargas (sin servidores se usan los sustitutos)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directorio de los conjuntos generados")
+    parser.add_argument("--reusar", action="store_true", help="Reutilizar los conjuntos ya generados")
+    parser.add_argument("--dgraph", action="store_true",
+                        help="Usar el servidor de Dgraph si está disponible (ejecuta drop_all)")
+    parser.add_argument("--salida", default=SALIDA, help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="Resultados anteriores (JSON) para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION, help="Factor de regresión tolerado")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    escalas = [int(float(escala)) for escala in args.escalas.split(",")]
+    try:
+        resultado = ejecutar(escalas, args.repeticiones, args.data_dir, args.reusar, args.dgraph,
+                             args.repeticiones_carga, args.solo_cargas)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 2
+    with open(args.salida, "w", encoding="utf-8") as file:
+        json.dump(resultado, file, indent=2)
+    print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as file:
+            regresiones = comparar(resultado, json.load(file), args.umbral)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        if regresiones:
+            return 1
+        print("Sin regresiones.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
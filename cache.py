@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import functools
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Set logger
+log = logging.getLogger()
+
+# Entradas máximas en la caché (LRU) y TTL por defecto en segundos
+MAX_ENTRIES = 256
+DEFAULT_TTL = 300
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # clave -> (expira, valor, grupo)
+_ttls = {}                # consulta -> TTL
+_stats = {}               # consulta -> Counter(hits, misses, evictions, expired)
+# Se incrementa al invalidar, para no guardar resultados calculados antes de una recarga
+_generation = [0]
+
+
+def configure(max_entries=None, ttls=None):
+    """
+    Ajusta el tamaño máximo de la caché y/o el TTL de consultas concretas ({nombre: segundos}).
+    """
+    global MAX_ENTRIES
+    with _lock:
+        if max_entries is not None:
+            MAX_ENTRIES = max_entries
+            _evict()
+        if ttls:
+            _ttls.update(ttls)
+
+
+def _evict():
+    while len(_entries) > MAX_ENTRIES:
+        (name, _, _), _ = _entries.popitem(last=False)
+        _stats[name]["evictions"] += 1
+
+
+def cached(name, group, ttl=DEFAULT_TTL):
+    """
+    Decorador de lectura a través de caché para funciones de consulta. La clave incluye los
+    argumentos; group identifica el almacén ("mongodb", "dgraph", "cassandra") para poder
+    invalidar solo lo afectado por una recarga.
+    """
+    def decorator(func):
+        _ttls.setdefault(name, ttl)
+        _stats.setdefault(name, Counter())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            now = time.monotonic()
+            with _lock:
+                entry = _entries.get(key)
+                if entry is not None and entry[0] > now:
+                    _entries.move_to_end(key)
+                    _stats[name]["hits"] += 1
+                    return entry[1]
+                if entry is not None:
+                    del _entries[key]
+                    _stats[name]["expired"] += 1
+                _stats[name]["misses"] += 1
+                generation = _generation[0]
+
+            value = func(*args, **kwargs)
+
+            with _lock:
+                if generation == _generation[0]:
+                    _entries[key] = (now + _ttls[name], value, group)
+                    _entries.move_to_end(key)
+                    _evict()
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def invalidate(group=None):
+    """
+    Elimina las entradas de un almacén, o todas si group es None.
+    """
+    with _lock:
+        _generation[0] += 1
+        if group is None:
+            removed = len(_entries)
+            _entries.clear()
+        else:
+            keys = [key for key, entry in _entries.items() if entry[2] == group]
+            for key in keys:
+                del _entries[key]
+            removed = len(keys)
+    log.info(f"Caché invalidada ({group or 'todas'}): {removed} entradas eliminadas")
+
+
+def stats():
+    """
+    Aciertos, fallos, expulsiones y expiraciones por consulta, más el tamaño actual.
+    """
+    with _lock:
+        return {
+            "entries": len(_entries),
+            "max_entries": MAX_ENTRIES,
+            "queries": {name: dict(counter, ttl=_ttls[name]) for name, counter in _stats.items()},
+        }
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import os
+import threading
+from collections import Counter
+import pydgraph
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.monitoring import ConnectionPoolListener
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+import metricas
+
+# Set logger
+log = logging.getLogger()
+
+# Configuración (variables de entorno); los clientes se crean la primera vez que se piden
+DGRAPH_URI = os.getenv('DGRAPH_URI', 'localhost:9080')
+DGRAPH_STUBS = int(os.getenv('DGRAPH_STUBS', '1'))
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+MONGODB_DB = os.getenv('MONGODB_DB', 'PFmongodb')
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '100'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_TIMEOUT_MS = int(os.getenv('MONGODB_TIMEOUT_MS', '5000'))
+CASSANDRA_CLUSTER_IPS = os.getenv('CASSANDRA_CLUSTER_IPS', 'localhost')
+CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'investments')
+CASSANDRA_REPLICATION_FACTOR = os.getenv('CASSANDRA_REPLICATION_FACTOR', '1')
+CASSANDRA_TIMEOUT = float(os.getenv('CASSANDRA_TIMEOUT', '10'))
+CASSANDRA_CONNECT_TIMEOUT = float(os.getenv('CASSANDRA_CONNECT_TIMEOUT', '5'))
+CASSANDRA_EXECUTOR_THREADS = int(os.getenv('CASSANDRA_EXECUTOR_THREADS', '2'))
+
+# Reentrante: la fábrica de la sesión de Cassandra pide el cluster con _get
+_lock = threading.RLock()
+_clients = {}
+
+
+class _PoolMonitor(ConnectionPoolListener):
+    """
+    Cuenta las conexiones abiertas y en uso de los pools de pymongo.
+    """
+    def __init__(self):
+        self.counts = Counter()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.counts["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.counts["open"] -= 1
+
+    def connection_check_out_started(self, event):
+        self.counts["waiting"] += 1
+
+    def connection_check_out_failed(self, event):
+        self.counts["waiting"] -= 1
+        self.counts["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        self.counts["waiting"] -= 1
+        self.counts["in_use"] += 1
+        self.counts["checkouts"] += 1
+
+    def connection_checked_in(self, event):
+        self.counts["in_use"] -= 1
+
+
+_mongo_monitor = _PoolMonitor()
+
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _mongo_options():
+    return {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGODB_TIMEOUT_MS,
+        "connectTimeoutMS": MONGODB_TIMEOUT_MS,
+        "event_listeners": [_mongo_monitor, metricas.MongoCommandListener()],
+    }
+
+
+def dgraph_client():
+    """
+    Cliente de Dgraph compartido; con DGRAPH_STUBS > 1 reparte las peticiones entre varios canales gRPC.
+    """
+    def crear():
+        log.info(f"Conectando a Dgraph en {DGRAPH_URI} ({DGRAPH_STUBS} canales)")
+        stubs = _clients["dgraph_stubs"] = [pydgraph.DgraphClientStub(DGRAPH_URI) for _ in range(DGRAPH_STUBS)]
+        return pydgraph.DgraphClient(*stubs)
+    return _get("dgraph", crear)
+
+
+def mongo_client():
+    def crear():
+        log.info(f"Conectando a MongoDB (pool de {MONGODB_MAX_POOL_SIZE} conexiones)")
+        return MongoClient(MONGODB_URI, **_mongo_options())
+    return _get("mongodb", crear)
+
+
+def mongo_database():
+    return mongo_client()[MONGODB_DB]
+
+
+def mongo_async_database():
+    """
+    Base de MongoDB con el cliente asíncrono (para el servicio HTTP); usa el mismo monitor de pool.
+    """
+    def crear():
+        return AsyncMongoClient(MONGODB_URI, **_mongo_options())
+    return _get("mongodb_async", crear)[MONGODB_DB]
+
+
+def cassandra_cluster():
+    def crear():
+        log.info(f"Conectando a Cassandra en {CASSANDRA_CLUSTER_IPS}")
+        perfil = ExecutionProfile(request_timeout=CASSANDRA_TIMEOUT)
+        return Cluster(CASSANDRA_CLUSTER_IPS.split(','), connect_timeout=CASSANDRA_CONNECT_TIMEOUT,
+                       executor_threads=CASSANDRA_EXECUTOR_THREADS,
+                       execution_profiles={EXEC_PROFILE_DEFAULT: perfil})
+    return _get("cassandra_cluster", crear)
+
+
+def cassandra_session():
+    """
+    Sesión de Cassandra compartida (sin keyspace; quien la usa hace set_keyspace tras crearlo).
+    """
+    def crear():
+        session = cassandra_cluster().connect()
+        session.add_request_init_listener(metricas.cassandra_request_listener)
+        return session
+    return _get("cassandra", crear)
+
+
+def utilizacion():
+    """
+    Estado de los pools que ya se abrieron: conexiones abiertas, en uso y en espera.
+    """
+    estado = {}
+    if "mongodb" in _clients or "mongodb_async" in _clients:
+        estado["mongodb"] = dict(_mongo_monitor.counts, max_pool_size=MONGODB_MAX_POOL_SIZE)
+    if "cassandra" in _clients:
+        estado["cassandra"] = {str(host): pool for host, pool in _clients["cassandra"].get_pool_state().items()}
+    if "dgraph" in _clients:
+        estado["dgraph"] = {"stubs": DGRAPH_STUBS}
+    return estado
+
+
+async def cerrar_async():
+    """
+    Cierra el cliente asíncrono de MongoDB en el bucle que lo usa y después el resto.
+    Es la forma de cerrar desde el servicio HTTP.
+    """
+    with _lock:
+        client = _clients.pop("mongodb_async", None)
+    if client is not None:
+        await client.close()
+    cerrar()
+
+
+def cerrar():
+    """
+    Cierra todos los clientes abiertos; el siguiente uso vuelve a conectar.
+    """
+    with _lock:
+        clients = dict(_clients)
+        _clients.clear()
+    for stub in clients.get("dgraph_stubs", []):
+        stub.close()
+    if "mongodb" in clients:
+        clients["mongodb"].close()
+    if "mongodb_async" in clients:
+        # Sin bucle en curso (por ejemplo, desde un script): se cierra en uno propio
+        try:
+            asyncio.run(clients["mongodb_async"].close())
+        except RuntimeError as e:
+            log.error(f"No se pudo cerrar el cliente asíncrono de MongoDB (usar cerrar_async): {e}")
+    if "cassandra_cluster" in clients:
+        clients["cassandra_cluster"].shutdown()
+    log.info("Conexiones cerradas")
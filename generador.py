@@ -1,10 +1,10 @@
+import argparse
 import csv
+import os
 import random
+from multiprocessing import Pool
 from faker import Faker
 
-# Inicializamos Faker para generar datos aleatorios
-faker = Faker()
-
 # Definir configuraciones para los datos
 CATEGORIAS = ["sushi", "italiana", "francesa", "mexicana", "china"]
 CIUDADES = ["Guadalajara", "Ciudad de Mexico", "Monterrey", "Cancun", "Tijuana"]
@@ -13,44 +13,163 @@ MESES = ["enero", "febrero", "marzo", "abril", "mayo", "junio",
 NUM_RESTAURANTES = 30
 NUM_USUARIOS = 50
 NUM_ZONAS = 5  # Número de zonas únicas
+SEED = 42
+CHUNK_SIZE = 10000  # Filas que se escriben de una vez
+
+HEADERS = {
+    "restaurantes": ["id", "nombre", "categoria", "rating", "ventas"],
+    "zonas": ["id", "nombre"],
+    "usuarios": ["id", "nombre", "email", "seguidores", "zona"],
+}
+
+
+def shard_path(output_dir, name, shard, num_shards):
+    """
+    Ruta del archivo de una entidad. Con un solo shard se conserva el nombre
+    original (restaurantes.csv); con varios, restaurantes.part-00000.csv, etc.
+    """
+    if num_shards == 1:
+        return os.path.join(output_dir, f"{name}.csv")
+    return os.path.join(output_dir, f"{name}.part-{shard:05d}.csv")
+
+
+def shard_files(name, output_dir="."):
+    """
+    Lista los archivos de una entidad en orden, ya sea el CSV único o sus partes.
+    """
+    single = os.path.join(output_dir, f"{name}.csv")
+    parts = sorted(
+        os.path.join(output_dir, f) for f in os.listdir(output_dir)
+        if f.startswith(f"{name}.part-") and f.endswith(".csv")
+    )
+    if parts:
+        return parts
+    return [single] if os.path.exists(single) else []
+
+
+def shard_range(total, shard, num_shards):
+    """
+    Rango de ids [inicio, fin) que le corresponde a un shard.
+    """
+    base, extra = divmod(total, num_shards)
+    start = shard * base + min(shard, extra)
+    end = start + base + (1 if shard < extra else 0)
+    return start + 1, end + 1
+
+
+def generar_zonas(num_zonas, seed):
+    rng = random.Random(f"{seed}-zonas")
+    nombres = rng.sample(CIUDADES, min(num_zonas, len(CIUDADES)))
+    # Si se piden más zonas que ciudades base, se agregan ciudades numeradas
+    nombres += [f"Ciudad {i}" for i in range(len(nombres) + 1, num_zonas + 1)]
+    return [{"id": i + 1, "nombre": nombre} for i, nombre in enumerate(nombres)]
+
+
+def generar_restaurantes(start, end, seed, shard):
+    rng = random.Random(f"{seed}-restaurantes-{shard}")
+    faker = Faker()
+    faker.seed_instance(f"{seed}-restaurantes-{shard}")
+    for i in range(start, end):
+        yield {
+            "id": i,
+            "nombre": faker.company(),
+            "categoria": rng.choice(CATEGORIAS),
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "ventas": [rng.randint(50000, 1000000) for _ in range(12)]  # Ventas para 12 meses
+        }
+
 
-# Generar las zonas (nombres de ciudades sin repetición)
-zonas = [{"id": i + 1, "nombre": ciudad} for i, ciudad in enumerate(random.sample(CIUDADES, NUM_ZONAS))]
-
-# Generar los restaurantes
-restaurantes = []
-for i in range(NUM_RESTAURANTES):
-    restaurante = {
-        "id": i + 1,
-        "nombre": faker.company(),
-        "categoria": random.choice(CATEGORIAS),
-        "rating": round(random.uniform(3.0, 5.0), 1),
-        "ventas": [random.randint(50000, 1000000) for _ in range(12)]  # Ventas para 12 meses
-    }
-    restaurantes.append(restaurante)
-
-# Generar los usuarios
-usuarios = []
-for i in range(NUM_USUARIOS):
-    usuario = {
-        "id": i + 1,
-        "nombre": faker.name(),
-        "email": faker.email(),
-        "seguidores": random.randint(1, 1000),
-        "zona": random.choice(zonas)["nombre"]  # Asignar zona aleatoria de las 5 ciudades
-    }
-    usuarios.append(usuario)
-
-# Función para escribir CSV
-def write_csv(file_name, data, header):
+def generar_usuarios(start, end, seed, shard, zonas):
+    rng = random.Random(f"{seed}-usuarios-{shard}")
+    faker = Faker()
+    faker.seed_instance(f"{seed}-usuarios-{shard}")
+    for i in range(start, end):
+        yield {
+            "id": i,
+            "nombre": faker.name(),
+            "email": faker.email(),
+            "seguidores": rng.randint(1, 1000),
+            "zona": rng.choice(zonas)["nombre"]  # Asignar zona aleatoria
+        }
+
+
+# Función para escribir CSV por bloques sin tener todo el conjunto en memoria
+def write_csv(file_name, data, header, chunk_size=CHUNK_SIZE):
+    count = 0
     with open(file_name, mode="w", newline="", encoding="utf-8") as file:
         writer = csv.DictWriter(file, fieldnames=header)
         writer.writeheader()
-        writer.writerows(data)
+        chunk = []
+        for row in data:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.writerows(chunk)
+                count += len(chunk)
+                chunk = []
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def generar_shard(args):
+    """
+    Genera un shard de restaurantes y de usuarios. Se ejecuta en un proceso aparte.
+    """
+    shard, num_shards, num_restaurantes, num_usuarios, zonas, seed, chunk_size, output_dir = args
+    start, end = shard_range(num_restaurantes, shard, num_shards)
+    n_restaurantes = write_csv(shard_path(output_dir, "restaurantes", shard, num_shards),
+                               generar_restaurantes(start, end, seed, shard),
+                               HEADERS["restaurantes"], chunk_size)
+    start, end = shard_range(num_usuarios, shard, num_shards)
+    n_usuarios = write_csv(shard_path(output_dir, "usuarios", shard, num_shards),
+                           generar_usuarios(start, end, seed, shard, zonas),
+                           HEADERS["usuarios"], chunk_size)
+    return n_restaurantes, n_usuarios
+
+
+def generar(num_restaurantes=NUM_RESTAURANTES, num_usuarios=NUM_USUARIOS, num_zonas=NUM_ZONAS,
+            seed=SEED, chunk_size=CHUNK_SIZE, shards=1, processes=None, output_dir="."):
+    """
+    Genera zonas.csv y los archivos de restaurantes y usuarios (uno o varios shards).
+    Con la misma semilla y número de shards el resultado es idéntico.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    zonas = generar_zonas(num_zonas, seed)
+    write_csv(os.path.join(output_dir, "zonas.csv"), zonas, HEADERS["zonas"], chunk_size)
+
+    tareas = [(shard, shards, num_restaurantes, num_usuarios, zonas, seed, chunk_size, output_dir)
+              for shard in range(shards)]
+    if shards == 1 or processes == 1:
+        resultados = [generar_shard(tarea) for tarea in tareas]
+    else:
+        with Pool(processes or min(shards, os.cpu_count() or 1)) as pool:
+            resultados = pool.map(generar_shard, tareas)
+
+    total_restaurantes = sum(r for r, _ in resultados)
+    total_usuarios = sum(u for _, u in resultados)
+    return total_restaurantes, total_usuarios, len(zonas)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Genera los CSV de restaurantes, zonas y usuarios.")
+    parser.add_argument("--restaurantes", type=int, default=NUM_RESTAURANTES, help="Número de restaurantes")
+    parser.add_argument("--usuarios", type=int, default=NUM_USUARIOS, help="Número de usuarios")
+    parser.add_argument("--zonas", type=int, default=NUM_ZONAS, help="Número de zonas")
+    parser.add_argument("--seed", type=int, default=SEED, help="Semilla para datos reproducibles")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Filas escritas por bloque")
+    parser.add_argument("--shards", type=int, default=1, help="Número de archivos part-N por entidad")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos en paralelo (por defecto, uno por shard)")
+    parser.add_argument("--output-dir", default=".", help="Directorio de salida")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    restaurantes, usuarios, zonas = generar(args.restaurantes, args.usuarios, args.zonas, args.seed,
+                                            args.chunk_size, args.shards, args.procesos, args.output_dir)
+    print(f"Archivos CSV generados exitosamente: {restaurantes} restaurantes, "
+          f"{usuarios} usuarios, {zonas} zonas en {args.shards} shard(s).")
 
-# Escribir los archivos CSV
-write_csv("restaurantes.csv", restaurantes, ["id", "nombre", "categoria", "rating", "ventas"])
-write_csv("zonas.csv", zonas, ["id", "nombre"])
-write_csv("usuarios.csv", usuarios, ["id", "nombre", "email", "seguidores", "zona"])
 
-"Archivos CSV generados exitosamente."
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import ast
+import csv
+import logging
+import queue
+import threading
+import time
+import cache
+import modeldgraph
+import modelcassandra
+import populate
+
+# Set logger
+log = logging.getLogger()
+
+# Registros en espera por cada destino; si un destino se atrasa, el lector se detiene
+QUEUE_SIZE = 1000
+
+# Marca de fin de flujo en las colas
+_FIN = object()
+
+
+def leer_csv(file_paths):
+    """
+    Lee uno o varios CSV (por ejemplo, las partes generadas con --shards) fila por fila.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    for file_path in file_paths:
+        with open(file_path, mode="r", encoding="utf-8") as file:
+            yield from csv.DictReader(file)
+
+
+def parse_restaurante(row):
+    """
+    Convierte una fila de restaurantes.csv en el registro compartido por todos los destinos.
+    """
+    ventas = ast.literal_eval(row.get("ventas") or "[]")
+    return {
+        "id": int(row["id"]),
+        "nombre": row["nombre"],
+        "categoria": row["categoria"],
+        "rating": float(row["rating"]),
+        "ventas": [int(v) for v in ventas],
+    }
+
+
+def _consumir(cola, estado=None):
+    """
+    Genera los registros de la cola hasta la marca de fin; si se pasa estado, anota
+    estado["fin"] = True al recibirla.
+    """
+    while True:
+        record = cola.get()
+        if record is _FIN:
+            if estado is not None:
+                estado["fin"] = True
+            return
+        yield record
+
+
+def _contar(records, stats):
+    for record in records:
+        stats["records"] += 1
+        yield record
+
+
+# Destinos: cada uno recibe el flujo de registros de restaurantes y lo escribe en su base
+
+def dgraph_sink(client, usuarios, zonas):
+    def cargar(restaurantes):
+        usuarios_nodos = [modeldgraph.usuario_nodo(u) for u in usuarios]
+        zonas_nodos = [modeldgraph.zona_nodo(z) for z in zonas]
+        restaurantes_nodos = [modeldgraph.restaurante_nodo(r) for r in restaurantes]
+        aristas = modeldgraph.generar_aristas(usuarios_nodos, restaurantes_nodos, zonas_nodos)
+        modeldgraph.agregar_datos(client, usuarios_nodos, restaurantes_nodos, zonas_nodos, aristas=aristas)
+    return cargar
+
+
+def mongo_sink(database, zonas):
+    def cargar(restaurantes):
+        populate.clear_collections(database)
+        zona_ids = [zona["id"] for zona in populate.insert_zonas(database, zonas)]
+        populate.insert_restaurantes(database, restaurantes, zona_ids)
+        populate.create_indexes(database)
+        cache.invalidate("mongodb")
+    return cargar
+
+
+def cassandra_sink(session):
+    def cargar(restaurantes):
+        records = ({"nombre": r["nombre"], "categoria": r["categoria"], "ventas": [float(v) for v in r["ventas"]]}
+                   for r in restaurantes)
+        # Se escribe en una generación nueva de tablas; las consultas leen la anterior hasta el final
+        _, errores = modelcassandra.reload_sales_records(session, records)
+        if errores:
+            raise RuntimeError(f"{len(errores)} lotes fallidos en Cassandra; se mantienen los datos anteriores")
+    return cargar
+
+
+def ejecutar(restaurantes_csv, sinks, queue_size=QUEUE_SIZE):
+    """
+    Lee el CSV de restaurantes una sola vez y reparte cada registro a todos los destinos,
+    que se ejecutan en hilos concurrentes. Devuelve el reporte por destino.
+    """
+    colas = {name: queue.Queue(maxsize=queue_size) for name in sinks}
+    reporte = {}
+    inicio = time.perf_counter()
+
+    def worker(name, cargar):
+        stats = {"records": 0}
+        estado = {"fin": False}
+        error = None
+        try:
+            cargar(_contar(_consumir(colas[name], estado), stats))
+        except Exception as e:
+            error = str(e)
+            log.error(f"Error en el destino {name}: {error}")
+        finally:
+            # Si el destino terminó (con error o sin él) antes de la marca de fin, se sigue
+            # vaciando su cola para no bloquear al lector
+            if not estado["fin"]:
+                if error is None:
+                    log.warning(f"El destino {name} terminó sin consumir todos los registros")
+                for _ in _consumir(colas[name]):
+                    pass
+            elapsed = time.perf_counter() - inicio
+            reporte[name] = {
+                "records": stats["records"],
+                "seconds": elapsed,
+                "records_per_sec": stats["records"] / elapsed if elapsed > 0 else 0.0,
+                "error": error,
+            }
+
+    hilos = [threading.Thread(target=worker, args=(name, cargar), name=f"sink-{name}")
+             for name, cargar in sinks.items()]
+    for hilo in hilos:
+        hilo.start()
+
+    for line_number, row in enumerate(leer_csv(restaurantes_csv), start=2):
+        try:
+            record = parse_restaurante(row)
+        except (ValueError, SyntaxError, KeyError) as e:
+            log.error(f"Fila {line_number} de restaurantes no válida: {e}")
+            continue
+        for cola in colas.values():
+            cola.put(record)
+    for cola in colas.values():
+        cola.put(_FIN)
+
+    for hilo in hilos:
+        hilo.join()
+    return reporte
+
+
+def cargar_todo(dgraph_client, mongo_database, cassandra_session, restaurantes_csv="restaurantes.csv",
+                usuarios_csv="usuarios.csv", zonas_csv="zonas.csv", extra_sinks=None):
+    """
+    Carga los tres almacenes a partir de una sola lectura de cada CSV. extra_sinks agrega
+    destinos {nombre: cargar} al mismo flujo de restaurantes.
+    """
+    log.info("Iniciando ingesta compartida para Dgraph, MongoDB y Cassandra")
+    zonas = list(leer_csv(zonas_csv))
+    usuarios = list(leer_csv(usuarios_csv))
+
+    sinks = {
+        "dgraph": dgraph_sink(dgraph_client, usuarios, zonas),
+        "mongodb": mongo_sink(mongo_database, zonas),
+        "cassandra": cassandra_sink(cassandra_session),
+    }
+    sinks.update(extra_sinks or {})
+    reporte = ejecutar(restaurantes_csv, sinks)
+
+    print("Resultados de la ingesta:")
+    for name, stats in reporte.items():
+        estado = f"ERROR: {stats['error']}" if stats["error"] else "OK"
+        print(f"- {name}: {stats['records']} registros en {stats['seconds']:.2f}s "
+              f"({stats['records_per_sec']:.1f} registros/seg) {estado}")
+        log.info(f"Ingesta {name}: {stats['records']} registros, {stats['records_per_sec']:.1f} registros/seg, {estado}")
+    return reporte
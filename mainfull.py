@@ -1,20 +1,11 @@
-import os
 import logging
-import pydgraph
-from pymongo import MongoClient
-from cassandra.cluster import Cluster
+import conexiones
+import metricas
 import modeldgraph
 import modelpython
 import modelcassandra
-import populate
-
-# Configuración de URLs y constantes
-DGRAPH_URI = os.getenv('DGRAPH_URI', 'localhost:9080')
-MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-CASSANDRA_CLUSTER_IPS = os.getenv('CASSANDRA_CLUSTER_IPS', 'localhost')
-CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'investments')
-CASSANDRA_REPLICATION_FACTOR = os.getenv('CASSANDRA_REPLICATION_FACTOR', '1')
-DB_NAME = "PFmongodb"
+import ingesta
+import sincronizacion
 
 # Configurar el logger
 log = logging.getLogger()
@@ -32,7 +23,8 @@ def print_main_menu():
         3: "Consultar de seguidores y restaurantes",
         4: "Consultar de rating de restaurantes",
         5: "Consultar de ventas",
-        6: "Salir"
+        6: "Sincronizar cambios de los CSV (solo filas nuevas, modificadas o eliminadas)",
+        7: "Salir"
     }
     for key in mm_options.keys():
         print(key, '--', mm_options[key])
@@ -76,50 +68,135 @@ def print_monthly_sales_menu():
         3: "Buscar por Restaurante", # input = restaurante / output = cada total de ventas mensual
         4: "Buscar por Restaurante y Mes", # input = restaurante, mes / output = el total de ese restaurante ese mes
         5: "Buscar por rango de ventas", # input = min, max / output = restaurantes que han ganado en ese rango y el mes en el que lo hicieron
-        6: "Salir" 
+        6: "Total anual por Restaurante", # input = restaurante / output = suma de sus 12 meses
+        7: "Totales por Mes", # input = mes (opcional) / output = suma de todos los restaurantes por mes
+        8: "Totales por Categoría", # input = categoría, mes (opcional) / output = suma de la categoría por mes
+        9: "Salir" 
     }
     for key in thm_options.keys():
         print('    ', key, '--', thm_options[key])
 
 
-def main():
-    # Configuración de clientes
-    log.info("Conectando a las bases de datos...")
-    # Configuración de Dgraph
-    client_stub = pydgraph.DgraphClientStub(DGRAPH_URI)
-    dgraph_client = pydgraph.DgraphClient(client_stub)
-    modeldgraph.configurar_esquema(dgraph_client)
-
-    # Configuración de MongoDB
-    mongo_client = MongoClient(MONGODB_URI)
-    mongo_database = mongo_client[DB_NAME]
-
-    # Configuración de Cassandra
-    cluster = Cluster(CASSANDRA_CLUSTER_IPS.split(','))
-    cassandra_session = cluster.connect()
-    modelcassandra.create_keyspace(cassandra_session, CASSANDRA_KEYSPACE, CASSANDRA_REPLICATION_FACTOR)
-    cassandra_session.set_keyspace(CASSANDRA_KEYSPACE)
-    modelcassandra.create_schema(cassandra_session)
+# Impresión de resultados: las consultas devuelven filas y aquí solo se muestran
+def print_top_followers(restaurants, order):
+    if not restaurants:
+        print("No se encontraron restaurantes.")
+        return
+    print('-'*40)
+    print(f"Top 3 restaurantes con {'menor' if order == 'desc' else 'mayor'} número de seguidores:")
+    for idx, restaurant in enumerate(restaurants, start=1):
+        print(f"{idx}. {restaurant.get('restaurant_name', 'Desconocido')} - {restaurant.get('followers', 0)} seguidores")
+    print('-'*40)
+
+
+def print_restaurants_by_city(restaurants, city_name):
+    found_records = False
+    for idx, restaurant in enumerate(restaurants, start=1):
+        if not found_records:
+            found_records = True
+            print(f"Restaurantes en {city_name}:")
+            print("-" * 40)
+        print(f"{idx}. {restaurant.name} - {restaurant.followers} seguidores")
+    if found_records:
+        print("-" * 40)
+    else:
+        print(f"No se encontraron restaurantes en la ciudad: {city_name}")
+
+
+def print_zone_rankings(zonas):
+    for zona in zonas:
+        print(f"Zona: {zona.nombre}")
+        for restaurante in zona.restaurantes:
+            print(f"- {restaurante.nombre} (Rating: {restaurante.rating})")
+
+
+def print_category_ranking(restaurantes, category):
+    found_records = False
+    for restaurante in restaurantes:
+        if not found_records:
+            found_records = True
+            print(f"Top 3 restaurantes en la categoría '{category}':")
+        print(f"- {restaurante.nombre} (Rating: {restaurante.rating})")
+    if not found_records:
+        print(f"No se encontraron restaurantes en la categoría '{category}'.")
+
+
+def print_sales(sales, show_month=True, show_restaurant=True, current=False, empty_message=None):
+    found_records = False
+    for sale in sales:
+        found_records = True
+        if show_month:
+            print(f"=== Mes{' Actual' if current else ''}: {sale.month} ===")
+        if show_restaurant:
+            print(f"----------- Restaurante: {sale.restaurant}")
+        print(f"----------- Total Ventas: {sale.total_sales:,.2f}")
+        print(f"------------------------------------------")
+    if not found_records and empty_message:
+        print(empty_message)
+
+
+def print_month_totals(totals):
+    found_records = False
+    for total in totals:
+        found_records = True
+        print(f"- Mes: {total.month}")
+        print(f"- Total Ventas: {total.total_sales:,.2f}")
+        print(f"------------------------------------------")
+    if not found_records:
+        print("No se encontraron registros de ventas.")
+
 
+# Cada base se conecta y verifica su versión de esquema la primera vez que se usa
+_esquemas_verificados = set()
+
+
+def dgraph_client():
+    client = conexiones.dgraph_client()
+    if "dgraph" not in _esquemas_verificados:
+        modeldgraph.ensure_schema(client)
+        _esquemas_verificados.add("dgraph")
+    return client
+
+
+def mongo_database():
+    database = conexiones.mongo_database()
+    if "mongodb" not in _esquemas_verificados:
+        modelpython.ensure_schema(database)
+        _esquemas_verificados.add("mongodb")
+    return database
+
+
+def cassandra_session():
+    session = conexiones.cassandra_session()
+    if "cassandra" not in _esquemas_verificados:
+        modelcassandra.ensure_schema(session, conexiones.CASSANDRA_KEYSPACE, conexiones.CASSANDRA_REPLICATION_FACTOR)
+        modelcassandra.prepare_statements(session)
+        _esquemas_verificados.add("cassandra")
+    return session
+
+
+def main():
     while True:
         print_main_menu()
         try:
             option = int(input("Ingrese su opción: "))
             if option == 1:
                 # Crear datos en todas las bases
-                usuarios = modeldgraph.procesar_usuarios("usuarios.csv")
-                restaurantes = modeldgraph.procesar_restaurantes("restaurantes.csv")
-                zonas = modeldgraph.procesar_zonas("zonas.csv")
-                modeldgraph.crear_relaciones(usuarios, restaurantes, zonas)
-                modeldgraph.agregar_datos(dgraph_client, usuarios, restaurantes, zonas)
-                populate.main()
-                modelcassandra.load_csv_to_cassandra(cassandra_session, "restaurantes.csv")
+                # La sincronización incremental parte de lo que se acaba de cargar: el manifiesto
+                # se arma con las mismas filas que recibieron las bases
+                registros = {}
+                reporte = ingesta.cargar_todo(dgraph_client(), mongo_database(), cassandra_session(),
+                                              extra_sinks={"manifiesto": sincronizacion.manifiesto_sink(registros)})
+                sincronizacion.registrar_carga_completa(reporte, registros)
                 print("Datos creados en todas las bases de datos.")
             elif option == 2:
                 # Eliminar datos de todas las bases
-                modeldgraph.drop_all(dgraph_client)
-                modelpython.delete_all_data(mongo_database)
-                modelcassandra.drop_data(cassandra_session)
+                modeldgraph.drop_all(dgraph_client())
+                modelpython.delete_all_data(mongo_database())
+                modelcassandra.drop_data(cassandra_session())
+                # drop_all también borra el esquema y la versión guardada en Dgraph
+                _esquemas_verificados.discard("dgraph")
+                sincronizacion.borrar_manifiesto()
                 print("Datos eliminados de todas las bases de datos.")
             elif option == 3:
                 # Submenú de Dgraph
@@ -127,64 +204,91 @@ def main():
                 dg_option = int(input("Ingrese su opción: "))
                 if dg_option == 1:
                     order = input("¿Top 3 con más seguidores (asc) o con menos seguidores (desc)?: ").lower()
-                    modeldgraph.Top_3_restaurants_by_followers(dgraph_client, order)
+                    # En este menú "asc" muestra los de mayor número de seguidores
+                    direction = "desc" if order == "asc" else "asc"
+                    top = modeldgraph.top_restaurants_by_followers(dgraph_client(), 3, direction)
+                    print_top_followers(top["items"], order)
                 elif dg_option == 2:
                     city_name = input("Ingrese el nombre de la ciudad: ")
-                    modeldgraph.get_restaurants_by_city(dgraph_client, city_name)
+                    print_restaurants_by_city(modeldgraph.get_restaurants_by_city(dgraph_client(), city_name),
+                                              modeldgraph.normalizeString(city_name))
             elif option == 4:
                 # Submenú de MongoDB
                 print_mongo_menu()
                 mongo_option = int(input("Ingrese su opción: "))
                 if mongo_option == 1:
                     zone_name = input("Ingrese el nombre de la zona (o deje en blanco para todos): ")
-                    modelpython.top_restaurants_by_zone(mongo_database, show_all=not bool(zone_name), zone_name=zone_name)
+                    print_zone_rankings(modelpython.leaderboard_by_zone(mongo_database(), zone_name or None))
                 elif mongo_option == 2:
                     category = input("Ingrese la categoría: ")
-                    modelpython.top_restaurants_by_category(mongo_database, category)
+                    print_category_ranking(modelpython.leaderboard_by_category(mongo_database(), category), category)
             elif option == 5:
                 # Submenú de Cassandra
                 print_cassandra_menu()
                 cass_option = int(input("Ingrese su opción: "))
                 if cass_option == 1:
-                    modelcassandra.get_current_month_sales(cassandra_session)
+                    print_sales(modelcassandra.get_current_month_sales(cassandra_session()), current=True)
                 elif cass_option == 2:
-                    modelcassandra.get_current_month_sales_top(cassandra_session)
+                    print_sales(modelcassandra.get_current_month_sales_top(cassandra_session()), current=True)
                 elif cass_option == 3:
                     # Menú mensual de Cassandra
                     print_monthly_sales_menu()
                     tv_option = int(input('Ingrese su preferencia de filtro: '))
                     if tv_option == 1:
-                        modelcassandra.get_all_sales(cassandra_session)
+                        print_sales(modelcassandra.get_all_sales(cassandra_session()))
                     elif tv_option == 2:
                         month = input('Mes: ')
-                        modelcassandra.get_sales_by_month(cassandra_session, month)
+                        month_en = modelcassandra.normalize_month(month)
+                        print(f"\n=== Mes: {month_en} ===")
+                        print_sales(modelcassandra.get_sales_by_month(cassandra_session(), month_en), show_month=False,
+                                    empty_message=f"No se encontraron registros de ventas para {month_en}")
                     elif tv_option == 3:
                         restaurant = input('Restaurante: ')
-                        modelcassandra.get_sales_by_restaurant(cassandra_session, restaurant)
+                        print(f"=== Restaurante: {restaurant} ===")
+                        print_sales(modelcassandra.get_sales_by_restaurant(cassandra_session(), restaurant),
+                                    show_restaurant=False,
+                                    empty_message=f"No se encontraron registros de ventas para el restaurante: {restaurant}")
                     elif tv_option == 4:
                         restaurant = input('Restaurante: ')
                         month = input('Mes: ')
-                        modelcassandra.get_sales_by_restaurant_and_month(cassandra_session, restaurant, month)
+                        print_sales(modelcassandra.get_sales_by_restaurant_and_month(cassandra_session(), restaurant, month),
+                                    empty_message="No se encontraron ventas para el restaurante y mes indicados.")
                     elif tv_option == 5:
                         min_value = input('Ventas mínimas: ')
                         max_value = input('Ventas máximas: ')
-                        modelcassandra.get_sales_by_sales_range(cassandra_session, min_value, max_value)
+                        print_sales(modelcassandra.get_sales_by_sales_range(cassandra_session(), min_value, max_value))
+                    elif tv_option == 6:
+                        restaurant = input('Restaurante: ')
+                        total = modelcassandra.get_restaurant_yearly_total(cassandra_session(), restaurant)
+                        if total is None:
+                            print(f"No se encontraron registros de ventas para el restaurante: {restaurant}")
+                        else:
+                            print(f"=== Restaurante: {restaurant} ===")
+                            print(f"----------- Total Anual: {total:,.2f}")
+                    elif tv_option == 7:
+                        month = input('Mes (o deje en blanco para todos): ')
+                        print_month_totals(modelcassandra.get_monthly_totals(cassandra_session(), month or None))
+                    elif tv_option == 8:
+                        category = input('Categoría: ')
+                        month = input('Mes (o deje en blanco para todos): ')
+                        print(f"=== Categoría: {category} ===")
+                        print_month_totals(modelcassandra.get_category_sales(cassandra_session(), category, month or None))
             elif option == 6:
+                # Aplicar solo el delta respecto del manifiesto de la última sincronización
+                sincronizacion.sincronizar(dgraph_client(), mongo_database(), cassandra_session())
+            elif option == 7:
                 print("Cerrando conexiones...")
-                close_client_stub(client_stub)
-                cluster.shutdown()
-                mongo_client.close()
+                log.info(f"Uso de los pools de conexiones: {conexiones.utilizacion()}")
+                metricas.exportar()
+                conexiones.cerrar()
                 print("Adiós.")
                 break
             else:
                 print("Opción no válida.")
         except ValueError as e:
             print("Entrada no válida:", e)
-
-
-# Dgraph: Cerrar cliente stub
-def close_client_stub(client_stub):
-    client_stub.close()
+        except LookupError as e:
+            print(e.args[0] if e.args else e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from pymongo import monitoring
+
+# Set logger
+log = logging.getLogger()
+
+# Límites (segundos) de los buckets del histograma de latencia
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Archivo donde se exportan las métricas en formato de texto de Prometheus
+METRICS_FILE = os.getenv('METRICS_FILE', 'metricas.prom')
+
+_lock = threading.Lock()
+_series = {}          # (almacen, operacion) -> métricas acumuladas
+_fuera = Counter()    # (almacen, "round_trips"|"bytes") de peticiones hechas fuera de una operación medida
+_actual = contextvars.ContextVar("medicion", default=None)
+
+
+class Medicion:
+    """
+    Contadores de una llamada en curso. Los hooks de los drivers suman aquí las idas y
+    vueltas y los bytes; al terminar, los totales también se suman a la operación que la llamó.
+    """
+    def __init__(self, almacen, operacion, padre=None):
+        self.almacen = almacen
+        self.operacion = operacion
+        self.padre = padre
+        self.filas = 0
+        self.bytes = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def agregar(self, filas=0, bytes=0, round_trips=0):
+        with self._lock:
+            self.filas += filas
+            self.bytes += bytes
+            self.round_trips += round_trips
+
+
+def _serie(almacen, operacion):
+    serie = _series.get((almacen, operacion))
+    if serie is None:
+        serie = _series[(almacen, operacion)] = {
+            "buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0,
+            "errores": 0, "filas": 0, "bytes": 0, "round_trips": 0,
+        }
+    return serie
+
+
+def _terminar(medicion, segundos, error):
+    with _lock:
+        serie = _serie(medicion.almacen, medicion.operacion)
+        serie["count"] += 1
+        serie["sum"] += segundos
+        serie["errores"] += int(error)
+        serie["filas"] += medicion.filas
+        serie["bytes"] += medicion.bytes
+        serie["round_trips"] += medicion.round_trips
+        for i, limite in enumerate(BUCKETS):
+            if segundos <= limite:
+                serie["buckets"][i] += 1
+                break
+    if medicion.padre is not None:
+        medicion.padre.agregar(bytes=medicion.bytes, round_trips=medicion.round_trips)
+
+
+def registrar(almacen, bytes=0, round_trips=1, medicion=None):
+    """
+    Anota una ida y vuelta al servidor (y los bytes recibidos) en la operación en curso.
+    """
+    medicion = medicion or _actual.get()
+    if medicion is None:
+        with _lock:
+            _fuera[(almacen, "round_trips")] += round_trips
+            _fuera[(almacen, "bytes")] += bytes
+    else:
+        medicion.agregar(bytes=bytes, round_trips=round_trips)
+
+
+def actual():
+    return _actual.get()
+
+
+def propagar(func):
+    """
+    Envuelve func para que, al ejecutarse en otro hilo (ThreadPoolExecutor, Thread), sus
+    peticiones se sumen a la operación que estaba en curso al crearla.
+    """
+    contexto = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return contexto.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def medir(almacen, operacion):
+    """
+    Mide un bloque como una llamada a `operacion`; el objeto devuelto permite sumar filas.
+    """
+    medicion = Medicion(almacen, operacion, _actual.get())
+    token = _actual.set(medicion)
+    inicio = time.perf_counter()
+    error = False
+    try:
+        yield medicion
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _actual.reset(token)
+        _terminar(medicion, time.perf_counter() - inicio, error)
+
+
+def _medir_generador(func, almacen, operacion, args, kwargs):
+    # Solo se cuenta el tiempo dentro de next(), no el que el consumidor tarda entre filas
+    medicion = None
+    gen = None
+    segundos = 0.0
+    error = False
+    try:
+        while True:
+            if medicion is None:
+                medicion = Medicion(almacen, operacion, _actual.get())
+            token = _actual.set(medicion)
+            inicio = time.perf_counter()
+            try:
+                if gen is None:
+                    gen = func(*args, **kwargs)
+                item = next(gen)
+            except StopIteration:
+                return
+            finally:
+                segundos += time.perf_counter() - inicio
+                _actual.reset(token)
+            medicion.agregar(filas=1)
+            yield item
+    except GeneratorExit:
+        raise
+    except BaseException:
+        error = True
+        raise
+    finally:
+        if gen is not None:
+            gen.close()
+        if medicion is not None:
+            _terminar(medicion, segundos, error)
+
+
+def instrumentado(almacen, filas=None):
+    """
+    Decorador para consultas y cargas de los modelos: registra latencia, errores, filas,
+    bytes e idas y vueltas al servidor bajo el nombre de la función.
+
+    En funciones generadoras las filas son los elementos generados; en las demás se
+    calculan con filas(resultado) si se indica.
+    """
+    def decorator(func):
+        operacion = func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return _medir_generador(func, almacen, operacion, args, kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with medir(almacen, operacion) as medicion:
+                    resultado = func(*args, **kwargs)
+                    if filas is not None:
+                        medicion.agregar(filas=filas(resultado))
+                    return resultado
+        return wrapper
+    return decorator
+
+
+# Hooks de los drivers
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Cuenta cada comando de pymongo como una ida y vuelta. No mide bytes: el evento no trae
+    el tamaño de la respuesta y volver a codificarla con bson costaría en cada comando.
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        registrar("mongodb")
+
+    def failed(self, event):
+        registrar("mongodb")
+
+
+def cassandra_request_listener(response_future):
+    """
+    Listener de Session.add_request_init_listener: cuenta una ida y vuelta por página.
+    La operación se captura aquí porque los callbacks corren en el hilo del driver.
+    """
+    medicion = _actual.get()
+
+    def pagina(rows):
+        registrar("cassandra", medicion=medicion)
+
+    def error(exc):
+        registrar("cassandra", medicion=medicion)
+
+    response_future.add_callbacks(pagina, error)
+
+
+# Exportación
+def snapshot():
+    with _lock:
+        return {
+            "operaciones": {f"{almacen}.{operacion}": dict(serie, buckets=list(serie["buckets"]))
+                            for (almacen, operacion), serie in _series.items()},
+            "fuera_de_operacion": {f"{almacen}.{campo}": valor for (almacen, campo), valor in _fuera.items()},
+        }
+
+
+def _etiquetas(almacen, operacion, **extra):
+    pares = {"almacen": almacen, "operacion": operacion, **extra}
+    return "{" + ",".join(f'{clave}="{valor}"' for clave, valor in pares.items()) + "}"
+
+
+def texto_prometheus():
+    """
+    Métricas acumuladas en formato de texto de Prometheus (0.0.4).
+    """
+    with _lock:
+        series = sorted((clave, dict(serie, buckets=list(serie["buckets"]))) for clave, serie in _series.items())
+        fuera = dict(_fuera)
+
+    lineas = [
+        "# HELP bdnr_operacion_segundos Latencia de las consultas y cargas de los modelos.",
+        "# TYPE bdnr_operacion_segundos histogram",
+    ]
+    for (almacen, operacion), serie in series:
+        acumulado = 0
+        for limite, valor in zip(BUCKETS, serie["buckets"]):
+            acumulado += valor
+            lineas.append(f"bdnr_operacion_segundos_bucket{_etiquetas(almacen, operacion, le=limite)} {acumulado}")
+        lineas.append(f"bdnr_operacion_segundos_bucket{_etiquetas(almacen, operacion, le='+Inf')} {serie['count']}")
+        lineas.append(f"bdnr_operacion_segundos_sum{_etiquetas(almacen, operacion)} {serie['sum']}")
+        lineas.append(f"bdnr_operacion_segundos_count{_etiquetas(almacen, operacion)} {serie['count']}")
+
+    contadores = [
+        ("errores", "Llamadas que terminaron con excepción."),
+        ("filas", "Filas o documentos devueltos o escritos."),
+        ("bytes", "Bytes de respuesta JSON de Dgraph."),
+        ("round_trips", "Idas y vueltas al servidor (páginas, comandos o peticiones gRPC)."),
+    ]
+    for campo, ayuda in contadores:
+        lineas.append(f"# HELP bdnr_operacion_{campo}_total {ayuda}")
+        lineas.append(f"# TYPE bdnr_operacion_{campo}_total counter")
+        for (almacen, operacion), serie in series:
+            lineas.append(f"bdnr_operacion_{campo}_total{_etiquetas(almacen, operacion)} {serie[campo]}")
+
+    lineas.append("# HELP bdnr_driver_round_trips_total Idas y vueltas hechas fuera de una operación medida.")
+    lineas.append("# TYPE bdnr_driver_round_trips_total counter")
+    for (almacen, campo), valor in sorted(fuera.items()):
+        if campo == "round_trips":
+            lineas.append(f'bdnr_driver_round_trips_total{{almacen="{almacen}"}} {valor}')
+    return "\n".join(lineas) + "\n"
+
+
+def exportar(path=METRICS_FILE):
+    """
+    Escribe las métricas en un archivo de texto de Prometheus (por ejemplo, para el
+    textfile collector de node_exporter). La escritura es atómica.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(texto_prometheus())
+    os.replace(tmp_path, path)
+    log.info(f"Métricas exportadas a {path}")
+
+
+def reiniciar():
+    with _lock:
+        _series.clear()
+        _fuera.clear()
@@ -1,12 +1,65 @@
 #!/usr/bin/env python3
 import logging
 from datetime import datetime, timedelta
+from decimal import Decimal
 import uuid
 import csv
+import ast
+import json
+import os
+import heapq
+import itertools
+import queue
+import threading
+import time
+import re
+import weakref
+from collections import Counter, namedtuple
+from cassandra import InvalidRequest
+from cassandra.policies import HostStateListener
+from cassandra.query import BatchStatement, BatchType
+import cache
+import metricas
 
 # Set logger
 log = logging.getLogger()
 
+# Meses en orden para mapear índices de ventas
+MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+# Fila de ventas devuelta por todas las consultas
+Sale = namedtuple('Sale', ['month', 'restaurant', 'total_sales'])
+MonthTotal = namedtuple('MonthTotal', ['month', 'total_sales'])
+CategoryMonthTotal = namedtuple('CategoryMonthTotal', ['category', 'month', 'total_sales'])
+
+# Nombres de mes aceptados (español e inglés) a su nombre en la base
+MONTH_MAP = {
+    'enero': 'January', 'febrero': 'February', 'marzo': 'March',
+    'abril': 'April', 'mayo': 'May', 'junio': 'June',
+    'julio': 'July', 'agosto': 'August', 'septiembre': 'September',
+    'octubre': 'October', 'noviembre': 'November', 'diciembre': 'December',
+    **{month.lower(): month for month in MONTH_ORDER}
+}
+
+# Número máximo de peticiones asíncronas en vuelo durante la carga
+DEFAULT_MAX_IN_FLIGHT = 128
+
+# Filas por página al leer resultados
+DEFAULT_FETCH_SIZE = 1000
+
+# Rango de tokens del particionador Murmur3 y división por defecto del escaneo paralelo
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+DEFAULT_SCAN_SPLITS = 64
+DEFAULT_SCAN_WORKERS = 8
+
+# Máximo de sentencias por lote UNLOGGED (mantiene los lotes bajo el umbral de advertencia)
+DEFAULT_BATCH_SIZE = 50
+
+# Restaurantes cuyas ventas guardadas se leen juntas antes de sobrescribirlas
+PREVIOUS_CHUNK_SIZE = 500
+
 CREATE_KEYSPACE = """
         CREATE KEYSPACE IF NOT EXISTS {}
         WITH replication = {{ 'class': 'SimpleStrategy', 'replication_factor': {} }}
@@ -39,6 +92,129 @@ CREATE_RESTAURANT_FILTERED_SALES_TABLE = """
     ) WITH CLUSTERING ORDER BY (total_sales DESC, restaurant ASC)
 """
 
+# Tablas de agregados mantenidas durante la carga. category guarda la categoría con la que se
+# sumaron las ventas del restaurante, para restarlas bien si una carga lo sobrescribe
+CREATE_RESTAURANT_YEARLY_TABLE = """
+    CREATE TABLE IF NOT EXISTS sales_yearly_by_restaurant (
+        restaurant TEXT,
+        total_sales DECIMAL,
+        category TEXT,
+        PRIMARY KEY ((restaurant))
+    )
+"""
+
+# Migración a la versión 3 de las tablas creadas antes (category)
+ADD_YEARLY_CATEGORY = """
+    ALTER TABLE sales_yearly_by_restaurant ADD category TEXT
+"""
+
+# Una sola partición (bucket) con los 12 totales mensuales
+CREATE_MONTHLY_TOTALS_TABLE = """
+    CREATE TABLE IF NOT EXISTS sales_totals_by_month (
+        bucket TEXT,
+        month TEXT,
+        total_sales DECIMAL,
+        PRIMARY KEY ((bucket), month)
+    )
+"""
+
+CREATE_CATEGORY_MONTHLY_TABLE = """
+    CREATE TABLE IF NOT EXISTS sales_by_category_month (
+        category TEXT,
+        month TEXT,
+        total_sales DECIMAL,
+        PRIMARY KEY ((category), month)
+    )
+"""
+
+# Tablas de ventas. Cada recarga completa escribe un juego nuevo (una generación) con el
+# sufijo _g<n>; la generación 0 usa los nombres sin sufijo.
+SALES_TABLES = ['sales_by_restaurant', 'sales_by_month', 'sales_by_total',
+                'sales_yearly_by_restaurant', 'sales_totals_by_month', 'sales_by_category_month']
+
+CREATE_SALES_TABLES = [
+    CREATE_RESTAURANT_SALES_TABLE,
+    CREATE_MONTHLY_SALES_TABLE,
+    CREATE_RESTAURANT_FILTERED_SALES_TABLE,
+    CREATE_RESTAURANT_YEARLY_TABLE,
+    CREATE_MONTHLY_TOTALS_TABLE,
+    CREATE_CATEGORY_MONTHLY_TABLE,
+]
+
+# Puntero a la generación que leen las consultas. Se cambia con una escritura condicional
+# (LWT) al terminar una recarga; los lectores lo cachean POINTER_TTL segundos.
+POINTER_NAME = 'sales'
+POINTER_TTL = 2.0
+
+CREATE_ACTIVE_GENERATION_TABLE = """
+    CREATE TABLE IF NOT EXISTS active_generation (
+        name TEXT,
+        generation INT,
+        previous INT,
+        updated_at TIMESTAMP,
+        PRIMARY KEY ((name))
+    )
+"""
+
+INSERT_ACTIVE_GENERATION = """
+    INSERT INTO active_generation (name, generation, updated_at)
+    VALUES (%s, 0, toTimestamp(now()))
+    IF NOT EXISTS
+"""
+
+SELECT_ACTIVE_GENERATION = """
+    SELECT generation
+    FROM active_generation
+    WHERE name = %s
+"""
+
+SWITCH_ACTIVE_GENERATION = """
+    UPDATE active_generation
+    SET generation = %s, previous = %s, updated_at = toTimestamp(now())
+    WHERE name = %s
+    IF generation = %s
+"""
+
+RESET_ACTIVE_GENERATION = """
+    UPDATE active_generation
+    SET generation = 0, previous = null, updated_at = toTimestamp(now())
+    WHERE name = %s
+    IF EXISTS
+"""
+
+SELECT_KEYSPACE_TABLES = """
+    SELECT table_name
+    FROM system_schema.tables
+    WHERE keyspace_name = %s
+"""
+
+# Versión del esquema guardada en el propio keyspace; incrementarla al cambiar el DDL
+SCHEMA_VERSION = 3
+SCHEMA_COMPONENT = 'cassandra'
+
+CREATE_SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        component TEXT,
+        version INT,
+        updated_at TIMESTAMP,
+        PRIMARY KEY ((component))
+    )
+"""
+
+SELECT_SCHEMA_VERSION = """
+    SELECT version
+    FROM {}.schema_version
+    WHERE component = %s
+"""
+
+INSERT_SCHEMA_VERSION = """
+    INSERT INTO schema_version (component, version, updated_at)
+    VALUES (%s, %s, toTimestamp(now()))
+"""
+
+# Partición única de sales_totals_by_month
+TOTALS_BUCKET = 'all'
+
 # Queries
 
 SELECT_CURRENT_MONTH_SALES = """
@@ -86,15 +262,370 @@ SELECT_SALES_IN_RANGE = """
     AND total_sales <= ?
 """
 
+SELECT_SALES_IN_RANGE_LIMIT = """
+    SELECT *
+    FROM sales_by_total
+    WHERE month = ?
+    AND total_sales >= ?
+    AND total_sales <= ?
+    LIMIT ?
+"""
+
+SELECT_MONTHLY_SALES_TOKEN_RANGE = """
+    SELECT month, restaurant, total_sales
+    FROM sales_by_month
+    WHERE token(month) > ?
+    AND token(month) <= ?
+"""
+
+SELECT_RESTAURANT_YEARLY_TOTAL = """
+    SELECT restaurant, total_sales
+    FROM sales_yearly_by_restaurant
+    WHERE restaurant = ?
+"""
+
+SELECT_RESTAURANT_CATEGORY = """
+    SELECT category
+    FROM sales_yearly_by_restaurant
+    WHERE restaurant = ?
+"""
+
+SELECT_MONTHLY_TOTALS = """
+    SELECT month, total_sales
+    FROM sales_totals_by_month
+    WHERE bucket = ?
+"""
+
+SELECT_MONTHLY_TOTAL = """
+    SELECT month, total_sales
+    FROM sales_totals_by_month
+    WHERE bucket = ?
+    AND month = ?
+"""
+
+SELECT_CATEGORY_SALES = """
+    SELECT category, month, total_sales
+    FROM sales_by_category_month
+    WHERE category = ?
+"""
+
+SELECT_CATEGORY_MONTH_SALES = """
+    SELECT category, month, total_sales
+    FROM sales_by_category_month
+    WHERE category = ?
+    AND month = ?
+"""
+
+INSERT_MONTHLY_SALES = """
+    INSERT INTO sales_by_month (month, restaurant, total_sales)
+    VALUES (?, ?, ?)
+"""
+
+INSERT_RESTAURANT_SALES = """
+    INSERT INTO sales_by_restaurant (restaurant, month, total_sales)
+    VALUES (?, ?, ?)
+"""
+
+INSERT_TOTAL_SALES = """
+    INSERT INTO sales_by_total (month, total_sales, restaurant)
+    VALUES (?, ?, ?)
+"""
+
+INSERT_RESTAURANT_YEARLY_TOTAL = """
+    INSERT INTO sales_yearly_by_restaurant (restaurant, total_sales, category)
+    VALUES (?, ?, ?)
+"""
+
+INSERT_MONTHLY_TOTAL = """
+    INSERT INTO sales_totals_by_month (bucket, month, total_sales)
+    VALUES (?, ?, ?)
+"""
+
+INSERT_CATEGORY_MONTH_SALES = """
+    INSERT INTO sales_by_category_month (category, month, total_sales)
+    VALUES (?, ?, ?)
+"""
+
+# Borrados de las filas de un restaurante (sincronización incremental)
+DELETE_RESTAURANT_SALES = """
+    DELETE FROM sales_by_restaurant
+    WHERE restaurant = ?
+"""
+
+DELETE_MONTHLY_SALES = """
+    DELETE FROM sales_by_month
+    WHERE month = ?
+    AND restaurant = ?
+"""
+
+DELETE_TOTAL_SALES = """
+    DELETE FROM sales_by_total
+    WHERE month = ?
+    AND total_sales = ?
+    AND restaurant = ?
+"""
+
+DELETE_RESTAURANT_YEARLY_TOTAL = """
+    DELETE FROM sales_yearly_by_restaurant
+    WHERE restaurant = ?
+"""
+
+# Registro de sentencias preparadas: nombre -> CQL
+STATEMENTS = {
+    'SELECT_CURRENT_MONTH_SALES': SELECT_CURRENT_MONTH_SALES,
+    'SELECT_CURRENT_MONTH_SALES_TOP': SELECT_CURRENT_MONTH_SALES_TOP,
+    'SELECT_ALL_MONTHLY_SALES': SELECT_ALL_MONTHLY_SALES,
+    'SELECT_MONTHLY_SALES': SELECT_MONTHLY_SALES,
+    'SELECT_RESTAURANT_SALES': SELECT_RESTAURANT_SALES,
+    'SELECT_MONTHLY_RESTAURANT_SALES': SELECT_MONTHLY_RESTAURANT_SALES,
+    'SELECT_SALES_IN_RANGE': SELECT_SALES_IN_RANGE,
+    'SELECT_SALES_IN_RANGE_LIMIT': SELECT_SALES_IN_RANGE_LIMIT,
+    'SELECT_MONTHLY_SALES_TOKEN_RANGE': SELECT_MONTHLY_SALES_TOKEN_RANGE,
+    'INSERT_MONTHLY_SALES': INSERT_MONTHLY_SALES,
+    'INSERT_RESTAURANT_SALES': INSERT_RESTAURANT_SALES,
+    'INSERT_TOTAL_SALES': INSERT_TOTAL_SALES,
+    'SELECT_RESTAURANT_YEARLY_TOTAL': SELECT_RESTAURANT_YEARLY_TOTAL,
+    'SELECT_RESTAURANT_CATEGORY': SELECT_RESTAURANT_CATEGORY,
+    'SELECT_MONTHLY_TOTALS': SELECT_MONTHLY_TOTALS,
+    'SELECT_MONTHLY_TOTAL': SELECT_MONTHLY_TOTAL,
+    'SELECT_CATEGORY_SALES': SELECT_CATEGORY_SALES,
+    'SELECT_CATEGORY_MONTH_SALES': SELECT_CATEGORY_MONTH_SALES,
+    'INSERT_RESTAURANT_YEARLY_TOTAL': INSERT_RESTAURANT_YEARLY_TOTAL,
+    'INSERT_MONTHLY_TOTAL': INSERT_MONTHLY_TOTAL,
+    'INSERT_CATEGORY_MONTH_SALES': INSERT_CATEGORY_MONTH_SALES,
+    'DELETE_RESTAURANT_SALES': DELETE_RESTAURANT_SALES,
+    'DELETE_MONTHLY_SALES': DELETE_MONTHLY_SALES,
+    'DELETE_TOTAL_SALES': DELETE_TOTAL_SALES,
+    'DELETE_RESTAURANT_YEARLY_TOTAL': DELETE_RESTAURANT_YEARLY_TOTAL,
+}
+
+# Sentencias preparadas por sesión y por generación de tablas. Una sesión nueva (reconexión)
+# empieza con un registro vacío; el DDL de este módulo y la reconexión de nodos incrementan la
+# generación del esquema y obligan a volver a preparar en el siguiente uso.
+_registries = weakref.WeakKeyDictionary()
+_schema_generation = [0]
+
+# Generación activa leída por cada sesión: sesión -> (expira, generación)
+_pointers = weakref.WeakKeyDictionary()
+_TABLE_PATTERN = re.compile(r'\b(' + '|'.join(SALES_TABLES) + r')\b')
+_GENERATION_PATTERN = re.compile(r'^(' + '|'.join(SALES_TABLES) + r')(?:_g(\d+))?$')
+
+
+class _ReprepareOnUp(HostStateListener):
+    def on_up(self, host):
+        invalidate_statements()
+
+    def on_add(self, host):
+        invalidate_statements()
+
+    def on_down(self, host):
+        pass
+
+    def on_remove(self, host):
+        pass
+
+
+def invalidate_statements():
+    """
+    Marca todas las sentencias preparadas como obsoletas (cambio de esquema o reconexión).
+    """
+    _schema_generation[0] += 1
+
+
+def table_name(table, generation):
+    return table if generation == 0 else f"{table}_g{generation}"
+
+
+def for_generation(cql, generation):
+    """
+    Reescribe las tablas de ventas de una sentencia CQL con los nombres de la generación.
+    """
+    if generation == 0:
+        return cql
+    return _TABLE_PATTERN.sub(lambda m: table_name(m.group(1), generation), cql)
+
+
+def active_generation(session, refresh=False):
+    """
+    Generación de tablas que deben leer las consultas. El puntero se lee de active_generation
+    y se cachea POINTER_TTL segundos por sesión; refresh=True fuerza la lectura.
+    """
+    now = time.monotonic()
+    cached = _pointers.get(session)
+    if cached is not None and not refresh and cached[0] > now:
+        return cached[1]
+    try:
+        row = session.execute(SELECT_ACTIVE_GENERATION, [POINTER_NAME]).one()
+    except InvalidRequest:
+        # Keyspace con un esquema anterior a la versión 2: solo existe la generación 0
+        row = None
+    generation = row.generation if row else 0
+    _pointers[session] = (now + POINTER_TTL, generation)
+    return generation
+
+
+def prepare_statements(session, generation=None):
+    """
+    Prepara todas las sentencias del registro para la sesión y la generación de tablas
+    (por defecto, la activa). Se llama al iniciar y, de forma automática, cuando cambian
+    el keyspace, la generación del esquema o la generación activa.
+    """
+    registry = _registries.get(session)
+    if registry is None:
+        registry = {'hits': Counter(), 'prepares': Counter(), 'key': None}
+        session.cluster.register_listener(_ReprepareOnUp())
+        _registries[session] = registry
+    key = (session.keyspace, _schema_generation[0])
+    if registry['key'] != key:
+        registry['statements'] = {}
+        registry['key'] = key
+    if generation is None:
+        generation = active_generation(session)
+    statements = {}
+    for name, cql in STATEMENTS.items():
+        statements[name] = session.prepare(for_generation(cql, generation))
+        registry['prepares'][name] += 1
+    registry['statements'][generation] = statements
+    log.info(f"{len(STATEMENTS)} sentencias preparadas para el keyspace {session.keyspace} (generación {generation})")
+    return registry
+
+
+def prepared(session, name, generation=None):
+    """
+    Devuelve la sentencia preparada `name` para la sesión sobre las tablas de la generación
+    indicada (por defecto, la activa), preparándola solo si hace falta.
+    """
+    if generation is None:
+        generation = active_generation(session)
+    registry = _registries.get(session)
+    if (registry is None or registry['key'] != (session.keyspace, _schema_generation[0])
+            or generation not in registry['statements']):
+        registry = prepare_statements(session, generation)
+    registry['hits'][name] += 1
+    return registry['statements'][generation][name]
+
+
+def cached_prepared(session, name):
+    """
+    Como prepared, pero sin ir al servidor: devuelve None si el puntero de la generación
+    activa venció o la sentencia no está preparada. Para usar desde un bucle asyncio, que
+    en ese caso llama a prepared en un executor.
+    """
+    cached = _pointers.get(session)
+    if cached is None or cached[0] <= time.monotonic():
+        return None
+    registry = _registries.get(session)
+    if (registry is None or registry['key'] != (session.keyspace, _schema_generation[0])
+            or cached[1] not in registry['statements']):
+        return None
+    registry['hits'][name] += 1
+    return registry['statements'][cached[1]][name]
+
+
+def statement_stats(session):
+    """
+    Número de usos y de preparaciones de cada sentencia en la sesión.
+    """
+    registry = _registries.get(session)
+    if registry is None:
+        return {}
+    return {name: {'hits': registry['hits'][name], 'prepares': registry['prepares'][name]}
+            for name in STATEMENTS}
+
+
 def create_keyspace(session, keyspace, replication_factor):
     log.info(f"Creando espacio de claves: {keyspace} con factor de replicación {replication_factor}")
     session.execute(CREATE_KEYSPACE.format(keyspace, replication_factor))
+    invalidate_statements()
 
 def create_schema(session):
     log.info("Creando el esquema del modelo")
-    session.execute(CREATE_RESTAURANT_SALES_TABLE)
-    session.execute(CREATE_MONTHLY_SALES_TABLE)
-    session.execute(CREATE_RESTAURANT_FILTERED_SALES_TABLE)
+    session.execute(CREATE_SCHEMA_VERSION_TABLE)
+    session.execute(CREATE_ACTIVE_GENERATION_TABLE)
+    session.execute(INSERT_ACTIVE_GENERATION, [POINTER_NAME])
+    create_generation(session, active_generation(session, refresh=True))
+    invalidate_statements()
+
+def create_generation(session, generation):
+    """
+    Crea el juego de tablas de ventas de una generación (vacías si no existían).
+    """
+    for cql in CREATE_SALES_TABLES:
+        session.execute(for_generation(cql, generation))
+
+def drop_generation(session, generation):
+    log.info(f"Eliminando las tablas de la generación {generation}")
+    for table in SALES_TABLES:
+        session.execute(f"DROP TABLE IF EXISTS {table_name(table, generation)}")
+    registry = _registries.get(session)
+    if registry is not None:
+        registry['statements'].pop(generation, None)
+
+def existing_generations(session):
+    """
+    Generaciones con alguna tabla de ventas en el keyspace de la sesión.
+    """
+    generations = set()
+    for row in session.execute(SELECT_KEYSPACE_TABLES, [session.keyspace]):
+        match = _GENERATION_PATTERN.match(row.table_name)
+        if match:
+            generations.add(int(match.group(2) or 0))
+    return generations
+
+def switch_generation(session, current, new):
+    """
+    Apunta las lecturas a la generación `new` con una escritura condicional: solo se aplica
+    si el puntero sigue en `current`, así dos recargas simultáneas no se pisan.
+    """
+    applied = session.execute(SWITCH_ACTIVE_GENERATION, [new, current, POINTER_NAME, current]).was_applied
+    if not applied:
+        raise RuntimeError(f"El puntero de generación cambió durante la recarga (se esperaba {current}).")
+    _pointers[session] = (time.monotonic() + POINTER_TTL, new)
+    log.info(f"Generación activa de Cassandra: {current} -> {new}")
+
+def cleanup_generations(session, keep=1):
+    """
+    Elimina las generaciones anteriores a la activa salvo las `keep` más recientes, que pueden
+    seguir leyéndose mientras caduca el puntero cacheado por otros procesos.
+    """
+    active = active_generation(session, refresh=True)
+    older = sorted((g for g in existing_generations(session) if g < active), reverse=True)
+    for generation in older[keep:]:
+        drop_generation(session, generation)
+    return older[keep:]
+
+def stored_schema_version(session, keyspace):
+    """
+    Versión del esquema guardada en el keyspace, o 0 si el keyspace o la tabla no existen.
+    La existencia se comprueba con los metadatos que el driver ya cargó al conectar.
+    """
+    metadata = session.cluster.metadata.keyspaces.get(keyspace)
+    if metadata is None or 'schema_version' not in metadata.tables:
+        return 0
+    row = session.execute(SELECT_SCHEMA_VERSION.format(keyspace), [SCHEMA_COMPONENT]).one()
+    return row.version if row else 0
+
+def ensure_schema(session, keyspace, replication_factor):
+    """
+    Deja la sesión en el keyspace y ejecuta el DDL solo si la versión guardada es menor que
+    SCHEMA_VERSION. Devuelve True si se aplicó el DDL.
+    """
+    if stored_schema_version(session, keyspace) >= SCHEMA_VERSION:
+        session.set_keyspace(keyspace)
+        return False
+    log.info(f"Actualizando el esquema de Cassandra a la versión {SCHEMA_VERSION}")
+    create_keyspace(session, keyspace, replication_factor)
+    session.set_keyspace(keyspace)
+    create_schema(session)
+    for generation in existing_generations(session):
+        try:
+            session.execute(for_generation(ADD_YEARLY_CATEGORY, generation))
+        except InvalidRequest:
+            # La tabla ya se creó con la columna
+            pass
+    invalidate_statements()
+    session.execute(INSERT_SCHEMA_VERSION, [SCHEMA_COMPONENT, SCHEMA_VERSION])
+    return True
 
 def uuid_from_time(date):
     timestamp = date.timestamp()
@@ -103,235 +634,859 @@ def uuid_from_time(date):
 def convert_uuid(date):
     return uuid_from_time(date)
 
+def normalize_month(month):
+    """
+    Convierte un mes en español, inglés o número (1-12) al nombre usado en las tablas.
+    Lanza ValueError si la entrada no es válida.
+    """
+    month_en = MONTH_MAP.get(str(month).strip().lower())
+    if month_en:
+        return month_en
+    try:
+        month_num = int(month)
+    except ValueError:
+        raise ValueError("Entrada de mes no válida. Introduzca el nombre del mes en español o inglés, o un número (1-12).")
+    if not 1 <= month_num <= 12:
+        raise ValueError("Número de mes no válido. Introduzca un número entre 1 y 12.")
+    return MONTH_ORDER[month_num - 1]
+
+
+def execute_paged(session, name, values=None, fetch_size=DEFAULT_FETCH_SIZE, generation=None):
+    """
+    Ejecuta la sentencia preparada `name` pidiendo páginas de fetch_size filas. Al iterar el
+    resultado el driver trae la siguiente página solo cuando se necesita.
+    """
+    bound = prepared(session, name, generation).bind(values or [])
+    bound.fetch_size = fetch_size
+    return session.execute(bound)
+
+
+def to_sales(rows, month=None, restaurant=None):
+    """
+    Convierte filas del driver en Sale; month/restaurant completan las columnas que la
+    consulta no selecciona.
+    """
+    for row in rows:
+        yield Sale(getattr(row, 'month', month), getattr(row, 'restaurant', restaurant), row.total_sales)
+
+
 # Función 1
-def get_current_month_sales(session):
+@metricas.instrumentado("cassandra")
+def get_current_month_sales(session, fetch_size=DEFAULT_FETCH_SIZE):
     current_month = datetime.now().strftime('%B')
     log.info(f"Recuperando totales de {current_month}")
-    stmt = session.prepare(SELECT_CURRENT_MONTH_SALES)
-    rows = session.execute(stmt, [current_month])
-    for row in rows:
-        print(f"=== Mes Actual: {row.month} ===")
-        print(f"=========== Restaurante: {row.restaurant}")
-        print(f"----------- Total Ventas: {row.total_sales}")
-        print(f"------------------------------------------")
+    yield from to_sales(execute_paged(session, 'SELECT_CURRENT_MONTH_SALES', [current_month], fetch_size))
 
 # Función 2
+@metricas.instrumentado("cassandra")
 def get_current_month_sales_top(session):
     current_month = datetime.now().strftime('%B')
     log.info(f"Recuperando los 3 principales restaurantes de {current_month}")
-    stmt = session.prepare(SELECT_CURRENT_MONTH_SALES_TOP)
-    rows = session.execute(stmt, [current_month])
-    for row in rows:
-        print(f"=== Mes Actual: {row.month} ===")
-        print(f"=========== Restaurante: {row.restaurant}")
-        print(f"----------- Total Ventas: {row.total_sales}")
-        print(f"------------------------------------------")
+    yield from to_sales(execute_paged(session, 'SELECT_CURRENT_MONTH_SALES_TOP', [current_month]))
 
 # Función 3
-def get_all_sales(session):
-    log.info("Recuperando todos los datos de ventas mensuales")
-    stmt = session.prepare(SELECT_ALL_MONTHLY_SALES)
-    rows = session.execute(stmt)
+def token_ranges(splits=DEFAULT_SCAN_SPLITS):
+    """
+    Divide el anillo de tokens en `splits` subrangos (inicio, fin] contiguos.
+    """
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    limites = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(limites[:-1], limites[1:]))
 
-    for row in rows:
-        print(f"=== Mes: {row.month} ===")
-        print(f"----------- Restaurante: {row.restaurant}")
-        print(f"----------- Total Ventas: {row.total_sales}")
-        print(f"------------------------------------------")
+
+def _load_checkpoint(checkpoint, splits):
+    if not checkpoint or not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, 'r') as file:
+        data = json.load(file)
+    # Un checkpoint con otra división del anillo no es reutilizable
+    return set(data.get('done', [])) if data.get('splits') == splits else set()
+
+
+def _save_checkpoint(checkpoint, splits, done):
+    tmp_path = f"{checkpoint}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({'splits': splits, 'done': sorted(done)}, file)
+    os.replace(tmp_path, checkpoint)
+
+
+def scan_all_sales(session, splits=DEFAULT_SCAN_SPLITS, workers=DEFAULT_SCAN_WORKERS,
+                   fetch_size=DEFAULT_FETCH_SIZE, checkpoint=None):
+    """
+    Escanea sales_by_month en paralelo: divide el anillo de tokens en `splits` subrangos y
+    los lee con `workers` hilos usando predicados token(month). Genera Sale conforme llegan
+    las páginas, sin orden entre subrangos.
+
+    checkpoint: ruta de un archivo JSON donde se guardan los subrangos terminados. Si el
+    escaneo se interrumpe, volver a llamar con el mismo archivo retoma solo los pendientes;
+    al terminar completo el archivo se elimina.
+    """
+    rangos = token_ranges(splits)
+    done = _load_checkpoint(checkpoint, splits)
+    pendientes = queue.Queue()
+    for idx in range(len(rangos)):
+        if idx not in done:
+            pendientes.put(idx)
+    total = pendientes.qsize()
+    if total < len(rangos):
+        log.info(f"Retomando escaneo: {len(rangos) - total} de {len(rangos)} subrangos ya completados")
+
+    # Todos los subrangos se leen de la misma generación aunque cambie el puntero a mitad
+    generation = active_generation(session)
+    salida = queue.Queue(maxsize=fetch_size * workers)
+    detener = threading.Event()
+    TERMINADO, ERROR = object(), object()
+
+    def enviar(item):
+        # put con espera acotada para que los hilos terminen si el consumidor abandona el escaneo
+        while not detener.is_set():
+            try:
+                salida.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        while not detener.is_set():
+            try:
+                idx = pendientes.get_nowait()
+            except queue.Empty:
+                return
+            inicio, fin = rangos[idx]
+            try:
+                for row in execute_paged(session, 'SELECT_MONTHLY_SALES_TOKEN_RANGE', [inicio, fin], fetch_size,
+                                         generation):
+                    if not enviar(Sale(row.month, row.restaurant, row.total_sales)):
+                        return
+                enviar((TERMINADO, idx))
+            except Exception as e:
+                enviar((ERROR, (idx, e)))
+                return
+
+    hilos = [threading.Thread(target=metricas.propagar(worker), name=f"scan-{i}", daemon=True)
+             for i in range(min(workers, total))]
+    for hilo in hilos:
+        hilo.start()
+
+    try:
+        completados = 0
+        while completados < total:
+            item = salida.get()
+            if isinstance(item, Sale):
+                yield item
+                continue
+            marca, valor = item
+            if marca is ERROR:
+                idx, exc = valor
+                raise RuntimeError(f"Error al escanear el subrango {idx} {rangos[idx]}: {exc}") from exc
+            completados += 1
+            done.add(valor)
+            if checkpoint:
+                _save_checkpoint(checkpoint, splits, done)
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    finally:
+        detener.set()
+
+
+@metricas.instrumentado("cassandra")
+def get_all_sales(session, fetch_size=DEFAULT_FETCH_SIZE, splits=DEFAULT_SCAN_SPLITS,
+                  workers=DEFAULT_SCAN_WORKERS, checkpoint=None):
+    log.info("Recuperando todos los datos de ventas mensuales")
+    if workers <= 1:
+        yield from to_sales(execute_paged(session, 'SELECT_ALL_MONTHLY_SALES', fetch_size=fetch_size))
+        return
+    yield from scan_all_sales(session, splits, workers, fetch_size, checkpoint)
 
 # Función 4
+@cache.cached("sales_by_month", group="cassandra")
+def query_sales_by_month(session, month_en, generation=None):
+    """
+    Ventas de la partición de un mes (nombre en inglés), materializadas para la caché.
+    La generación forma parte de la clave, así una recarga en otro proceso no sirve datos viejos.
+    """
+    rows = execute_paged(session, 'SELECT_MONTHLY_SALES', [month_en], generation=generation)
+    return tuple(to_sales(rows, month=month_en))
+
+
+@metricas.instrumentado("cassandra")
 def get_sales_by_month(session, month):
     log.info(f"Recuperando todas las ventas de {month}")
-    
-    # Diccionario
-    month_map = {
-        # Español a Inglés
-        'enero': 'January', 'febrero': 'February', 'marzo': 'March',
-        'abril': 'April', 'mayo': 'May', 'junio': 'June',
-        'julio': 'July', 'agosto': 'August', 'septiembre': 'September',
-        'octubre': 'October', 'noviembre': 'November', 'diciembre': 'December',
-        # Meses en inglés
-        'january': 'January', 'february': 'February', 'march': 'March',
-        'april': 'April', 'may': 'May', 'june': 'June',
-        'july': 'July', 'august': 'August', 'september': 'September',
-        'october': 'October', 'november': 'November', 'december': 'December'
-    }
-    month_en = month_map.get(month.lower())
-    
-    if not month_en:
-        try:
-            month_num = int(month)
-            if 1 <= month_num <= 12:
-                month_en = datetime(2024, month_num, 1).strftime('%B')
-            else:
-                print("Número de mes no válido. Introduzca un número entre 1 y 12.")
-                return
-        except ValueError:
-            print("Entrada de mes no válida. Introduzca el nombre del mes en español o inglés, o un número (1-12).")
-            return
-
-    stmt = session.prepare(SELECT_MONTHLY_SALES)
-    rows = session.execute(stmt, [month_en])
-    
-    found_records = False
-    print(f"\n=== Mes: {month_en} ===")
-    for row in rows:
-        found_records = True
-        print(f"- Restaurante: {row.restaurant}")
-        print(f"- Total Ventas: ${row.total_sales:,.2f}")
-        print(f"------------------------------------------")
-    
-    if not found_records:
-        print(f"No se encontraron registros de ventas para {month_en}")
+    yield from query_sales_by_month(session, normalize_month(month), active_generation(session))
 
 # Función 5
-def get_sales_by_restaurant(session, restaurant):
+@metricas.instrumentado("cassandra")
+def get_sales_by_restaurant(session, restaurant, fetch_size=DEFAULT_FETCH_SIZE):
     log.info(f"Recuperando ventas mensuales para el restaurante: {restaurant}")
-    stmt = session.prepare(SELECT_RESTAURANT_SALES)
-    rows = session.execute(stmt, [restaurant])
-    
-    found_records = False
-    print(f"=== Restaurante: {restaurant} ===")
-    for row in rows:
-        found_records = True
-        print(f"- Mes: {row.month}")
-        print(f"- Total Ventas: {row.total_sales}")
-        print(f"------------------------------------------")
-    
-    if not found_records:
-        print(f"No se encontraron registros de ventas para el restaurante: {restaurant}")
+    rows = execute_paged(session, 'SELECT_RESTAURANT_SALES', [restaurant], fetch_size)
+    yield from to_sales(rows, restaurant=restaurant)
 
 # Función 6
+@metricas.instrumentado("cassandra")
 def get_sales_by_restaurant_and_month(session, restaurant, month):
     log.info(f"Recuperando ventas para {restaurant} en {month}")
-    
-    # Mapeo de los meses en español a inglés
-    month_map = {
-        'enero': 'January', 'febrero': 'February', 'marzo': 'March',
-        'abril': 'April', 'mayo': 'May', 'junio': 'June',
-        'julio': 'July', 'agosto': 'August', 'septiembre': 'September',
-        'octubre': 'October', 'noviembre': 'November', 'diciembre': 'December'
-    }
-    
-    # Obtener el nombre del mes en inglés
-    month_en = month_map.get(month.lower())
-    
-    if not month_en:
-        print("Entrada de mes no válida.")
-        return
-    
-    # Preparar la consulta
-    stmt = session.prepare(SELECT_MONTHLY_RESTAURANT_SALES)
-    
-    # Ejecutar la consulta
-    rows = session.execute(stmt, [restaurant, month_en])
-    
-    # Verificar si hay resultados
-    if not rows:
-        print("No se encontraron ventas para el restaurante y mes indicados.")
-        return
-    
-    # Imprimir la información de la primera fila
-    for row in rows:
-        print(f"=== Mes: {row.month} ===")
-        print(f"=== Restaurante: {row.restaurant} ===")
-        print(f"----------- Total Ventas: {row.total_sales}")
-        print(f"------------------------------------------")
+    month_en = normalize_month(month)
+    yield from to_sales(execute_paged(session, 'SELECT_MONTHLY_RESTAURANT_SALES', [restaurant, month_en]))
 
 # Función 7
-def get_sales_by_sales_range(session, min_sales, max_sales):
+def query_sales_by_sales_range(session, min_sales, max_sales, months=None, limit=None, order=None,
+                               fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Lee en paralelo las particiones de sales_by_total de cada mes y genera las filas
+    con ventas entre min_sales y max_sales.
+
+    months: subconjunto de meses (español o inglés); por defecto los 12.
+    order: None entrega las filas según llegan; "desc" o "asc" las ordena globalmente
+    por total_sales mezclando las particiones, que ya vienen ordenadas por Cassandra.
+    limit: número máximo de filas; salvo con order="asc", también se envía como LIMIT
+    a cada partición, porque las particiones están ordenadas por total_sales DESC.
+    """
+    name, values = sales_range_request(min_sales, max_sales, months, limit, order)
+
+    # Se lanzan todas las lecturas (de una misma generación) y cada future se encola al completarse
+    generation = active_generation(session)
+    completados = queue.Queue()
+    for month_values in values:
+        bound = prepared(session, name, generation).bind(month_values)
+        bound.fetch_size = fetch_size
+        future = session.execute_async(bound)
+        future.add_callbacks(lambda _, f=future: completados.put(f), lambda _, f=future: completados.put(f))
+
+    def en_orden_de_llegada():
+        for _ in values:
+            yield completados.get().result()
+
+    return merge_sales_partitions(en_orden_de_llegada(), limit, order)
+
+
+def sales_range_request(min_sales, max_sales, months=None, limit=None, order=None):
+    """
+    Valida los parámetros de la consulta por rango y devuelve (nombre de la sentencia,
+    lista con los valores de cada partición de mes a leer).
+    """
+    if order not in (None, 'asc', 'desc'):
+        raise ValueError(f"Orden no válido: {order}")
+    if months is None:
+        months = MONTH_ORDER
+    else:
+        months = [normalize_month(month) for month in months]
+
+    params = [float(min_sales), float(max_sales)]
+    if limit is not None and order != 'asc':
+        name = 'SELECT_SALES_IN_RANGE_LIMIT'
+        params.append(int(limit))
+    else:
+        name = 'SELECT_SALES_IN_RANGE'
+    return name, [[month, *params] for month in months]
+
+
+def merge_sales_partitions(partitions, limit=None, order=None):
+    """
+    Une las filas de las particiones de sales_by_total (cada una ordenada por total_sales DESC)
+    según `order` y corta en `limit` filas.
+    """
+    if order is None:
+        rows = itertools.chain.from_iterable(partitions)
+    else:
+        partitions = [list(rows) for rows in partitions]
+        if order == 'asc':
+            partitions = [list(reversed(rows)) for rows in partitions]
+        rows = heapq.merge(*partitions, key=lambda row: row.total_sales, reverse=(order == 'desc'))
+    return itertools.islice(rows, limit)
+
+
+@metricas.instrumentado("cassandra")
+def get_sales_by_sales_range(session, min_sales, max_sales, months=None, limit=None, order=None,
+                             fetch_size=DEFAULT_FETCH_SIZE):
     log.info(f"Recuperando ventas en el rango {min_sales} a {max_sales}")
-    
-    # Retrieve sales for each month
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                   'July', 'August', 'September', 'October', 'November', 'December']
-    
-    for month in month_order:
-        stmt = session.prepare(SELECT_SALES_IN_RANGE)
-        rows = session.execute(stmt, [month, float(min_sales), float(max_sales)])
-        
-        for row in rows:
-            print(f"- Mes: {row.month}")
-            print(f"- Restaurante: {row.restaurant}")
-            print(f"- Total Ventas: {row.total_sales}")
-            print(f"------------------------------------------")
+    yield from to_sales(query_sales_by_sales_range(session, min_sales, max_sales, months, limit, order, fetch_size))
+
+# Agregados: cada consulta lee una sola partición
+@metricas.instrumentado("cassandra", filas=lambda total: int(total is not None))
+def get_restaurant_yearly_total(session, restaurant):
+    """
+    Total anual de ventas del restaurante, o None si no existe.
+    """
+    row = execute_paged(session, 'SELECT_RESTAURANT_YEARLY_TOTAL', [restaurant]).one()
+    return row.total_sales if row else None
+
+
+@metricas.instrumentado("cassandra")
+def get_monthly_totals(session, month=None):
+    """
+    Genera MonthTotal con la suma de ventas de todos los restaurantes por mes, en orden
+    de calendario; con month solo ese mes.
+    """
+    if month is not None:
+        rows = execute_paged(session, 'SELECT_MONTHLY_TOTAL', [TOTALS_BUCKET, normalize_month(month)])
+    else:
+        rows = sorted(execute_paged(session, 'SELECT_MONTHLY_TOTALS', [TOTALS_BUCKET]),
+                      key=lambda row: MONTH_ORDER.index(row.month))
+    for row in rows:
+        yield MonthTotal(row.month, row.total_sales)
+
+
+@metricas.instrumentado("cassandra")
+def get_category_sales(session, category, month=None):
+    """
+    Genera CategoryMonthTotal con las ventas totales de una categoría por mes.
+    """
+    if month is not None:
+        rows = execute_paged(session, 'SELECT_CATEGORY_MONTH_SALES', [category, normalize_month(month)])
+    else:
+        rows = sorted(execute_paged(session, 'SELECT_CATEGORY_SALES', [category]),
+                      key=lambda row: MONTH_ORDER.index(row.month))
+    for row in rows:
+        yield CategoryMonthTotal(row.category, row.month, row.total_sales)
+
 
 # Subir datos
-def load_csv_to_cassandra(session, csv_file_path):
-    log.info(f"Cargando datos desde {csv_file_path}")
+def parse_ventas(raw):
+    """
+    Convierte la columna 'ventas' del CSV ("[123, 456, ...]") en una lista de floats
+    sin evaluar código arbitrario.
+    """
+    ventas = ast.literal_eval(raw or '[]')
+    if not isinstance(ventas, (list, tuple)):
+        raise ValueError(f"Formato de ventas no válido: {raw!r}")
+    return [float(v) for v in ventas]
+
 
-    # Mapeo de meses en español a inglés
-    month_map = {
-        'enero': 'January', 'febrero': 'February', 'marzo': 'March',
-        'abril': 'April', 'mayo': 'May', 'junio': 'June',
-        'julio': 'July', 'agosto': 'August', 'septiembre': 'September',
-        'octubre': 'October', 'noviembre': 'November', 'diciembre': 'December'
+def prepare_insert_statements(session, generation=None):
+    return {
+        'monthly': prepared(session, 'INSERT_MONTHLY_SALES', generation),
+        'restaurant': prepared(session, 'INSERT_RESTAURANT_SALES', generation),
+        'total': prepared(session, 'INSERT_TOTAL_SALES', generation),
+        'yearly': prepared(session, 'INSERT_RESTAURANT_YEARLY_TOTAL', generation),
+        'stale_total': prepared(session, 'DELETE_TOTAL_SALES', generation),
     }
 
-    # Meses en orden para mapear índices de ventas
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                   'July', 'August', 'September', 'October', 'November', 'December']
 
-    # Insert statements
-    insert_statements = {
-        'monthly': session.prepare("""
-            INSERT INTO sales_by_month (month, restaurant, total_sales)
-            VALUES (?, ?, ?)
-        """),
-        'restaurant': session.prepare("""
-            INSERT INTO sales_by_restaurant (restaurant, month, total_sales)
-            VALUES (?, ?, ?)
-        """),
-        'total': session.prepare("""
-            INSERT INTO sales_by_total (month, total_sales, restaurant)
-            VALUES (?, ?, ?)
-        """)
+def sales_mutations(insert_statements, restaurant, ventas_list, categoria=None, previous=None):
+    """
+    Genera (tabla, sentencia, valores) para cada mes de ventas de un restaurante,
+    más su total anual. previous ({mes: total} ya guardado) borra las filas de sales_by_total
+    cuyo total cambia, porque el total es parte de su clave y el INSERT no las reemplaza.
+    """
+    for month_index, total_sales in enumerate(ventas_list):
+        month = MONTH_ORDER[month_index]
+        yield 'monthly', insert_statements['monthly'], [month, restaurant, total_sales]
+        yield 'restaurant', insert_statements['restaurant'], [restaurant, month, total_sales]
+        if previous and month in previous and previous[month] != total_sales:
+            yield 'total', insert_statements['stale_total'], [month, previous[month], restaurant]
+        yield 'total', insert_statements['total'], [month, total_sales, restaurant]
+    yield 'yearly', insert_statements['yearly'], [restaurant, sum(ventas_list), categoria]
+
+
+def new_rollup():
+    return {'month': Counter(), 'category': Counter()}
+
+
+def accumulate_rollup(rollup, categoria, ventas_list):
+    """
+    Suma las ventas de un restaurante a los totales por mes y por categoría y mes.
+    """
+    for month_index, total_sales in enumerate(ventas_list):
+        month = MONTH_ORDER[month_index]
+        rollup['month'][month] += total_sales
+        if categoria:
+            rollup['category'][(categoria, month)] += total_sales
+
+
+def accumulate_overwrite(rollup, record, previous):
+    """
+    Suma al rollup las ventas del registro menos las que sobrescribe en cada mes (previous es
+    {'categoria', 'ventas': {mes: total}} o None), así cargar dos veces los mismos datos no
+    cambia los totales.
+    """
+    accumulate_rollup(rollup, record.get('categoria'), record['ventas'])
+    if not previous:
+        return
+    # Las filas escritas antes de la versión 3 del esquema no guardan la categoría
+    categoria = previous['categoria'] or record.get('categoria')
+    for month in MONTH_ORDER[:len(record['ventas'])]:
+        if month in previous['ventas']:
+            total_sales = float(previous['ventas'][month])
+            rollup['month'][month] -= total_sales
+            if categoria:
+                rollup['category'][(categoria, month)] -= total_sales
+
+
+def previous_sales(session, restaurants, generation=None):
+    """
+    Lee de forma concurrente las ventas por mes y la categoría guardadas de los restaurantes.
+    Devuelve {restaurante: {'categoria', 'ventas': {mes: total}}} de los que ya tienen ventas.
+    """
+    by_restaurant = prepared(session, 'SELECT_RESTAURANT_SALES', generation)
+    by_category = prepared(session, 'SELECT_RESTAURANT_CATEGORY', generation)
+    futures = [(restaurant, session.execute_async(by_restaurant, [restaurant]),
+                session.execute_async(by_category, [restaurant]))
+               for restaurant in dict.fromkeys(restaurants)]
+    previous = {}
+    for restaurant, sales_future, category_future in futures:
+        ventas = {row.month: row.total_sales for row in sales_future.result()}
+        row = category_future.result().one()
+        if ventas:
+            previous[restaurant] = {'categoria': row.category if row else None, 'ventas': ventas}
+    return previous
+
+
+def with_previous(session, records, generation=None, chunk_size=PREVIOUS_CHUNK_SIZE):
+    """
+    Genera (registro, anterior) con las ventas que el registro va a sobrescribir (None si el
+    restaurante es nuevo), leídas por tandas de chunk_size restaurantes. Un restaurante que se
+    repite en la carga toma como anterior la versión escrita antes en la misma carga, que
+    puede no haber llegado aún a Cassandra; para eso se recuerdan las ventas de cada nombre.
+    """
+    written = {}
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        stored = previous_sales(session, [r['nombre'] for r in chunk if r['nombre'] not in written], generation)
+        for record in chunk:
+            restaurant = record['nombre']
+            previous = written.get(restaurant, stored.get(restaurant))
+            written[restaurant] = {
+                'categoria': record.get('categoria'),
+                'ventas': dict(zip(MONTH_ORDER, record['ventas'])),
+            }
+            yield record, previous
+
+
+def delete_mutations(session, restaurant, ventas_list, generation=None):
+    """
+    Genera (tabla, sentencia, valores) que borran las filas escritas por sales_mutations
+    para el restaurante con esas ventas.
+    """
+    by_month = prepared(session, 'DELETE_MONTHLY_SALES', generation)
+    by_total = prepared(session, 'DELETE_TOTAL_SALES', generation)
+    for month_index, total_sales in enumerate(ventas_list):
+        month = MONTH_ORDER[month_index]
+        yield 'monthly', by_month, [month, restaurant]
+        yield 'total', by_total, [month, total_sales, restaurant]
+    yield 'restaurant', prepared(session, 'DELETE_RESTAURANT_SALES', generation), [restaurant]
+    yield 'yearly', prepared(session, 'DELETE_RESTAURANT_YEARLY_TOTAL', generation), [restaurant]
+
+
+def adjust_rollups(session, delta, max_in_flight=DEFAULT_MAX_IN_FLIGHT, generation=None):
+    """
+    Suma a los totales guardados las diferencias de `delta` (un rollup con valores que pueden
+    ser negativos). Solo lee y reescribe la partición de totales mensuales y las de las
+    categorías afectadas. Devuelve (escrituras exitosas, lista de errores).
+    """
+    absolute = new_rollup()
+    if delta['month']:
+        rows = execute_paged(session, 'SELECT_MONTHLY_TOTALS', [TOTALS_BUCKET], generation=generation)
+        stored = {row.month: row.total_sales for row in rows}
+        for month, diff in delta['month'].items():
+            absolute['month'][month] = stored.get(month, Decimal(0)) + Decimal(str(diff))
+    for categoria in {categoria for categoria, _ in delta['category']}:
+        rows = execute_paged(session, 'SELECT_CATEGORY_SALES', [categoria], generation=generation)
+        stored = {row.month: row.total_sales for row in rows}
+        for month in MONTH_ORDER:
+            if (categoria, month) in delta['category']:
+                diff = Decimal(str(delta['category'][(categoria, month)]))
+                absolute['category'][(categoria, month)] = stored.get(month, Decimal(0)) + diff
+    return write_rollups(session, absolute, max_in_flight, generation)
+
+
+def write_rollups(session, rollup, max_in_flight=DEFAULT_MAX_IN_FLIGHT, generation=None):
+    """
+    Escribe los totales por mes y por categoría tal cual, reemplazando los guardados. Solo
+    sirve cuando el rollup cubre todos los datos (una generación nueva); para sumar una carga
+    a tablas con datos usar adjust_rollups. Devuelve (escrituras exitosas, lista de errores).
+    """
+    monthly = prepared(session, 'INSERT_MONTHLY_TOTAL', generation)
+    category = prepared(session, 'INSERT_CATEGORY_MONTH_SALES', generation)
+
+    def requests():
+        for month, total in rollup['month'].items():
+            yield ('month_totals', month), monthly, [TOTALS_BUCKET, month, total]
+        for (categoria, month), total in rollup['category'].items():
+            yield ('category_totals', categoria), category, [categoria, month, total]
+
+    return execute_async_bounded(session, requests(), max_in_flight)
+
+
+def execute_async_bounded(session, requests, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    Ejecuta las peticiones (clave, sentencia, valores) con execute_async, sin superar
+    max_in_flight peticiones pendientes. Cuando se alcanza el límite, el productor se
+    bloquea hasta que el driver complete alguna (backpressure).
+    Devuelve (número de peticiones exitosas, lista de (clave, error)).
+    """
+    semaforo = threading.Semaphore(max_in_flight)
+    lock = threading.Lock()
+    exitosas = [0]
+    errores = []
+
+    def on_success(_, key):
+        with lock:
+            exitosas[0] += 1
+        semaforo.release()
+
+    def on_error(exc, key):
+        with lock:
+            errores.append((key, exc))
+        semaforo.release()
+
+    for key, stmt, values in requests:
+        semaforo.acquire()
+        try:
+            future = session.execute_async(stmt, values)
+        except Exception as e:
+            on_error(e, key)
+            continue
+        future.add_callbacks(on_success, on_error, callback_args=(key,), errback_args=(key,))
+
+    # Esperar a que todas las peticiones en vuelo terminen
+    for _ in range(max_in_flight):
+        semaforo.acquire()
+    for _ in range(max_in_flight):
+        semaforo.release()
+
+    return exitosas[0], errores
+
+
+def load_csv_to_cassandra_async(session, csv_file_path, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    Carga concurrente del CSV usando los futures asíncronos del driver.
+    Devuelve un reporte con filas cargadas, filas/seg y errores por fila del CSV.
+    """
+    log.info(f"Cargando datos (modo concurrente, max_in_flight={max_in_flight}) desde {csv_file_path}")
+    generation = active_generation(session)
+    insert_statements = prepare_insert_statements(session, generation)
+    row_errors = {}
+    stats = {'rows': 0}
+
+    rollup = new_rollup()
+
+    def requests():
+        records = read_sales_records(csv_file_path, row_errors, stats)
+        for record, previous in with_previous(session, records, generation):
+            accumulate_overwrite(rollup, record, previous)
+            for table, stmt, values in sales_mutations(insert_statements, record['nombre'], record['ventas'],
+                                                       record['categoria'], previous and previous['ventas']):
+                yield (record['line'], table, values[0]), stmt, values
+
+    start = time.perf_counter()
+    try:
+        exitosas, errores = execute_async_bounded(session, requests(), max_in_flight)
+        _, errores_rollup = adjust_rollups(session, rollup, max_in_flight, generation)
+        for key, exc in errores_rollup:
+            log.error(f"Error al escribir el agregado {key}: {exc}")
+    finally:
+        cache.invalidate("cassandra")
+    elapsed = time.perf_counter() - start
+
+    for (line_number, table, _), exc in errores:
+        row_errors.setdefault(line_number, []).append(f"{table}: {exc}")
+
+    total_rows = stats['rows']
+    loaded_rows = total_rows - len(row_errors)
+    report = {
+        'rows': total_rows,
+        'rows_loaded': loaded_rows,
+        'statements': exitosas,
+        'errors': row_errors,
+        'seconds': elapsed,
+        'rows_per_sec': loaded_rows / elapsed if elapsed > 0 else 0.0,
     }
 
+    log.info(f"Carga concurrente: {loaded_rows}/{total_rows} filas en {elapsed:.2f}s "
+             f"({report['rows_per_sec']:.1f} filas/seg)")
+    print(f"Importación completada: {loaded_rows}/{total_rows} filas, "
+          f"{report['rows_per_sec']:.1f} filas/seg")
+    for line_number, messages in sorted(row_errors.items()):
+        log.error(f"Fila {line_number}: {'; '.join(messages)}")
+        print(f"- Error en fila {line_number}: {'; '.join(messages)}")
+    return report
+
+
+def build_unlogged_batch(mutations):
+    batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+    for stmt, values in mutations:
+        batch.add(stmt, values)
+    return batch
+
+
+def read_sales_records(csv_file_path, row_errors=None, stats=None):
+    """
+    Lee el CSV de restaurantes y genera registros {'line', 'nombre', 'ventas'} con las
+    ventas ya convertidas. Las filas con ventas inválidas se anotan en row_errors.
+    """
+    with open(csv_file_path, 'r') as file:
+        reader = csv.DictReader(file)
+        # La línea 1 es el encabezado
+        for line_number, row in enumerate(reader, start=2):
+            if stats is not None:
+                stats['rows'] = stats.get('rows', 0) + 1
+            try:
+                ventas_list = parse_ventas(row.get('ventas'))
+            except (ValueError, SyntaxError) as e:
+                if row_errors is not None:
+                    row_errors.setdefault(line_number, []).append(f"ventas: {e}")
+                continue
+            yield {
+                'line': line_number,
+                'nombre': row.get('nombre', 'Restaurante Desconocido'),
+                'categoria': row.get('categoria'),
+                'ventas': ventas_list,
+            }
+
+
+def partition_batches(records, insert_statements, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Agrupa las mutaciones de los registros por tabla y clave de partición, y genera
+    ((tabla, partición), lote UNLOGGED) con a lo sumo batch_size sentencias.
+
+    Los 12 meses de un restaurante forman una partición completa de sales_by_restaurant,
+    así que se emiten al terminar cada registro. Las particiones por mes de sales_by_month
+    y sales_by_total se acumulan y se emiten al llenarse o al final de los registros.
+    """
+    buffers = {}
+    for record in records:
+        restaurant = record['nombre']
+        restaurant_rows = []
+        for table, stmt, values in sales_mutations(insert_statements, restaurant, record['ventas'],
+                                                   record.get('categoria'), record.get('previous')):
+            if table == 'yearly':
+                # Fila única de sales_yearly_by_restaurant: no necesita lote
+                yield ('yearly', restaurant), stmt.bind(values)
+                continue
+            if table == 'restaurant':
+                restaurant_rows.append((stmt, values))
+                continue
+            # En sales_by_month y sales_by_total la partición es el mes (values[0])
+            key = (table, values[0])
+            buffer = buffers.setdefault(key, [])
+            buffer.append((stmt, values))
+            if len(buffer) >= batch_size:
+                yield key, build_unlogged_batch(buffers.pop(key))
+
+        for i in range(0, len(restaurant_rows), batch_size):
+            yield ('restaurant', restaurant), build_unlogged_batch(restaurant_rows[i:i + batch_size])
+
+    for key, buffer in buffers.items():
+        yield key, build_unlogged_batch(buffer)
+
+
+@metricas.instrumentado("cassandra", filas=lambda resultado: resultado[0])
+def load_sales_records(session, records, batch_size=DEFAULT_BATCH_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                       generation=None, fresh=False):
+    """
+    Escribe un flujo de registros {'nombre', 'categoria', 'ventas'} con lotes UNLOGGED de una
+    sola partición, enviados de forma concurrente, y al final los totales agregados.
+    generation: juego de tablas destino; por defecto, el que leen las consultas.
+    fresh: la generación estaba vacía, así que los totales se escriben sin leer nada; si no,
+    antes de escribir cada restaurante se leen sus ventas guardadas y a los totales se les
+    suma solo la diferencia (cargar una parte del CSV no pisa los totales del resto, y
+    repetir una carga no los duplica).
+    Devuelve (lotes exitosos, lista de ((tabla, partición), error)).
+    """
+    if generation is None:
+        generation = active_generation(session)
+    insert_statements = prepare_insert_statements(session, generation)
+    rollup = new_rollup()
+
+    def acumulando():
+        if fresh:
+            for record in records:
+                accumulate_rollup(rollup, record.get('categoria'), record['ventas'])
+                yield record
+            return
+        for record, previous in with_previous(session, records, generation):
+            accumulate_overwrite(rollup, record, previous)
+            yield dict(record, previous=previous and previous['ventas'])
+
+    def requests():
+        for key, batch in partition_batches(acumulando(), insert_statements, batch_size):
+            yield key, batch, None
+
+    try:
+        exitosos, errores = execute_async_bounded(session, requests(), max_in_flight)
+        escribir = write_rollups if fresh else adjust_rollups
+        exitosos_rollup, errores_rollup = escribir(session, rollup, max_in_flight, generation)
+        return exitosos + exitosos_rollup, errores + errores_rollup
+    finally:
+        cache.invalidate("cassandra")
+
+
+@metricas.instrumentado("cassandra", filas=lambda resultado: resultado[0])
+def reload_sales_records(session, records, batch_size=DEFAULT_BATCH_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    Recarga completa sin cortar las lecturas: escribe los registros en una generación nueva
+    de tablas mientras las consultas siguen leyendo la activa, y al terminar sin errores
+    cambia el puntero. Si la carga falla, la generación nueva se elimina y el puntero no se
+    toca. Las generaciones viejas se eliminan al empezar la siguiente recarga.
+    Devuelve (lotes exitosos, lista de ((tabla, partición), error)).
+    """
+    cleanup_generations(session)
+    current = active_generation(session, refresh=True)
+    new = max(existing_generations(session) | {current}) + 1
+    log.info(f"Recargando ventas en la generación {new} (activa: {current})")
+    create_generation(session, new)
+    try:
+        exitosos, errores = load_sales_records(session, records, batch_size, max_in_flight, generation=new,
+                                               fresh=True)
+        if errores:
+            log.error(f"{len(errores)} lotes fallidos; la generación {current} sigue activa")
+            drop_generation(session, new)
+            return exitosos, errores
+        switch_generation(session, current, new)
+    except Exception:
+        drop_generation(session, new)
+        raise
+    finally:
+        cache.invalidate("cassandra")
+    return exitosos, errores
+
+
+@metricas.instrumentado("cassandra", filas=lambda resultado: resultado[0])
+def apply_sales_delta(session, removed, added, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    Aplica en la generación activa solo los restaurantes que cambiaron: borra las filas de
+    `removed` y escribe las de `added` (registros {'nombre', 'categoria', 'ventas'}; un
+    restaurante modificado va en ambas listas con sus valores anterior y nuevo). Los totales
+    por mes y categoría se ajustan con la diferencia en lugar de recalcularse.
+    Devuelve (sentencias exitosas, lista de (clave, error)).
+    """
+    generation = active_generation(session, refresh=True)
+    delta = new_rollup()
+
+    def borrados():
+        for record in removed:
+            accumulate_rollup(delta, record.get('categoria'), [-v for v in record['ventas']])
+            for table, stmt, values in delete_mutations(session, record['nombre'], record['ventas'], generation):
+                yield (table, values[0]), stmt, values
+
+    insert_statements = prepare_insert_statements(session, generation)
+
+    def escrituras():
+        for record in added:
+            accumulate_rollup(delta, record.get('categoria'), record['ventas'])
+            for table, stmt, values in sales_mutations(insert_statements, record['nombre'], record['ventas'],
+                                                       record.get('categoria')):
+                yield (table, values[0]), stmt, values
+
+    # Los borrados terminan antes de escribir, así un restaurante que conserva su nombre
+    # no pierde las filas nuevas
+    try:
+        exitosas, errores = execute_async_bounded(session, borrados(), max_in_flight)
+        if not errores:
+            exitosas_add, errores = execute_async_bounded(session, escrituras(), max_in_flight)
+            exitosas += exitosas_add
+        if not errores:
+            exitosas_rollup, errores = adjust_rollups(session, delta, max_in_flight, generation)
+            exitosas += exitosas_rollup
+        return exitosas, errores
+    finally:
+        cache.invalidate("cassandra")
+
+
+def load_csv_to_cassandra_batched(session, csv_file_path, batch_size=DEFAULT_BATCH_SIZE,
+                                  max_in_flight=DEFAULT_MAX_IN_FLIGHT, reload=False):
+    """
+    Carga el CSV con lotes UNLOGGED por partición. Con reload=True escribe en una generación
+    nueva y cambia el puntero al terminar (ver reload_sales_records). Devuelve un reporte con
+    lotes enviados, filas/seg y particiones que fallaron.
+    """
+    log.info(f"Cargando datos (lotes por partición, batch_size={batch_size}) desde {csv_file_path}")
+    row_errors = {}
+    stats = {'rows': 0}
+
+    start = time.perf_counter()
+    records = read_sales_records(csv_file_path, row_errors, stats)
+    load = reload_sales_records if reload else load_sales_records
+    exitosos, errores = load(session, records, batch_size, max_in_flight)
+    elapsed = time.perf_counter() - start
+
+    total_rows = stats['rows']
+    loaded_rows = total_rows - len(row_errors)
+
+    report = {
+        'rows': total_rows,
+        'rows_loaded': loaded_rows,
+        'batches': exitosos,
+        'errors': row_errors,
+        'failed_partitions': [(table, partition, str(exc)) for (table, partition), exc in errores],
+        'seconds': elapsed,
+        'rows_per_sec': loaded_rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+    log.info(f"Carga por lotes: {exitosos} lotes, {loaded_rows}/{total_rows} filas en {elapsed:.2f}s "
+             f"({report['rows_per_sec']:.1f} filas/seg)")
+    print(f"Importación completada: {loaded_rows}/{total_rows} filas en {exitosos} lotes, "
+          f"{report['rows_per_sec']:.1f} filas/seg")
+    for line_number, messages in sorted(row_errors.items()):
+        log.error(f"Fila {line_number}: {'; '.join(messages)}")
+        print(f"- Error en fila {line_number}: {'; '.join(messages)}")
+    for table, partition, message in report['failed_partitions']:
+        log.error(f"Lote fallido en {table} ({partition}): {message}")
+        print(f"- Lote fallido en {table} ({partition}): {message}")
+    return report
+
+
+@metricas.instrumentado("cassandra")
+def load_csv_to_cassandra(session, csv_file_path, concurrent=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                          batched=False, batch_size=DEFAULT_BATCH_SIZE, reload=False):
+    if batched or reload:
+        return load_csv_to_cassandra_batched(session, csv_file_path, batch_size, max_in_flight, reload)
+    if concurrent:
+        return load_csv_to_cassandra_async(session, csv_file_path, max_in_flight)
+
+    log.info(f"Cargando datos desde {csv_file_path}")
+
+    # Insert statements
+    generation = active_generation(session)
+    insert_statements = prepare_insert_statements(session, generation)
+
     try:
+        start = time.perf_counter()
+        total_rows = 0
+        rollup = new_rollup()
         with open(csv_file_path, 'r') as file:
             reader = csv.DictReader(file)
-            for row in reader:
-                restaurant = row.get('nombre', 'Restaurante Desconocido')
-                
-                # Procesar la lista de ventas como lista de enteros
-                ventas_list = eval(row.get('ventas', '[]'))
-                
-                # Insertar ventas para cada mes
-                for month_index, total_sales in enumerate(ventas_list):
-                    month = month_order[month_index]
-                    
-                    # Insertar en las tablas
-                    batch_data = [
-                        (insert_statements['monthly'], [month, restaurant, float(total_sales)]),
-                        (insert_statements['restaurant'], [restaurant, month, float(total_sales)]),
-                        (insert_statements['total'], [month, float(total_sales), restaurant])
-                    ]
-
-                    for prepared_stmt, values in batch_data:
-                        session.execute(prepared_stmt, values)
-
-        log.info("Datos cargados exitosamente en Cassandra.")
-        print("Importación de datos completada exitosamente.")
+            # Procesar la lista de ventas como lista de números
+            records = ({'nombre': row.get('nombre', 'Restaurante Desconocido'), 'categoria': row.get('categoria'),
+                        'ventas': parse_ventas(row.get('ventas'))} for row in reader)
+            # Una lectura de las ventas anteriores por fila, como las escrituras
+            for record, previous in with_previous(session, records, generation, chunk_size=1):
+                # Insertar ventas para cada mes en las tablas
+                for _, prepared_stmt, values in sales_mutations(insert_statements, record['nombre'], record['ventas'],
+                                                                record['categoria'],
+                                                                previous and previous['ventas']):
+                    session.execute(prepared_stmt, values)
+                accumulate_overwrite(rollup, record, previous)
+                total_rows += 1
+
+        adjust_rollups(session, rollup, generation=generation)
+
+        elapsed = time.perf_counter() - start
+        rows_per_sec = total_rows / elapsed if elapsed > 0 else 0.0
+        log.info(f"Datos cargados exitosamente en Cassandra ({rows_per_sec:.1f} filas/seg).")
+        print(f"Importación de datos completada exitosamente ({total_rows} filas, {rows_per_sec:.1f} filas/seg).")
         
     except Exception as e:
         log.error(f"Error al cargar los datos: {str(e)}")
         print(f"Error al cargar los datos: {str(e)}")
+    finally:
+        cache.invalidate("cassandra")
 
+@metricas.instrumentado("cassandra")
 def drop_data(session):
     log.info("Eliminando todas las tablas para limpiar los datos")
-    tables_to_drop = [
-        'sales_by_restaurant',
-        'sales_by_month',
-        'sales_by_total'
-    ]
-    
-    for table in tables_to_drop:
+    for generation in sorted(existing_generations(session)):
         try:
-            session.execute(f"DROP TABLE IF EXISTS {table}")
-            log.info(f"Tabla eliminada: {table}")
+            drop_generation(session, generation)
         except Exception as e:
-            log.error(f"Error al eliminar la tabla {table}: {str(e)}")
-    
+            log.error(f"Error al eliminar la generación {generation}: {str(e)}")
+
+    # El puntero vuelve a la generación 0, que create_schema crea vacía
+    session.execute(RESET_ACTIVE_GENERATION, [POINTER_NAME])
     create_schema(session)
-    print("Data de Cassandra eliminada")
\ No newline at end of file
+    cache.invalidate("cassandra")
+    print("Data de Cassandra eliminada")
@@ -2,8 +2,50 @@ import pydgraph
 import csv
 import os
 import json
+import logging
+import itertools
 import random
+import time
 import unicodedata
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+import cache
+import metricas
+
+# Set logger
+log = logging.getLogger()
+
+# Versión del esquema; incrementarla al cambiar configurar_esquema
+SCHEMA_VERSION = 2
+
+# Nodos o aristas por mutación, transacciones concurrentes y reintentos ante abortos
+CHUNK_SIZE = 1000
+# Nodos por bloque upsert (cada nodo agrega variables a la consulta del bloque)
+UPSERT_CHUNK_SIZE = 250
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+# Mutaciones enviadas o en espera a la vez: acota la memoria al leer flujos de nodos o aristas
+MAX_IN_FLIGHT = 2 * MAX_WORKERS
+
+# Usuarios procesados por lote al generar relaciones
+EDGE_BATCH_SIZE = 100000
+
+# Fila devuelta por las consultas de restaurantes por ciudad
+RestaurantFollowers = namedtuple("RestaurantFollowers", ["name", "followers"])
+
+# Predicados que son relaciones entre nodos
+EDGE_PREDICATES = ("Ciudad", "sigue_user", "sigue_restaurantes", "esta_en", "followers", "restaurantes")
+SCALAR_PREDICATES = ("xid", "Name", "Email", "restaurant_name", "categoria", "rating", "City_name")
+
+# Aristas que se guardan en los dos sentidos: al reemplazar las relaciones de un nodo
+# también se borra la arista inversa que llega a él
+INVERSE_PREDICATES = {"esta_en": "restaurantes", "restaurantes": "esta_en",
+                      "sigue_restaurantes": "followers", "followers": "sigue_restaurantes"}
+
+# Predicados propios de un restaurante (se borran al eliminarlo; sin el xid el nodo vacío
+# seguiría apareciendo en las búsquedas por xid)
+RESTAURANT_PREDICATES = ("xid", "restaurant_name", "categoria", "rating", "followers", "esta_en")
 
 def configurar_esquema(client):
     schema = """
@@ -45,12 +87,34 @@ def configurar_esquema(client):
     esta_en: [uid] @reverse .
 
     City_name: string @index(term) .
+
+    # Identificador externo estable ("user1", "restaurante1", "city1") para las cargas con upsert
+    xid: string @index(exact) @upsert .
+
+    schema_version: int .
     
     """
 
     return client.alter(pydgraph.Operation(schema=schema))
 
 
+def ensure_schema(client):
+    """
+    Aplica configurar_esquema solo si la versión guardada en el grafo es menor que
+    SCHEMA_VERSION (o no existe, por ejemplo tras drop_all). Devuelve True si se aplicó.
+    """
+    res = client.txn(read_only=True).query("{ version(func: has(schema_version)) { uid schema_version } }")
+    nodos = json.loads(res.json).get("version", [])
+    if nodos and nodos[0]["schema_version"] >= SCHEMA_VERSION:
+        return False
+
+    log.info(f"Actualizando el esquema de Dgraph a la versión {SCHEMA_VERSION}")
+    configurar_esquema(client)
+    nodo = {"uid": nodos[0]["uid"] if nodos else "_:schema_version", "schema_version": SCHEMA_VERSION}
+    mutate_con_reintentos(client, set_obj=nodo)
+    return True
+
+
 def normalizeString(string):
     if string=='Ciudad de Mexico':
         return string
@@ -74,59 +138,51 @@ def cargar_datos(csv_file):
 
 
 
+def usuario_nodo(dato):
+    return {
+        "uid": f"_:user{dato.get('id', 0)}",  # Asignar un UID dinámico, pero será el mismo para las relaciones
+        "xid": f"user{dato.get('id', 0)}",
+        "Name": dato.get("nombre"),
+        "Email": dato.get("email"),
+        "Seguidores": int(dato.get("seguidores", 0)),
+        "Ciudad": dato.get("zona"),
+        'sigue_user': [],
+        'sigue_restaurantes': []
+    }
+
+
+def restaurante_nodo(dato):
+    return {
+        'uid': f"_:restaurante{dato.get('id', 0)}",  # Asignar un UID dinámico
+        'xid': f"restaurante{dato.get('id', 0)}",
+        "restaurant_name": dato.get('nombre'),
+        'categoria': dato.get('categoria'),
+        'rating': float(dato.get('rating')),
+        'followers': [],
+        "esta_en": []  # Se rellenará con zonas después
+    }
+
+
+def zona_nodo(dato):
+    return {
+        'uid': f"_:city{dato.get('id')}",  # Asignar un UID dinámico para cada zona
+        'xid': f"city{dato.get('id')}",
+        'City_name': dato.get('nombre'),
+        "restaurantes": []  # Se rellenará con restaurantes después
+    }
+
+
 def procesar_usuarios(csvfile):
     # Leer los datos del CSV
-    usuariosruta = csvfile
-    datos = cargar_datos(usuariosruta)
-
-    usuarios = []
-    for dato in datos:
-        # Crear el usuario
-        usuario = {
-            "uid": f"_:user{dato.get('id', 0)}",  # Asignar un UID dinámico, pero será el mismo para las relaciones
-            "Name": dato.get("nombre"),
-            "Email": dato.get("email"),
-            "Seguidores": int(dato.get("seguidores", 0)),
-            "Ciudad": dato.get("zona"),
-            'sigue_user': [],
-            'sigue_restaurantes': []
-        }
-        usuarios.append(usuario)
-
-    return usuarios
+    return [usuario_nodo(dato) for dato in cargar_datos(csvfile)]
 
 
 def procesar_restaurantes(csvfile):
-    datos = cargar_datos(csvfile)
-    restaurantes = []
-    for dato in datos:
-        restaurante = {
-            'uid': f"_:restaurante{dato.get('id', 0)}",  # Asignar un UID dinámico
-            "restaurant_name": dato.get('nombre'),
-            'categoria': dato.get('categoria'),
-            'rating': float(dato.get('rating')),
-            'followers': [],
-            "esta_en": []  # Se rellenará con zonas después
-        }
-        restaurantes.append(restaurante)
-
-    
-    return restaurantes
+    return [restaurante_nodo(dato) for dato in cargar_datos(csvfile)]
 
 
 def procesar_zonas(csvfile):
-    datos = cargar_datos(csvfile)
-    zonas = []
-    for dato in datos:
-        zona = {
-            'uid': f"_:city{dato.get('id')}",  # Asignar un UID dinámico para cada zona
-            'City_name': dato.get('nombre'),
-            "restaurantes": []  # Se rellenará con restaurantes después
-        }
-        zonas.append(zona)
-
-    
-    return zonas
+    return [zona_nodo(dato) for dato in cargar_datos(csvfile)]
 
 
 def crear_relaciones(usuarios, restaurantes, zonas):
@@ -145,10 +201,11 @@ def crear_relaciones(usuarios, restaurantes, zonas):
         restaurante["followers"] = []
 
     # Asignar relaciones para cada usuario
-    for usuario in usuarios:
-        # Asignar a 5 usuarios que sigue (si hay suficientes usuarios)
-        usuarios_a_seguir = random.sample([u for u in usuarios if u["uid"] != usuario["uid"]], min(5, len(usuarios) - 1))
-        usuario["sigue_user"] = [u["uid"] for u in usuarios_a_seguir]  # Relacionar usuario con otros usuarios
+    for idx, usuario in enumerate(usuarios):
+        # Asignar a 5 usuarios que sigue (si hay suficientes usuarios), sin copiar la lista
+        # de usuarios: se muestrean índices de los demás y se salta el propio
+        indices = random.sample(range(len(usuarios) - 1), min(5, len(usuarios) - 1))
+        usuario["sigue_user"] = [usuarios[i + (i >= idx)]["uid"] for i in indices]  # Relacionar usuario con otros usuarios
 
         # Asignar a 6 restaurantes que sigue
         restaurantes_a_seguir = random.sample(restaurantes, min(6, len(restaurantes)))
@@ -165,112 +222,463 @@ def crear_relaciones(usuarios, restaurantes, zonas):
     return usuarios, restaurantes, zonas
 
 
-def agregar_datos(client, usuarios, restaurantes, zonas):
-    txn = client.txn()
+def pesos_popularidad(n, distribucion="uniforme", alpha=1.2, rng=None):
+    """
+    Probabilidad de que cada uno de n nodos sea elegido como destino.
+    "uniforme": todos igual; "powerlaw": ley de potencia (Zipf) con exponente alpha,
+    asignada a los nodos en orden aleatorio para que los populares no sean siempre los primeros.
+    """
+    if distribucion == "uniforme":
+        return None
+    if distribucion != "powerlaw":
+        raise ValueError(f"Distribución no soportada: {distribucion}")
+    rng = rng or np.random.default_rng()
+    pesos = 1.0 / np.arange(1, n + 1) ** alpha
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
 
-    # Crear una lista de mutaciones
-    nodos = []
 
-    # Mutaciones para usuarios
-    for usuario in usuarios:
-        nodo_usuario = {
-            "uid": usuario["uid"],  # Usar el UID existente
-            "Name": usuario["Name"],
-            "Email": usuario["Email"],
-            "Ciudad": {"uid": usuario.get("Ciudad")},  # Relación con zona
-            "sigue_user": [{"uid": uid} for uid in usuario.get("sigue_user", [])],  # Relación con otros usuarios
-            "sigue_restaurantes": [{"uid": uid} for uid in usuario.get("sigue_restaurantes", [])],  # Relación con restaurantes
-        }
-        nodos.append(nodo_usuario)
+def grados_salida(rng, n, media, distribucion="fijo"):
+    """
+    Número de aristas que sale de cada uno de n nodos: "fijo" (siempre media) o "poisson".
+    """
+    if distribucion == "fijo":
+        return np.full(n, media, dtype=np.int64)
+    if distribucion == "poisson":
+        return rng.poisson(media, n)
+    raise ValueError(f"Distribución de grado no soportada: {distribucion}")
 
-    # Mutaciones para restaurantes
-    for restaurante in restaurantes:
-        nodo_restaurante = {
-            "uid": restaurante["uid"],  # Usar el UID existente
-            "restaurant_name": restaurante["restaurant_name"],
-            "categoria": restaurante["categoria"],
-            "rating": restaurante["rating"],
-            "esta_en": {"uid": restaurante.get("esta_en")},  # Relación con la zona
-            "followers": [{"uid": follower_uid} for follower_uid in restaurante.get("followers", [])],  # Relación con seguidores
-        }
-        nodos.append(nodo_restaurante)
-
-    # Mutaciones para zonas
-    for zona in zonas:
-        nodo_zona = {
-            "uid": zona["uid"],  # Usar el UID existente
-            "City_name": zona["City_name"],
-            "restaurantes": [{"uid": uid} for uid in zona.get("restaurantes", [])],  # Relación con restaurantes
-        }
-        nodos.append(nodo_zona)
 
-    # Crear la mutación en lote
-    response = txn.mutate(set_obj=nodos)
-    
+def _triples(uids_origen, predicado, uids_destino, origen, destino):
+    for a, b in zip(uids_origen[origen], uids_destino[destino]):
+        yield a, predicado, b
+
+
+def generar_aristas(usuarios, restaurantes, zonas, sigue_usuarios=5, sigue_restaurantes=6,
+                    popularidad="uniforme", alpha=1.2, grado="fijo", batch_size=EDGE_BATCH_SIZE, seed=None):
+    """
+    Genera en flujo las aristas (origen, predicado, destino) del grafo social con NumPy,
+    procesando los usuarios por lotes. No modifica los diccionarios de los nodos.
+
+    - esta_en / restaurantes: cada restaurante en una ciudad al azar.
+    - Ciudad: cada usuario en una ciudad al azar.
+    - sigue_user: sigue_usuarios por usuario (nunca a sí mismo).
+    - sigue_restaurantes / followers: sigue_restaurantes por usuario.
+    popularidad ("uniforme" o "powerlaw") decide qué destinos reciben más seguidores y
+    grado ("fijo" o "poisson") cuántas aristas salen de cada usuario.
+    """
+    rng = np.random.default_rng(seed)
+    uids_usuarios = np.array([u["uid"] for u in usuarios], dtype=object)
+    uids_restaurantes = np.array([r["uid"] for r in restaurantes], dtype=object)
+    uids_zonas = np.array([z["uid"] for z in zonas], dtype=object)
+    n_usuarios, n_restaurantes, n_zonas = len(uids_usuarios), len(uids_restaurantes), len(uids_zonas)
+
+    # Restaurantes en ciudades
+    if n_zonas:
+        for inicio in range(0, n_restaurantes, batch_size):
+            origen = np.arange(inicio, min(inicio + batch_size, n_restaurantes))
+            destino = rng.integers(0, n_zonas, len(origen))
+            yield from _triples(uids_restaurantes, "esta_en", uids_zonas, origen, destino)
+            yield from _triples(uids_zonas, "restaurantes", uids_restaurantes, destino, origen)
+
+    p_usuarios = pesos_popularidad(n_usuarios, popularidad, alpha, rng) if n_usuarios > 1 else None
+    p_restaurantes = pesos_popularidad(n_restaurantes, popularidad, alpha, rng) if n_restaurantes else None
+
+    for inicio in range(0, n_usuarios, batch_size):
+        lote = np.arange(inicio, min(inicio + batch_size, n_usuarios))
+
+        if n_zonas:
+            destino = rng.integers(0, n_zonas, len(lote))
+            yield from _triples(uids_usuarios, "Ciudad", uids_zonas, lote, destino)
+
+        if n_usuarios > 1:
+            grados = np.minimum(grados_salida(rng, len(lote), sigue_usuarios, grado), n_usuarios - 1)
+            origen = np.repeat(lote, grados)
+            if p_usuarios is None:
+                # Desplazamiento en [1, n) para no elegir nunca al propio usuario
+                destino = (origen + rng.integers(1, n_usuarios, len(origen))) % n_usuarios
+            else:
+                destino = rng.choice(n_usuarios, len(origen), p=p_usuarios)
+                propios = destino == origen
+                destino[propios] = (destino[propios] + 1) % n_usuarios
+            yield from _triples(uids_usuarios, "sigue_user", uids_usuarios, origen, destino)
+
+        if n_restaurantes:
+            grados = np.minimum(grados_salida(rng, len(lote), sigue_restaurantes, grado), n_restaurantes)
+            origen = np.repeat(lote, grados)
+            destino = rng.choice(n_restaurantes, len(origen), p=p_restaurantes)
+            yield from _triples(uids_usuarios, "sigue_restaurantes", uids_restaurantes, origen, destino)
+            yield from _triples(uids_restaurantes, "followers", uids_usuarios, destino, origen)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _en_paralelo(funcion, chunks, max_workers=MAX_WORKERS, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Genera funcion(chunk) de cada chunk, ejecutadas en max_workers hilos, en orden de
+    finalización. Se toma un chunk nuevo del flujo solo cuando hay menos de max_in_flight
+    pendientes, así la memoria depende de la ventana y no del tamaño del flujo.
+    """
+    funcion = metricas.propagar(funcion)
+    max_in_flight = max(max_in_flight, max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pendientes = set()
+        for chunk in chunks:
+            if len(pendientes) >= max_in_flight:
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                for future in listos:
+                    yield future.result()
+            pendientes.add(executor.submit(funcion, chunk))
+        while pendientes:
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for future in listos:
+                yield future.result()
+
+
+def mutate_con_reintentos(client, retries=MAX_RETRIES, **mutacion):
+    """
+    Ejecuta una mutación en su propia transacción (commit_now) y la reintenta con
+    espera exponencial si Dgraph la aborta por conflicto. Devuelve el mapa de UIDs.
+    """
+    for intento in range(retries):
+        txn = client.txn()
+        try:
+            metricas.registrar("dgraph")
+            response = txn.mutate(commit_now=True, **mutacion)
+            return dict(response.uids)
+        except pydgraph.AbortedError:
+            if intento == retries - 1:
+                raise
+            time.sleep(0.05 * 2 ** intento)
+        finally:
+            txn.discard()
+
+
+def upsert_con_reintentos(client, query, retries=MAX_RETRIES, variables=None, **mutacion):
+    """
+    Ejecuta un bloque upsert (una consulta y una mutación que usa sus variables con uid())
+    en una transacción con commit_now, con los mismos reintentos que mutate_con_reintentos.
+    Devuelve la respuesta: uids con los nodos creados y json con el resultado de la consulta.
+    """
+    for intento in range(retries):
+        txn = client.txn()
+        try:
+            metricas.registrar("dgraph")
+            request = txn.create_request(query=query, variables=variables,
+                                         mutations=[txn.create_mutation(**mutacion)], commit_now=True)
+            return txn.do_request(request)
+        except pydgraph.AbortedError:
+            if intento == retries - 1:
+                raise
+            time.sleep(0.05 * 2 ** intento)
+        finally:
+            txn.discard()
+
+
+def agregar_nodos(client, nodos, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS):
+    """
+    Crea los nodos (solo predicados escalares) en mutaciones de chunk_size ejecutadas
+    en paralelo. Devuelve el mapa de nodo en blanco ("_:user1") a UID real.
+    """
+    def mutar(chunk):
+        uids = mutate_con_reintentos(client, set_obj=chunk)
+        return {f"_:{blank}": uid for blank, uid in uids.items()}
+
+    uid_map = {}
+    for parcial in _en_paralelo(mutar, _chunks(nodos, chunk_size), max_workers):
+        uid_map.update(parcial)
+    return uid_map
+
+
+def _literal(valor):
+    if isinstance(valor, int):
+        return f'"{valor}"^^<xs:int>'
+    if isinstance(valor, float):
+        return f'"{valor}"^^<xs:float>'
+    return json.dumps(str(valor))
+
+
+def upsert_request(nodos, reemplazar_relaciones=True):
+    """
+    Construye (consulta, set_nquads, del_nquads) de un bloque upsert que busca cada nodo por
+    su xid y actualiza sus predicados escalares, o lo crea si no existe.
+
+    Con reemplazar_relaciones, a los nodos que ya existían se les borran las aristas de sus
+    predicados de relación (y las inversas que llegan a ellos), para que las que se escriben
+    después las reemplacen en lugar de acumularse.
+    """
+    bloques = []
+    set_nquads = []
+    del_nquads = []
+    xids = []
+    for i, nodo in enumerate(nodos):
+        escalares, _ = separar_nodo(nodo)
+        xid = escalares["xid"]
+        xids.append(xid)
+        inversas = []
+        if reemplazar_relaciones:
+            for predicado in EDGE_PREDICATES:
+                if predicado not in nodo:
+                    continue
+                del_nquads.append(f"uid(n{i}) <{predicado}> * .")
+                if predicado in INVERSE_PREDICATES:
+                    inversas.append(f"e{i}_{predicado} as {predicado}")
+                    del_nquads.append(f"uid(e{i}_{predicado}) <{INVERSE_PREDICATES[predicado]}> uid(n{i}) .")
+        cuerpo = f" {{ {' '.join(inversas)} }}" if inversas else ""
+        bloques.append(f"n{i} as var(func: eq(xid, {json.dumps(xid)})){cuerpo}")
+        # categoria es una lista: se borra el valor anterior (los borrados se aplican antes que los set)
+        if "categoria" in escalares:
+            del_nquads.append(f"uid(n{i}) <categoria> * .")
+        for predicado, valor in escalares.items():
+            if predicado != "uid" and valor is not None:
+                set_nquads.append(f"uid(n{i}) <{predicado}> {_literal(valor)} .")
+    bloques.append(f"existentes(func: eq(xid, {json.dumps(xids)})) {{ uid xid }}")
+    query = "{\n    " + "\n    ".join(bloques) + "\n}"
+    return query, "\n".join(set_nquads), "\n".join(del_nquads)
+
+
+def upsert_nodos(client, nodos, chunk_size=UPSERT_CHUNK_SIZE, max_workers=MAX_WORKERS,
+                 reemplazar_relaciones=True):
+    """
+    Crea o actualiza los nodos por su xid con bloques upsert de chunk_size nodos ejecutados
+    en paralelo, así repetir la carga no duplica el grafo. Devuelve el mapa de nodo en
+    blanco ("_:user1") a UID real, tanto de los nodos creados como de los que ya existían.
+    """
+    def mutar(chunk):
+        query, set_nquads, del_nquads = upsert_request(chunk, reemplazar_relaciones)
+        response = upsert_con_reintentos(client, query, set_nquads=set_nquads, del_nquads=del_nquads or None)
+        existentes = {nodo["xid"]: nodo["uid"] for nodo in json.loads(response.json or "{}").get("existentes", [])}
+        return {nodo["uid"]: existentes.get(nodo["xid"]) or response.uids[f"uid(n{i})"]
+                for i, nodo in enumerate(chunk)}
+
+    uid_map = {}
+    for parcial in _en_paralelo(mutar, _chunks(nodos, chunk_size), max_workers):
+        uid_map.update(parcial)
+    return uid_map
+
+
+def agregar_aristas(client, uid_map, aristas, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS):
+    """
+    Escribe aristas (origen, predicado, destino) como N-Quads usando los UIDs ya creados,
+    así las relaciones funcionan aunque los nodos se hayan creado en mutaciones distintas.
+    Devuelve el número de aristas escritas.
+    """
+    def nquads():
+        for origen, predicado, destino in aristas:
+            if origen in uid_map and destino in uid_map:
+                yield f"<{uid_map[origen]}> <{predicado}> <{uid_map[destino]}> ."
 
-    # Confirmar la transacción
-    txn.commit()
-    print("Data de dgraph creada")
+    def mutar(chunk):
+        mutate_con_reintentos(client, set_nquads="\n".join(chunk))
+        return len(chunk)
 
+    return sum(_en_paralelo(mutar, _chunks(nquads(), chunk_size), max_workers))
 
 
-def Top_3_restaurants_by_followers(client, order):
-    query = """
-    {
-        all(func: has(restaurant_name)) {
+def separar_nodo(nodo):
+    """
+    Divide un nodo en sus predicados escalares y sus aristas (origen, predicado, destino).
+    """
+    escalares = {}
+    aristas = []
+    for predicado, valor in nodo.items():
+        if predicado == "uid" or predicado in SCALAR_PREDICATES:
+            escalares[predicado] = valor
+        if predicado not in EDGE_PREDICATES:
+            continue
+        for destino in (valor if isinstance(valor, list) else [valor]):
+            if destino:
+                aristas.append((nodo["uid"], predicado, destino))
+    return escalares, aristas
+
+
+@metricas.instrumentado("dgraph", filas=len)
+def agregar_datos(client, usuarios, restaurantes, zonas, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS,
+                  aristas=None, upsert=True):
+    """
+    aristas es un flujo opcional de (origen, predicado, destino), por ejemplo de
+    generar_aristas, que se escribe además de las relaciones guardadas en los nodos.
+
+    Con upsert=True los nodos se identifican por su xid: una carga repetida o parcial
+    actualiza los nodos existentes y reemplaza sus relaciones en lugar de duplicarlos.
+    upsert=False crea nodos nuevos sin consultar (solo para un grafo vacío, tras drop_all).
+    """
+    # Primero los nodos, en mutaciones acotadas; después las aristas ya con UIDs reales
+    nodos = []
+    relaciones = []
+    for nodo in (*usuarios, *restaurantes, *zonas):
+        escalares, aristas_nodo = separar_nodo(nodo)
+        nodos.append(escalares)
+        relaciones.extend(aristas_nodo)
+
+    if upsert:
+        # upsert_request necesita los nodos completos para saber qué relaciones reemplazar
+        uid_map = upsert_nodos(client, [*usuarios, *restaurantes, *zonas], min(chunk_size, UPSERT_CHUNK_SIZE),
+                               max_workers)
+    else:
+        uid_map = agregar_nodos(client, nodos, chunk_size, max_workers)
+    todas = relaciones if aristas is None else itertools.chain(relaciones, aristas)
+    total_aristas = agregar_aristas(client, uid_map, todas, chunk_size, max_workers)
+    cache.invalidate("dgraph")
+    print(f"Data de dgraph creada: {len(uid_map)} nodos, {total_aristas} relaciones")
+    return uid_map
+
+
+ZONAS_QUERY = "{ zonas(func: has(City_name)) { uid } }"
+
+
+@metricas.instrumentado("dgraph")
+def aplicar_cambios_restaurantes(client, agregados, modificados, eliminados,
+                                 chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS):
+    """
+    Aplica un delta de restaurantes sin recargar el grafo. Los nodos se buscan por su xid,
+    así el delta sigue siendo válido después de un drop_all y una carga completa.
+
+    - agregados: nodos de restaurante_nodo; se escriben con upsert por xid (repetir la
+      sincronización no los duplica) y cada uno queda en una ciudad al azar del grafo.
+    - modificados: nodos de restaurante_nodo; se actualizan sus predicados escalares y se
+      conservan sus relaciones.
+    - eliminados: xids de los restaurantes a borrar, junto con las aristas que llegan a ellos.
+    Devuelve el mapa de nodo en blanco ("_:restaurante1") a UID de los agregados.
+    """
+    def eliminar(chunk):
+        query = f"{{ r as var(func: eq(xid, {json.dumps(chunk)})) {{ f as followers z as esta_en }} }}"
+        del_nquads = "\n".join([
+            *(f"uid(r) <{predicado}> * ." for predicado in RESTAURANT_PREDICATES),
+            "uid(f) <sigue_restaurantes> uid(r) .",
+            "uid(z) <restaurantes> uid(r) .",
+        ])
+        upsert_con_reintentos(client, query, del_nquads=del_nquads)
+        return len(chunk)
+
+    sum(_en_paralelo(eliminar, _chunks(eliminados, chunk_size), max_workers))
+
+    # Sin las claves de relación upsert_request solo reescribe los escalares (y borra la categoria anterior)
+    escalares = [separar_nodo(nodo)[0] for nodo in modificados]
+    upsert_nodos(client, escalares, min(chunk_size, UPSERT_CHUNK_SIZE), max_workers)
+
+    uid_map = upsert_nodos(client, agregados, min(chunk_size, UPSERT_CHUNK_SIZE), max_workers)
+    zona_uids = []
+    if agregados:
+        res = client.txn(read_only=True).query(ZONAS_QUERY)
+        zona_uids = [zona["uid"] for zona in json.loads(res.json or "{}").get("zonas", [])]
+    if zona_uids:
+        aristas = []
+        for nodo in agregados:
+            zona = random.choice(zona_uids)
+            aristas += [(nodo["uid"], "esta_en", zona), (zona, "restaurantes", nodo["uid"])]
+        agregar_aristas(client, {**uid_map, **{zona: zona for zona in zona_uids}}, aristas, chunk_size, max_workers)
+    cache.invalidate("dgraph")
+    log.info(f"Delta de Dgraph: {len(agregados)} agregados, {len(modificados)} modificados, "
+             f"{len(eliminados)} eliminados")
+    return uid_map
+
+
+def _top_k_query(direction, category, city, paginar=False):
+    """
+    Construye la consulta de ranking. El conteo, el orden y el límite se resuelven en Dgraph;
+    el cursor se aplica filtrando por el último conteo visto y saltando los empates ya devueltos.
+    """
+    orden = "orderdesc" if direction == "desc" else "orderasc"
+    comparador = "le" if direction == "desc" else "ge"
+    params = ["$first: int", "$offset: int"]
+    bloques = []
+    if city:
+        params.append("$city: string")
+        bloques.append("""
+        var(func: allofterms(City_name, $city)) {
+            candidatos as ~esta_en
+        }""")
+        raiz = "uid(candidatos)"
+    else:
+        raiz = "has(restaurant_name)"
+    filtro = ""
+    if category:
+        params.append("$category: string")
+        filtro = "@filter(anyofterms(categoria, $category))"
+    cursor = ""
+    if paginar:
+        params.append("$last: int")
+        cursor = f"@filter({comparador}(val(c), $last))"
+
+    bloques.append(f"""
+        var(func: {raiz}) {filtro} {{
+            c as count(followers)
+        }}
+        top(func: uid(c), {orden}: val(c), first: $first, offset: $offset) {cursor} {{
+            uid
             restaurant_name
-            followers_count: count(followers)
-        }
-    }
+            categoria
+            rating
+            followers: val(c)
+        }}""")
+    return f"query TopK({', '.join(params)}) {{{''.join(bloques)}\n    }}"
+
+
+def top_k_request(k=3, direction="desc", category=None, city=None, cursor=None):
     """
-    try:
-        # Ejecuta la consulta
-        res = client.txn(read_only=True).query(query)
+    Devuelve (consulta, variables) del ranking por seguidores para la página indicada por cursor.
+    """
+    if direction not in ("asc", "desc"):
+        raise ValueError(f"Dirección no válida: {direction}")
 
-        # Decodifica la respuesta JSON
-        response = json.loads(res.json)
-    except Exception as e:
-        print(f"Error durante la consulta o decodificación JSON: {e}")
-        return  # Termina si ocurre un error
+    last, skip = (int(part) for part in cursor.split(":")) if cursor else (0, 0)
+    variables = {"$first": str(k), "$offset": str(skip)}
+    if cursor:
+        variables["$last"] = str(last)
+    if category:
+        variables["$category"] = category
+    if city:
+        variables["$city"] = normalizeString(city)
 
-    # Extrae los datos de restaurantes
-    restaurants = response.get("all", [])
-    if not restaurants:
-        print("No se encontraron restaurantes.")
-        return  # Termina si la lista está vacía
+    return _top_k_query(direction, category, city, paginar=bool(cursor)), variables
 
-    # Ordena los restaurantes según el orden solicitado por el usuario
-    if order == "asc":
-        
-        sorted_restaurants = sorted(restaurants, key=lambda r: r.get('followers_count', 0), reverse=True)
-        
-        
-    elif order == "desc":
-        
-        sorted_restaurants = sorted(restaurants, key=lambda r: r.get('followers_count', 0))
-        
-        
 
-    # Obtén los top 3
-    top_3 = sorted_restaurants[:3]
+def parse_top_k(data, k, cursor=None):
+    """
+    Convierte la respuesta de la consulta de ranking en {"items", "next_cursor"}.
+    """
+    last, skip = (int(part) for part in cursor.split(":")) if cursor else (0, 0)
+    items = data.get("top", [])
+    for item in items:
+        item.setdefault("followers", 0)
 
-    # Muestra los resultados
-    print('-'*40)
-    print(f"Top 3 restaurantes con {'menor' if order == 'desc' else 'mayor'} número de seguidores:")
-    for idx, restaurant in enumerate(top_3, start=1):
-        name = restaurant.get("restaurant_name", "Desconocido")
-        followers = restaurant.get("followers_count", 0)
-        print(f"{idx}. {name} - {followers} seguidores")
-    print('-'*40)
+    next_cursor = None
+    if len(items) == k and items:
+        ultimo = items[-1]["followers"]
+        empates = sum(1 for item in items if item["followers"] == ultimo)
+        # Si toda la página empata con el cursor anterior, acumular los saltos
+        if cursor and ultimo == last:
+            empates += skip
+        next_cursor = f"{ultimo}:{empates}"
 
-    return top_3
+    return {"items": items, "next_cursor": next_cursor}
 
-def get_restaurants_by_city(client, city_name):
-    
-    city_name=normalizeString(city_name)
 
-    query = """
-    
+@metricas.instrumentado("dgraph", filas=lambda top: len(top["items"]))
+def top_restaurants_by_followers(client, k=3, direction="desc", category=None, city=None, cursor=None):
+    """
+    Devuelve los k restaurantes con más (direction="desc") o menos ("asc") seguidores,
+    opcionalmente filtrados por categoría y ciudad. El resultado es
+    {"items": [{"uid", "restaurant_name", "categoria", "rating", "followers"}], "next_cursor": str | None};
+    pasar next_cursor en la siguiente llamada devuelve la página siguiente.
+    """
+    query, variables = top_k_request(k, direction, category, city, cursor)
+    res = client.txn(read_only=True).query(query, variables=variables)
+    metricas.registrar("dgraph", bytes=len(res.json))
+    return parse_top_k(json.loads(res.json), k, cursor)
+
+
+RESTAURANTS_BY_CITY_QUERY = """
     query RestaurantsInCity($city_name: string) {
     city(func: allofterms(City_name, $city_name)) {
         City_name
@@ -280,42 +688,55 @@ def get_restaurants_by_city(client, city_name):
             }
         }
     }
+"""
 
-    """
-    
 
-    variables = {"$city_name": city_name}
-    res = client.txn(read_only=True).query(query, variables=variables)
-    data = json.loads(res.json)
-
-    
+def parse_restaurants_by_city(data):
+    """
+    Convierte la respuesta de RESTAURANTS_BY_CITY_QUERY en una tupla de RestaurantFollowers,
+    o None si la ciudad no existe.
+    """
     city_info = data.get("city", [])
 
-
     if not city_info:
-        print(f"No se encontró la ciudad con el nombre: {city_name}")
-        return []
-    
-    
+        return None
 
     # Obtener la lista de restaurantes
     restaurants = city_info[0].get("~esta_en", [])
-    restaurant_list = [
-        {"name": r.get("restaurant_name"), "followers": r.get("cant_followers", 0)}
+    return tuple(
+        RestaurantFollowers(r.get("restaurant_name"), r.get("cant_followers", 0))
         for r in restaurants
-    ]
-
-    if restaurant_list:
-        print(f"Restaurantes en {city_name}:")
-        print("-" * 40)
-        for idx, restaurant in enumerate(restaurant_list, start=1):
-            print(f"{idx}. {restaurant['name']} - {restaurant['followers']} seguidores")
-        print("-" * 40)
-    else:
-        print(f"No se encontraron restaurantes en la ciudad: {city_name}")
-        
-        return restaurant_list
+    )
+
+
+@cache.cached("restaurants_by_city", group="dgraph")
+def query_restaurants_by_city(client, city_name):
+    """
+    Devuelve una tupla de RestaurantFollowers de la ciudad, o None si la ciudad no existe.
+    """
+    variables = {"$city_name": normalizeString(city_name)}
+    res = client.txn(read_only=True).query(RESTAURANTS_BY_CITY_QUERY, variables=variables)
+    metricas.registrar("dgraph", bytes=len(res.json))
+    return parse_restaurants_by_city(json.loads(res.json))
+
+
+@metricas.instrumentado("dgraph")
+def get_restaurants_by_city(client, city_name):
+    """
+    Genera RestaurantFollowers(name, followers) de los restaurantes de la ciudad.
+    Lanza LookupError si la ciudad no existe.
+    """
+    city_name = normalizeString(city_name)
+    restaurant_list = query_restaurants_by_city(client, city_name)
+
+    if restaurant_list is None:
+        raise LookupError(f"No se encontró la ciudad con el nombre: {city_name}")
+    yield from restaurant_list
+
     
+@metricas.instrumentado("dgraph")
 def drop_all(client):
+    response = client.alter(pydgraph.Operation(drop_all=True))
+    cache.invalidate("dgraph")
     print("Data de dgraph eliminada")
-    return client.alter(pydgraph.Operation(drop_all=True))
\ No newline at end of file
+    return response
\ No newline at end of file
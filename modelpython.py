@@ -1,76 +1,407 @@
+import logging
+from collections import namedtuple
 from pymongo import MongoClient
+from pymongo.collation import Collation
+import cache
+import metricas
+import time
 
+# Set logger
+log = logging.getLogger()
+
+# Documentos por lote al recorrer cursores
+DEFAULT_BATCH_SIZE = 500
+
+# Filas devueltas por las consultas
+Restaurante = namedtuple("Restaurante", ["id", "nombre", "categoria", "rating", "zona_id"])
+ZonaTop = namedtuple("ZonaTop", ["nombre", "restaurantes"])
+
+RESTAURANTE_FIELDS = {"_id": 0, "id": 1, "nombre": 1, "categoria": 1, "rating": 1, "zona_id": 1}
+
+# Versión de los índices guardada en la colección schema_version; incrementarla al cambiarlos
+SCHEMA_VERSION = 2
+SCHEMA_COLLECTION = "schema_version"
+
+# Colecciones materializadas con el top K por zona y por categoría
+ZONE_LEADERBOARD = "top_por_zona"
+CATEGORY_LEADERBOARD = "top_por_categoria"
+LEADERBOARD_K = 10
+
+
+def to_restaurante(documento):
+    return Restaurante(
+        documento.get("id"),
+        documento.get("nombre"),
+        documento.get("categoria"),
+        documento.get("rating"),
+        documento.get("zona_id"),
+    )
+
+
+@metricas.instrumentado("mongodb")
 def delete_all_data(database):
     """
     Elimina todas las colecciones de la base de datos.
     """
     database["zonas"].delete_many({})
     database["restaurantes"].delete_many({})
+    database[ZONE_LEADERBOARD].delete_many({})
+    database[CATEGORY_LEADERBOARD].delete_many({})
+    cache.invalidate("mongodb")
     print("Data de MongoDB eliminada")
 
 
-def top_restaurants_by_zone(database, show_all=True, zone_name=None):
+# Índice compuesto que resuelve el filtro por zona y el orden por rating sin ordenar en memoria
+ZONE_RATING_INDEX = [("zona_id", 1), ("rating", -1)]
+ZONE_RATING_INDEX_NAME = "zona_id_1_rating_-1"
+
+
+def top_by_zone_pipeline(zona_id, n=3):
+    """
+    Pipeline del top n de una zona: $match por zona_id y $sort por rating, ambos cubiertos
+    por el índice (zona_id, rating).
+    """
+    return [
+        {"$match": {"zona_id": zona_id}},  # Filtrar por zona específica
+        {"$sort": {"rating": -1}},          # Ordenar por rating descendente
+        {"$limit": n},                      # Limitar a los n mejores
+        {"$project": RESTAURANTE_FIELDS},
+    ]
+
+
+def top_all_zones_pipeline(n=3, num_zones=None, zone_name=None):
+    """
+    Pipeline sobre zonas que agrega el top n de cada una (num_zones limita cuántas, por id;
+    zone_name se queda solo con esa zona).
+    """
+    pipeline = [{"$match": {"nombre": zone_name}}] if zone_name else []
+    pipeline.append({"$sort": {"id": 1}})
+    if num_zones:
+        pipeline.append({"$limit": num_zones})
+    pipeline += [
+        # Sub-pipeline por zona: igualdad en zona_id + sort + limit sobre el índice compuesto,
+        # así solo se traen n restaurantes por zona en lugar de todos
+        {"$lookup": {
+            "from": "restaurantes",
+            "localField": "id",
+            "foreignField": "zona_id",
+            "pipeline": [
+                {"$sort": {"rating": -1}},
+                {"$limit": n},
+                {"$project": RESTAURANTE_FIELDS},
+            ],
+            "as": "restaurantes"
+        }},
+        {"$project": {"nombre": 1, "restaurantes": 1}},
+    ]
+    return pipeline
+
+
+def zone_top_pipeline(zone_name=None, n=3, leaderboard=True):
+    """
+    Pipeline sobre zonas con el top n de cada una, o solo de zone_name (sin resultados si la
+    zona no existe). Con leaderboard (la vista materializada tiene documentos) y n <= LEADERBOARD_K
+    lee la vista; si no, agrega en vivo sobre restaurantes. Una zona sin restaurantes queda
+    con la lista vacía.
+    """
+    if not leaderboard or n > LEADERBOARD_K:
+        return top_all_zones_pipeline(n, zone_name=zone_name)
+    pipeline = [{"$match": {"nombre": zone_name}}] if zone_name else []
+    pipeline += [
+        {"$sort": {"id": 1}},
+        {"$lookup": {"from": ZONE_LEADERBOARD, "localField": "id", "foreignField": "_id", "as": "top"}},
+        {"$project": {"nombre": 1, "restaurantes": {"$ifNull": [{"$first": "$top.restaurantes"}, []]}}},
+    ]
+    return pipeline
+
+
+def to_zona_top(documento, n=None):
+    return ZonaTop(documento["nombre"], tuple(to_restaurante(r) for r in documento["restaurantes"][:n]))
+
+
+@cache.cached("top_restaurants_by_zone", group="mongodb")
+def query_top_restaurants_by_zone(database, show_all=True, zone_name=None, batch_size=DEFAULT_BATCH_SIZE,
+                                  n=3, num_zones=None):
+    """
+    Devuelve una tupla de ZonaTop con los n restaurantes de mayor rating de cada zona,
+    o None si la zona no existe. num_zones limita cuántas zonas (por id) se devuelven;
+    None devuelve todas.
+    """
     zonas_collection = database["zonas"]
     restaurantes_collection = database["restaurantes"]
 
     if show_all:
-        # Obtener las primeras 5 zonas con un pipeline de agregación
-        zonas = zonas_collection.aggregate([
-            {"$limit": 5},  # Limitar a las primeras 5 zonas
-            {"$lookup": {   # Unir restaurantes relacionados
-                "from": "restaurantes",
-                "localField": "id",
-                "foreignField": "zona_id",
-                "as": "restaurantes"
-            }},
-            {"$project": {
-                "nombre": 1,
-                "restaurantes": {"$slice": ["$restaurantes", 3]}  # Limitar a los 3 mejores
-            }}
-        ])
-        for zona in zonas:
-            print(f"Zona: {zona['nombre']}")
-            for restaurante in zona["restaurantes"]:
-                print(f"- {restaurante['nombre']} (Rating: {restaurante['rating']})")
-    else:
-        if not zone_name:
-            print("Debes proporcionar el nombre de la zona.")
+        zonas = zonas_collection.aggregate(top_all_zones_pipeline(n, num_zones), batchSize=batch_size)
+        return tuple(to_zona_top(zona) for zona in zonas)
+
+    zona = zonas_collection.find_one({"nombre": zone_name})
+    if not zona:
+        return None
+
+    restaurantes = restaurantes_collection.aggregate(top_by_zone_pipeline(zona["id"], n), batchSize=batch_size)
+    return (ZonaTop(zona["nombre"], tuple(to_restaurante(r) for r in restaurantes)),)
+
+
+@metricas.instrumentado("mongodb")
+def top_restaurants_by_zone(database, show_all=True, zone_name=None, batch_size=DEFAULT_BATCH_SIZE,
+                            n=3, num_zones=None):
+    """
+    Genera ZonaTop(nombre, restaurantes) con el top n de cada zona.
+    Lanza ValueError si falta el nombre y LookupError si la zona no existe.
+    """
+    if not show_all and not zone_name:
+        raise ValueError("Debes proporcionar el nombre de la zona.")
+
+    zonas = query_top_restaurants_by_zone(database, show_all, zone_name, batch_size, n, num_zones)
+    if zonas is None:
+        raise LookupError(f"No se encontró la zona con el nombre '{zone_name}'.")
+    yield from zonas
+
+
+def _plan_stages(plan):
+    """
+    Recorre un plan de explain y genera (etapa, nombre del índice) de cada nodo.
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"], plan.get("indexName")
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+def explain_top_by_zone(database, zona_id=None, n=3):
+    """
+    Ejecuta explain (executionStats) sobre la agregación real de zonas con el $lookup del top n
+    (top_all_zones_pipeline), limitada a la zona zona_id o a la primera por id.
+    El plan de la sub-pipeline del $lookup no aparece en queryPlanner: se lee de las estadísticas
+    de la etapa (MongoDB 5+). indexesUsed debe incluir el índice (zona_id, rating) y, sin un SORT
+    en memoria, cada búsqueda examina como mucho n restaurantes en lugar de toda la zona.
+    Devuelve {"uses_index", "in_memory_sort", "stages", "docs_examined", "lookups"}.
+    """
+    pipeline = top_all_zones_pipeline(n, num_zones=1)
+    if zona_id is not None:
+        pipeline.insert(0, {"$match": {"id": zona_id}})
+    explain = database.command(
+        "explain", {"aggregate": "zonas", "pipeline": pipeline, "cursor": {}}, verbosity="executionStats"
+    )
+    etapas = [documento for documento in _walk_dicts(explain) if "$lookup" in documento]
+    # nReturned de la etapa es el número de zonas, es decir, de ejecuciones de la sub-pipeline
+    lookups = sum(etapa.get("nReturned", 0) for etapa in etapas)
+    docs_examined = sum(etapa.get("totalDocsExamined", 0) for etapa in etapas)
+    return {
+        "uses_index": bool(etapas) and all(
+            ZONE_RATING_INDEX_NAME in etapa.get("indexesUsed", []) and not etapa.get("collectionScans")
+            for etapa in etapas
+        ),
+        "in_memory_sort": docs_examined > n * lookups,
+        "stages": [stage for stage, _ in _plan_stages(explain)] + ["$lookup"] * len(etapas),
+        "docs_examined": docs_examined,
+        "lookups": lookups,
+    }
+
+
+def _walk_dicts(document):
+    if isinstance(document, dict):
+        yield document
+        for value in document.values():
+            yield from _walk_dicts(value)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _walk_dicts(value)
+
+
+
+# Collation insensible a mayúsculas/minúsculas; el índice y la consulta deben usar la misma
+CATEGORY_COLLATION = Collation(locale="es", strength=2)
+CATEGORY_RATING_INDEX = [("categoria", 1), ("rating", -1)]
+
+
+@cache.cached("top_restaurants_by_category", group="mongodb")
+def query_top_restaurants_by_category(db, category, batch_size=DEFAULT_BATCH_SIZE, n=3):
+    """
+    Devuelve (número de restaurantes de la categoría, top n por rating) en una sola
+    agregación: $match y $sort usan el índice (categoria, rating) con collation y $facet
+    calcula el conteo y el top a la vez.
+    """
+    resultado = db["restaurantes"].aggregate(top_by_category_pipeline(category, n),
+                                             collation=CATEGORY_COLLATION, batchSize=batch_size)
+    return parse_category_facet(next(resultado, None))
+
+
+def top_by_category_pipeline(category, n=3):
+    return [
+        {"$match": {"categoria": category}},
+        {"$sort": {"rating": -1}},
+        {"$facet": {
+            "total": [{"$count": "n"}],
+            "top": [{"$limit": n}, {"$project": RESTAURANTE_FIELDS}],
+        }},
+    ]
+
+
+def parse_category_facet(facet):
+    """
+    Convierte el documento de $facet en (número de restaurantes, tupla de Restaurante).
+    """
+    facet = facet or {"total": [], "top": []}
+    num_restaurantes = facet["total"][0]["n"] if facet["total"] else 0
+    return num_restaurantes, tuple(to_restaurante(r) for r in facet["top"])
+
+
+@metricas.instrumentado("mongodb")
+def top_restaurants_by_category(db, category, batch_size=DEFAULT_BATCH_SIZE, n=3):
+    """
+    Genera el top n de restaurantes (Restaurante) según la categoría.
+    """
+    _, restaurantes = query_top_restaurants_by_category(db, category, batch_size, n)
+    yield from restaurantes
+
+
+def create_indexes(database):
+    """
+    Crea los índices de las consultas y de las vistas materializadas.
+    """
+    # Índice en 'categoria' con collation, para búsquedas sin distinguir mayúsculas/minúsculas
+    database["restaurantes"].create_index(CATEGORY_RATING_INDEX, collation=CATEGORY_COLLATION)
+    database["restaurantes"].create_index([("rating", -1)])    # Índice en 'rating'
+    # Índice compuesto para el top por zona (también sirve para filtrar solo por 'zona_id')
+    database["restaurantes"].create_index(ZONE_RATING_INDEX)
+    # Índice en 'id' para las actualizaciones y borrados de la sincronización incremental
+    database["restaurantes"].create_index([("id", 1)])
+    database[ZONE_LEADERBOARD].create_index([("nombre", 1)])
+
+
+def ensure_schema(database):
+    """
+    Crea los índices solo si la versión guardada es menor que SCHEMA_VERSION.
+    Devuelve True si se crearon.
+    """
+    documento = database[SCHEMA_COLLECTION].find_one({"_id": "mongodb"})
+    if documento and documento["version"] >= SCHEMA_VERSION:
+        return False
+    log.info(f"Actualizando los índices de MongoDB a la versión {SCHEMA_VERSION}")
+    create_indexes(database)
+    database[SCHEMA_COLLECTION].update_one({"_id": "mongodb"}, {"$set": {"version": SCHEMA_VERSION}}, upsert=True)
+    return True
+
+
+@metricas.instrumentado("mongodb")
+def get_restaurants(database, filtro=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recorre los restaurantes que cumplen el filtro en lotes de batch_size documentos,
+    sin cargar la colección completa en memoria.
+    """
+    cursor = database["restaurantes"].find(filtro or {}, RESTAURANTE_FIELDS).batch_size(batch_size)
+    for documento in cursor:
+        yield to_restaurante(documento)
+
+
+# Vistas materializadas: se recalculan solo los grupos afectados por una carga o un cambio
+def _top_n_accumulator(k):
+    return {"$topN": {
+        "n": k,
+        "sortBy": {"rating": -1, "id": 1},
+        "output": {"id": "$id", "nombre": "$nombre", "categoria": "$categoria",
+                   "rating": "$rating", "zona_id": "$zona_id"},
+    }}
+
+
+def refresh_zone_leaderboards(database, zona_ids=None, k=LEADERBOARD_K):
+    """
+    Recalcula con $merge el top k de las zonas indicadas (todas si zona_ids es None).
+    Las zonas que se quedaron sin restaurantes se eliminan de la vista.
+    """
+    stamp = time.time()
+    pipeline = []
+    if zona_ids is not None:
+        zona_ids = list(zona_ids)
+        if not zona_ids:
             return
-        zona = zonas_collection.find_one({"nombre": zone_name})
-        if not zona:
-            print(f"No se encontró la zona con el nombre '{zone_name}'.")
+        pipeline.append({"$match": {"zona_id": {"$in": zona_ids}}})
+    pipeline += [
+        {"$group": {"_id": "$zona_id", "restaurantes": _top_n_accumulator(k)}},
+        {"$lookup": {"from": "zonas", "localField": "_id", "foreignField": "id", "as": "zona"}},
+        {"$project": {
+            "nombre": {"$first": "$zona.nombre"},
+            "restaurantes": 1,
+            "actualizado": {"$literal": stamp},
+        }},
+        {"$merge": {"into": ZONE_LEADERBOARD, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    database["restaurantes"].aggregate(pipeline)
+
+    obsoletos = {"actualizado": {"$lt": stamp}}
+    if zona_ids is not None:
+        obsoletos["_id"] = {"$in": zona_ids}
+    database[ZONE_LEADERBOARD].delete_many(obsoletos)
+    cache.invalidate("mongodb")
+
+
+def refresh_category_leaderboards(database, categorias=None, k=LEADERBOARD_K):
+    """
+    Recalcula con $merge el top k y el total de las categorías indicadas (todas si es None).
+    La clave de cada documento es la categoría en minúsculas.
+    """
+    stamp = time.time()
+    pipeline = []
+    if categorias is not None:
+        categorias = list(categorias)
+        if not categorias:
             return
+        pipeline.append({"$match": {"categoria": {"$in": categorias}}})
+    pipeline += [
+        {"$group": {
+            "_id": {"$toLower": "$categoria"},
+            "categoria": {"$first": "$categoria"},
+            "total": {"$sum": 1},
+            "restaurantes": _top_n_accumulator(k),
+        }},
+        {"$set": {"actualizado": {"$literal": stamp}}},
+        {"$merge": {"into": CATEGORY_LEADERBOARD, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    database["restaurantes"].aggregate(pipeline, collation=CATEGORY_COLLATION)
+
+    obsoletos = {"actualizado": {"$lt": stamp}}
+    if categorias is not None:
+        obsoletos["_id"] = {"$in": [categoria.lower() for categoria in categorias]}
+    database[CATEGORY_LEADERBOARD].delete_many(obsoletos)
+    cache.invalidate("mongodb")
 
-        # Usar agregación para obtener el top 3 de restaurantes en esa zona
-        restaurantes = restaurantes_collection.aggregate([
-            {"$match": {"zona_id": zona["id"]}},  # Filtrar por zona específica
-            {"$sort": {"rating": -1}},           # Ordenar por rating descendente
-            {"$limit": 3}                        # Limitar a los 3 mejores
-        ])
-        print(f"Zona: {zona['nombre']}")
-        for restaurante in restaurantes:
-            print(f"- {restaurante['nombre']} (Rating: {restaurante['rating']})")
 
+@metricas.instrumentado("mongodb")
+def refresh_leaderboards(database, zona_ids=None, categorias=None, k=LEADERBOARD_K):
+    refresh_zone_leaderboards(database, zona_ids, k)
+    refresh_category_leaderboards(database, categorias, k)
 
 
-def top_restaurants_by_category(db, category):
+@metricas.instrumentado("mongodb")
+def leaderboard_by_zone(database, zone_name=None, n=3):
     """
-    Muestra el top 3 de restaurantes según la categoría.
+    Genera ZonaTop leyendo la vista materializada: un documento por zona, sin ordenar
+    restaurantes. Si la vista aún no existe, usa la consulta en vivo.
     """
-    # Asegurar la consulta insensible a mayúsculas/minúsculas
-    restaurantes = db["restaurantes"].find(
-        {"categoria": {"$regex": f"^{category}$", "$options": "i"}}
-    ).sort("rating", -1).limit(3)
+    leaderboard = database[ZONE_LEADERBOARD].estimated_document_count() > 0
+    found = False
+    for documento in database["zonas"].aggregate(zone_top_pipeline(zone_name, n, leaderboard)):
+        found = True
+        yield to_zona_top(documento, n)
+    if zone_name and not found:
+        raise LookupError(f"No se encontró la zona con el nombre '{zone_name}'.")
 
-    # Contar los resultados
-    num_restaurantes = db["restaurantes"].count_documents(
-        {"categoria": {"$regex": f"^{category}$", "$options": "i"}}
-    )
 
-    if num_restaurantes == 0:
-        print(f"No se encontraron restaurantes en la categoría '{category}'.")
+@metricas.instrumentado("mongodb")
+def leaderboard_by_category(database, category, n=3):
+    """
+    Genera el top n de la categoría leyendo un solo documento de la vista materializada.
+    Si la vista aún no existe, usa la consulta en vivo.
+    """
+    if n > LEADERBOARD_K or database[CATEGORY_LEADERBOARD].estimated_document_count() == 0:
+        yield from top_restaurants_by_category(database, category, n=n)
         return
 
-    print(f"Top 3 restaurantes en la categoría '{category}':")
-    for restaurante in restaurantes:
-        print(f"- {restaurante['nombre']} (Rating: {restaurante['rating']})")
+    documento = database[CATEGORY_LEADERBOARD].find_one({"_id": category.lower()})
+    if documento:
+        yield from (to_restaurante(r) for r in documento["restaurantes"][:n])
\ No newline at end of file
@@ -1,76 +1,229 @@
 #!/usr/bin/env python3
+import argparse
 import csv
-from pymongo import MongoClient
+import logging
 import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import cache
+import conexiones
+import modelpython
 
-# Conexión a la base de datos
-client = MongoClient("mongodb://localhost:27017/")
-db = client["PFmongodb"]
+# Set logger
+log = logging.getLogger()
 
 # Nombres de las colecciones
 ZONAS_COLLECTION = "zonas"
 RESTAURANTES_COLLECTION = "restaurantes"
 
+# Tamaño de los bloques de inserción
+CHUNK_SIZE = 1000
+
+# Bloques bulk_write enviados a la vez
+MAX_IN_FLIGHT = 4
+
+
+def zona_documento(row):
+    return {"id": int(row["id"]), "nombre": row["nombre"]}
+
+
+def restaurante_documento(row, zona_ids):
+    # Agregar un campo zona_id aleatorio basado en los IDs de las zonas cargadas
+    ventas = row["ventas"]
+    if isinstance(ventas, str):
+        ventas = list(map(int, ventas[1:-1].split(", ")))  # Procesar la lista de ventas
+    return {
+        "id": int(row["id"]),
+        "nombre": row["nombre"],
+        "categoria": row["categoria"],
+        "rating": float(row["rating"]),
+        "ventas": ventas,
+        "zona_id": random.choice(zona_ids) if zona_ids else None,  # Sin zonas cargadas queda sin zona
+    }
+
+
+def chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bulk_insert(collection, documentos):
+    try:
+        result = collection.bulk_write([InsertOne(doc) for doc in documentos], ordered=False)
+        return result.inserted_count
+    except BulkWriteError as e:
+        # Con ordered=False el resto del bloque se inserta aunque fallen algunos documentos
+        errores = e.details.get("writeErrors", [])
+        log.error(f"{len(errores)} documentos no insertados en {collection.name}: {errores[:1]}")
+        return e.details.get("nInserted", 0)
+
+
+def bulk_insert_stream(collection, documentos, chunk_size=CHUNK_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Inserta un flujo de documentos en bloques unordered de chunk_size, con a lo sumo
+    max_in_flight bloques enviados a la vez. La memoria usada depende de
+    chunk_size * max_in_flight y no del tamaño del archivo.
+    Devuelve el número de documentos insertados.
+    """
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pendientes = set()
+        for chunk in chunks(documentos, chunk_size):
+            if len(pendientes) >= max_in_flight:
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                total += sum(f.result() for f in listos)
+            pendientes.add(executor.submit(_bulk_insert, collection, chunk))
+        total += sum(f.result() for f in pendientes)
+    return total
+
+
+def insert_zonas(database, zonas):
+    documentos = [zona_documento(row) for row in zonas]
+    database[ZONAS_COLLECTION].insert_many(documentos)
+    return documentos
+
+
+def _grupos_afectados(documentos, zonas, categorias):
+    for documento in documentos:
+        zonas.add(documento["zona_id"])
+        categorias.add(documento["categoria"])
+        yield documento
+
+
+def insert_restaurantes(database, restaurantes, zona_ids, chunk_size=CHUNK_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Inserta un flujo de filas de restaurantes en bloques de chunk_size y actualiza el top
+    materializado solo de las zonas y categorías que recibieron restaurantes.
+    Devuelve el número de restaurantes insertados.
+    """
+    zonas, categorias = set(), set()
+    documentos = _grupos_afectados((restaurante_documento(row, zona_ids) for row in restaurantes),
+                                   zonas, categorias)
+    total = bulk_insert_stream(database[RESTAURANTES_COLLECTION], documentos, chunk_size, max_in_flight)
+    modelpython.refresh_leaderboards(database, zonas, categorias)
+    return total
+
+
+def update_restaurante(database, restaurante_id, cambios):
+    """
+    Modifica un restaurante (por ejemplo, su rating, categoría o zona) y recalcula el top
+    materializado de los grupos a los que pertenecía y a los que pertenece ahora.
+    """
+    anterior = database[RESTAURANTES_COLLECTION].find_one_and_update(
+        {"id": restaurante_id}, {"$set": cambios}, projection={"zona_id": 1, "categoria": 1})
+    if anterior is None:
+        raise LookupError(f"No existe el restaurante con id {restaurante_id}.")
+    zonas = {anterior["zona_id"], cambios.get("zona_id", anterior["zona_id"])}
+    categorias = {anterior["categoria"], cambios.get("categoria", anterior["categoria"])}
+    modelpython.refresh_leaderboards(database, zonas, categorias)
+
+
+def apply_restaurantes_delta(database, upserts, removed_ids, zona_ids, chunk_size=CHUNK_SIZE):
+    """
+    Aplica solo los cambios de una sincronización: borra los restaurantes de removed_ids y
+    crea o actualiza los de upserts (filas del CSV) por su id. Un restaurante que ya existía
+    conserva su zona; uno nuevo recibe una al azar. Después recalcula el top materializado
+    de las zonas y categorías afectadas.
+    Devuelve el número de documentos creados, modificados o borrados.
+    """
+    if not upserts and not removed_ids:
+        return 0
+    collection = database[RESTAURANTES_COLLECTION]
+    zonas, categorias = set(), set()
+    ids = [int(row["id"]) for row in upserts] + list(removed_ids)
+    for anterior in collection.find({"id": {"$in": ids}}, {"_id": 0, "zona_id": 1, "categoria": 1}):
+        zonas.add(anterior["zona_id"])
+        categorias.add(anterior["categoria"])
+
+    def operaciones():
+        # (operación, zona que recibe el restaurante si el upsert lo crea)
+        if removed_ids:
+            yield DeleteMany({"id": {"$in": list(removed_ids)}}), None
+        for row in upserts:
+            documento = restaurante_documento(row, zona_ids)
+            zona_id = documento.pop("zona_id")
+            categorias.add(documento["categoria"])
+            yield UpdateOne({"id": documento["id"]}, {"$set": documento, "$setOnInsert": {"zona_id": zona_id}},
+                            upsert=True), zona_id
+
+    total = 0
+    for chunk in chunks(operaciones(), chunk_size):
+        result = collection.bulk_write([operacion for operacion, _ in chunk], ordered=False)
+        total += result.upserted_count + result.modified_count + result.deleted_count
+        zonas.update(chunk[i][1] for i in result.upserted_ids)
+    zonas.discard(None)
+    modelpython.refresh_leaderboards(database, zonas, categorias)
+    return total
+
+
 # Leer y cargar zonas en la colección
-def load_zonas(file_path):
+def load_zonas(file_path, database=None, chunk_size=CHUNK_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    database = conexiones.mongo_database() if database is None else database
     with open(file_path, mode="r", encoding="utf-8") as file:
         reader = csv.DictReader(file)
-        zonas = [{"id": int(row["id"]), "nombre": row["nombre"]} for row in reader]
-        db[ZONAS_COLLECTION].insert_many(zonas)
-        print(f"Datos de MongoDB creados: {len(zonas)} zonas cargadas.")
+        documentos = (zona_documento(row) for row in reader)
+        total = bulk_insert_stream(database[ZONAS_COLLECTION], documentos, chunk_size, max_in_flight)
+        print(f"Datos de MongoDB creados: {total} zonas cargadas.")
+    return total
 
 
 # Leer y cargar restaurantes en la colección
-def load_restaurantes(file_path):
-    zonas = list(db[ZONAS_COLLECTION].find())
-    zona_ids = [zona["id"] for zona in zonas]
+def load_restaurantes(file_path, database=None, chunk_size=CHUNK_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    database = conexiones.mongo_database() if database is None else database
+    zona_ids = [zona["id"] for zona in database[ZONAS_COLLECTION].find({}, {"id": 1})]
 
     with open(file_path, mode="r", encoding="utf-8") as file:
         reader = csv.DictReader(file)
-        restaurantes = []
-
-        for row in reader:
-            # Agregar un campo zona_id aleatorio basado en los IDs de las zonas cargadas
-            zona_id = random.choice(zona_ids)
-            restaurante = {
-                "id": int(row["id"]),
-                "nombre": row["nombre"],
-                "categoria": row["categoria"],
-                "rating": float(row["rating"]),
-                "ventas": list(map(int, row["ventas"][1:-1].split(", "))),  # Procesar la lista de ventas
-                "zona_id": zona_id,
-            }
-            restaurantes.append(restaurante)
-
-        db[RESTAURANTES_COLLECTION].insert_many(restaurantes)
-        print(f"Datos de MongoDB creados: {len(restaurantes)} restaurantes cargados.")
+        total = insert_restaurantes(database, reader, zona_ids, chunk_size, max_in_flight)
+        print(f"Datos de MongoDB creados: {total} restaurantes cargados.")
+    return total
 
 
 # Borrar colecciones (opcional, para limpiar la base de datos antes de cargar)
-def clear_collections():
-    db[ZONAS_COLLECTION].delete_many({})
-    db[RESTAURANTES_COLLECTION].delete_many({})
+def clear_collections(database=None):
+    database = conexiones.mongo_database() if database is None else database
+    database[ZONAS_COLLECTION].delete_many({})
+    database[RESTAURANTES_COLLECTION].delete_many({})
+    database[modelpython.ZONE_LEADERBOARD].delete_many({})
+    database[modelpython.CATEGORY_LEADERBOARD].delete_many({})
     print("Colecciones limpiadas.")
 
 
-# Agregar índices después de cargar los datos
+# Agregar índices antes o después de cargar los datos
 def create_indexes(db):
     """
     Crea índices para optimizar las consultas.
     """
-    db["restaurantes"].create_index([("categoria", 1)])  # Índice en 'categoria'
-    db["restaurantes"].create_index([("rating", -1)])    # Índice en 'rating'
-    db["restaurantes"].create_index([("zona_id", 1)])    # Índice en 'zona_id'
-
+    modelpython.create_indexes(db)
 
 
-# Llamar a create_indexes al final del archivo populate.py:
-def main():
-    clear_collections()  # Comentar si no deseas limpiar antes de cargar
-    load_zonas("zonas.csv")
-    load_restaurantes("restaurantes.csv")
-    create_indexes(db)  # Crear índices después de cargar datos
+def main(indexes="after", chunk_size=CHUNK_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    """
+    indexes="before" crea los índices antes de cargar (útil si se consulta durante la carga);
+    indexes="after" los construye una sola vez al final, que suele ser más rápido.
+    """
+    db = conexiones.mongo_database()
+    clear_collections(db)  # Comentar si no deseas limpiar antes de cargar
+    if indexes == "before":
+        create_indexes(db)
+    load_zonas("zonas.csv", db, chunk_size, max_in_flight)
+    load_restaurantes("restaurantes.csv", db, chunk_size, max_in_flight)
+    if indexes == "after":
+        create_indexes(db)  # Crear índices después de cargar datos
+    cache.invalidate("mongodb")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Carga zonas y restaurantes en MongoDB.")
+    parser.add_argument("--indices", choices=["before", "after"], default="after",
+                        help="Crear los índices antes o después de la carga")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Documentos por bloque bulk_write")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="Bloques enviados a la vez")
+    args = parser.parse_args()
+    main(args.indices, args.chunk_size, args.in_flight)
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Servicio HTTP local (JSON) con las consultas de Dgraph, MongoDB y Cassandra.
+
+Un solo proceso atiende muchas peticiones concurrentes sobre un bucle asyncio:
+MongoDB usa el cliente asíncrono de pymongo, y las futures de Cassandra (execute_async)
+y de Dgraph (async_query, gRPC) se adaptan al bucle con callbacks, sin un hilo por petición.
+Cada endpoint tiene su propio límite de peticiones simultáneas.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from decimal import Decimal
+from urllib.parse import urlsplit, parse_qs
+import pydgraph
+import conexiones
+import metricas
+import modeldgraph
+import modelpython
+import modelcassandra
+
+# Dirección de escucha
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', '8080'))
+
+# Peticiones simultáneas por endpoint; se pueden cambiar con SERVICE_LIMITS="endpoint=n,..."
+# o con --limite endpoint=n
+DEFAULT_LIMIT = 32
+LIMITES = {
+    "top-seguidores": 16,
+    "restaurantes-por-ciudad": 32,
+    "top-por-zona": 64,
+    "top-por-categoria": 64,
+    "ventas-por-mes": 32,
+    "ventas-por-restaurante": 64,
+    "ventas-por-rango": 8,
+    "totales-por-mes": 64,
+    "ventas-por-categoria": 64,
+    "total-anual": 64,
+}
+
+# Segundos que una petición espera un hueco en su endpoint antes de responder 503
+ESPERA_MAXIMA = 5.0
+
+# Set logger
+log = logging.getLogger()
+
+
+class Clientes:
+    """
+    Clientes del servicio; cada base se conecta la primera vez que un endpoint la usa.
+    """
+    def __init__(self, dgraph_client=None, mongo_database=None, cassandra_session=None):
+        self._dgraph = dgraph_client
+        self._mongo = mongo_database
+        self._cassandra = cassandra_session
+        self._cassandra_lock = asyncio.Lock()
+
+    @property
+    def dgraph(self):
+        if self._dgraph is None:
+            self._dgraph = conexiones.dgraph_client()
+        return self._dgraph
+
+    @property
+    def mongo(self):
+        if self._mongo is None:
+            self._mongo = conexiones.mongo_async_database()
+        return self._mongo
+
+    async def cassandra(self):
+        # Conectar, leer el puntero de la generación y preparar son llamadas bloqueantes:
+        # se hacen en un hilo del executor, una sola vez aunque lleguen varias peticiones
+        async with self._cassandra_lock:
+            if self._cassandra is None:
+                self._cassandra = await asyncio.get_running_loop().run_in_executor(None, _conectar_cassandra)
+        return self._cassandra
+
+
+def _conectar_cassandra():
+    session = conexiones.cassandra_session()
+    session.set_keyspace(conexiones.CASSANDRA_KEYSPACE)
+    modelcassandra.prepare_statements(session)
+    return session
+
+
+# Adaptadores de futures de los drivers a asyncio
+async def dgraph_query(client, query, variables=None):
+    """
+    Ejecuta una consulta de solo lectura con async_query y espera la future de gRPC en el bucle.
+    """
+    loop = asyncio.get_running_loop()
+    listo = loop.create_future()
+    future = client.txn(read_only=True).async_query(query, variables=variables)
+    future.add_done_callback(lambda f: loop.call_soon_threadsafe(
+        lambda: listo.done() or listo.set_result(f)))
+    respuesta = pydgraph.Txn.handle_query_future(await listo)
+    metricas.registrar("dgraph", bytes=len(respuesta.json))
+    return json.loads(respuesta.json)
+
+
+async def cassandra_rows(session, name, values=None, fetch_size=modelcassandra.DEFAULT_FETCH_SIZE):
+    """
+    Ejecuta la sentencia preparada `name` con execute_async y devuelve todas sus filas,
+    pidiendo cada página cuando llega la anterior.
+    """
+    loop = asyncio.get_running_loop()
+    paginas = asyncio.Queue()
+    statement = modelcassandra.cached_prepared(session, name)
+    if statement is None:
+        # Puntero de la generación vencido o sentencia sin preparar: prepared consulta al servidor
+        statement = await loop.run_in_executor(None, modelcassandra.prepared, session, name)
+    bound = statement.bind(values or [])
+    bound.fetch_size = fetch_size
+    future = session.execute_async(bound)
+    # Los callbacks se conservan entre páginas: se llaman una vez por página
+    future.add_callbacks(lambda rows: loop.call_soon_threadsafe(paginas.put_nowait, (rows, None)),
+                         lambda exc: loop.call_soon_threadsafe(paginas.put_nowait, (None, exc)))
+    rows = []
+    while True:
+        pagina, exc = await paginas.get()
+        if exc is not None:
+            raise exc
+        rows.extend(pagina)
+        if not future.has_more_pages:
+            return rows
+        future.start_fetching_next_page()
+
+
+# Conversión de resultados a JSON
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _dicts(rows):
+    return [row._asdict() for row in rows]
+
+
+def _param(params, name, default=None, tipo=str):
+    valor = params.get(name, [None])[0]
+    if valor in (None, ""):
+        if default is None:
+            raise ValueError(f"Falta el parámetro '{name}'.")
+        return default
+    try:
+        return tipo(valor)
+    except ValueError:
+        raise ValueError(f"Valor no válido para '{name}': {valor}")
+
+
+# Endpoints de Dgraph
+async def top_seguidores(clientes, params):
+    k = _param(params, "k", 3, int)
+    cursor = params.get("cursor", [None])[0]
+    query, variables = modeldgraph.top_k_request(k, _param(params, "direccion", "desc"),
+                                                 params.get("categoria", [None])[0],
+                                                 params.get("ciudad", [None])[0], cursor)
+    return modeldgraph.parse_top_k(await dgraph_query(clientes.dgraph, query, variables), k, cursor)
+
+
+async def restaurantes_por_ciudad(clientes, params):
+    ciudad = modeldgraph.normalizeString(_param(params, "ciudad"))
+    data = await dgraph_query(clientes.dgraph, modeldgraph.RESTAURANTS_BY_CITY_QUERY, {"$city_name": ciudad})
+    restaurantes = modeldgraph.parse_restaurants_by_city(data)
+    if restaurantes is None:
+        raise LookupError(f"No se encontró la ciudad con el nombre: {ciudad}")
+    return _dicts(restaurantes)
+
+
+# Endpoints de MongoDB (leen las vistas materializadas y, si no existen, agregan en vivo)
+async def top_por_zona(clientes, params):
+    db = clientes.mongo
+    n = _param(params, "n", 3, int)
+    zona = params.get("zona", [None])[0]
+    leaderboard = await db[modelpython.ZONE_LEADERBOARD].estimated_document_count() > 0
+    cursor = await db["zonas"].aggregate(modelpython.zone_top_pipeline(zona, n, leaderboard))
+    documentos = await cursor.to_list()
+    if zona and not documentos:
+        raise LookupError(f"No se encontró la zona con el nombre '{zona}'.")
+    return [{"nombre": top.nombre, "restaurantes": _dicts(top.restaurantes)}
+            for top in (modelpython.to_zona_top(documento, n) for documento in documentos)]
+
+
+async def top_por_categoria(clientes, params):
+    db = clientes.mongo
+    categoria = _param(params, "categoria")
+    n = _param(params, "n", 3, int)
+    if n <= modelpython.LEADERBOARD_K and await db[modelpython.CATEGORY_LEADERBOARD].estimated_document_count():
+        documento = await db[modelpython.CATEGORY_LEADERBOARD].find_one({"_id": categoria.lower()}) or {}
+        total = documento.get("total", 0)
+        restaurantes = [modelpython.to_restaurante(r) for r in documento.get("restaurantes", [])[:n]]
+    else:
+        cursor = await db["restaurantes"].aggregate(modelpython.top_by_category_pipeline(categoria, n),
+                                                   collation=modelpython.CATEGORY_COLLATION)
+        facets = await cursor.to_list()
+        total, restaurantes = modelpython.parse_category_facet(facets[0] if facets else None)
+    return {"categoria": categoria, "total": total, "restaurantes": _dicts(restaurantes)}
+
+
+# Endpoints de Cassandra
+async def ventas_por_mes(clientes, params):
+    session = await clientes.cassandra()
+    mes = modelcassandra.normalize_month(_param(params, "mes"))
+    rows = await cassandra_rows(session, 'SELECT_MONTHLY_SALES', [mes])
+    return _dicts(modelcassandra.to_sales(rows, month=mes))
+
+
+async def ventas_por_restaurante(clientes, params):
+    session = await clientes.cassandra()
+    restaurante = _param(params, "restaurante")
+    mes = params.get("mes", [None])[0]
+    if mes:
+        rows = await cassandra_rows(session, 'SELECT_MONTHLY_RESTAURANT_SALES',
+                                    [restaurante, modelcassandra.normalize_month(mes)])
+    else:
+        rows = await cassandra_rows(session, 'SELECT_RESTAURANT_SALES', [restaurante])
+    return _dicts(modelcassandra.to_sales(rows, restaurant=restaurante))
+
+
+async def ventas_por_rango(clientes, params):
+    session = await clientes.cassandra()
+    minimo, maximo = _param(params, "min", tipo=float), _param(params, "max", tipo=float)
+    limite = params.get("limite", [None])[0]
+    limite = int(limite) if limite else None
+    orden = params.get("orden", [None])[0] or None
+    meses = params.get("meses", [None])[0]
+    meses = meses.split(",") if meses else None
+
+    name, valores = modelcassandra.sales_range_request(minimo, maximo, meses, limite, orden)
+    particiones = await asyncio.gather(*(cassandra_rows(session, name, v) for v in valores))
+    return _dicts(modelcassandra.to_sales(modelcassandra.merge_sales_partitions(particiones, limite, orden)))
+
+
+async def totales_por_mes(clientes, params):
+    session = await clientes.cassandra()
+    mes = params.get("mes", [None])[0]
+    if mes:
+        rows = await cassandra_rows(session, 'SELECT_MONTHLY_TOTAL',
+                                    [modelcassandra.TOTALS_BUCKET, modelcassandra.normalize_month(mes)])
+    else:
+        rows = await cassandra_rows(session, 'SELECT_MONTHLY_TOTALS', [modelcassandra.TOTALS_BUCKET])
+    rows = sorted(rows, key=lambda row: modelcassandra.MONTH_ORDER.index(row.month))
+    return [{"month": row.month, "total_sales": row.total_sales} for row in rows]
+
+
+async def ventas_por_categoria(clientes, params):
+    session = await clientes.cassandra()
+    categoria = _param(params, "categoria")
+    mes = params.get("mes", [None])[0]
+    if mes:
+        rows = await cassandra_rows(session, 'SELECT_CATEGORY_MONTH_SALES',
+                                    [categoria, modelcassandra.normalize_month(mes)])
+    else:
+        rows = await cassandra_rows(session, 'SELECT_CATEGORY_SALES', [categoria])
+    rows = sorted(rows, key=lambda row: modelcassandra.MONTH_ORDER.index(row.month))
+    return [{"category": row.category, "month": row.month, "total_sales": row.total_sales} for row in rows]
+
+
+async def total_anual(clientes, params):
+    session = await clientes.cassandra()
+    restaurante = _param(params, "restaurante")
+    rows = await cassandra_rows(session, 'SELECT_RESTAURANT_YEARLY_TOTAL', [restaurante])
+    if not rows:
+        raise LookupError(f"No se encontraron ventas para el restaurante {restaurante}.")
+    return {"restaurant": restaurante, "total_sales": rows[0].total_sales}
+
+
+# Ruta -> (nombre del endpoint, función)
+RUTAS = {
+    "/dgraph/top-seguidores": ("top-seguidores", top_seguidores),
+    "/dgraph/restaurantes-por-ciudad": ("restaurantes-por-ciudad", restaurantes_por_ciudad),
+    "/mongodb/top-por-zona": ("top-por-zona", top_por_zona),
+    "/mongodb/top-por-categoria": ("top-por-categoria", top_por_categoria),
+    "/cassandra/ventas-por-mes": ("ventas-por-mes", ventas_por_mes),
+    "/cassandra/ventas-por-restaurante": ("ventas-por-restaurante", ventas_por_restaurante),
+    "/cassandra/ventas-por-rango": ("ventas-por-rango", ventas_por_rango),
+    "/cassandra/totales-por-mes": ("totales-por-mes", totales_por_mes),
+    "/cassandra/ventas-por-categoria": ("ventas-por-categoria", ventas_por_categoria),
+    "/cassandra/total-anual": ("total-anual", total_anual),
+}
+
+ESTADOS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Servicio:
+    def __init__(self, clientes, limites=None, espera_maxima=ESPERA_MAXIMA):
+        self.clientes = clientes
+        limites = {**LIMITES, **(limites or {})}
+        self.limites = {nombre: limites.get(nombre, DEFAULT_LIMIT) for nombre, _ in RUTAS.values()}
+        self.semaforos = {nombre: asyncio.Semaphore(limite) for nombre, limite in self.limites.items()}
+        self.en_curso = {nombre: 0 for nombre in self.limites}
+        self.espera_maxima = espera_maxima
+
+    def estado(self):
+        return {
+            "endpoints": {nombre: {"limite": self.limites[nombre], "en_curso": self.en_curso[nombre]}
+                          for nombre in self.limites},
+            "pools": conexiones.utilizacion(),
+        }
+
+    async def despachar(self, metodo, objetivo):
+        """
+        Resuelve una petición y devuelve (código HTTP, cuerpo JSON).
+        """
+        if metodo != "GET":
+            return 405, {"error": f"Método no permitido: {metodo}"}
+        url = urlsplit(objetivo)
+        if url.path == "/estado":
+            return 200, self.estado()
+        if url.path == "/metricas":
+            return 200, metricas.texto_prometheus()
+        if url.path not in RUTAS:
+            return 404, {"error": f"Ruta desconocida: {url.path}"}
+
+        nombre, funcion = RUTAS[url.path]
+        semaforo = self.semaforos[nombre]
+        try:
+            await asyncio.wait_for(semaforo.acquire(), self.espera_maxima)
+        except asyncio.TimeoutError:
+            return 503, {"error": f"Endpoint {nombre} saturado ({self.limites[nombre]} peticiones en curso)."}
+
+        self.en_curso[nombre] += 1
+        inicio = time.perf_counter()
+        try:
+            with metricas.medir("servicio", nombre) as medicion:
+                resultado = await funcion(self.clientes, parse_qs(url.query))
+                medicion.agregar(filas=len(resultado) if isinstance(resultado, list) else 1)
+            return 200, resultado
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except LookupError as e:
+            return 404, {"error": str(e)}
+        except Exception as e:
+            log.error(f"Error en {nombre}: {e}")
+            return 500, {"error": str(e)}
+        finally:
+            self.en_curso[nombre] -= 1
+            semaforo.release()
+            log.info(f"{nombre} atendido en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    async def atender(self, reader, writer):
+        """
+        Atiende una conexión HTTP/1.1; admite varias peticiones seguidas (keep-alive).
+        """
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, objetivo, version = linea.decode("latin-1").split()
+                except ValueError:
+                    break
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b"\r\n", b"\n", b""):
+                        break
+                    clave, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[clave.strip().lower()] = valor.strip()
+                try:
+                    longitud = int(cabeceras.get("content-length", 0))
+                    if longitud < 0:
+                        raise ValueError(longitud)
+                except ValueError:
+                    # Sin una longitud válida no se sabe dónde acaba el cuerpo: se responde y se cierra
+                    codigo, cuerpo = 400, {"error": "Content-Length no válido."}
+                    cabeceras["connection"] = "close"
+                else:
+                    if longitud:
+                        await reader.readexactly(longitud)
+                    codigo, cuerpo = await self.despachar(metodo, objetivo)
+                if isinstance(cuerpo, str):
+                    tipo = "text/plain; version=0.0.4; charset=utf-8"
+                    datos = cuerpo.encode("utf-8")
+                else:
+                    tipo = "application/json; charset=utf-8"
+                    datos = json.dumps(cuerpo, ensure_ascii=False, default=_json_default).encode("utf-8")
+                cerrar = cabeceras.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                writer.write(
+                    f"HTTP/1.1 {codigo} {ESTADOS[codigo]}\r\n"
+                    f"Content-Type: {tipo}\r\n"
+                    f"Content-Length: {len(datos)}\r\n"
+                    f"Connection: {'close' if cerrar else 'keep-alive'}\r\n\r\n".encode("latin-1") + datos)
+                await writer.drain()
+                if cerrar:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def parse_limites(texto):
+    """
+    Convierte "endpoint=n,endpoint=n" en {endpoint: n}.
+    """
+    limites = {}
+    for parte in filter(None, (texto or "").split(",")):
+        nombre, _, valor = parte.partition("=")
+        limites[nombre.strip()] = int(valor)
+    return limites
+
+
+async def servir(host=SERVICE_HOST, port=SERVICE_PORT, limites=None):
+    servicio = Servicio(Clientes(), limites)
+    server = await asyncio.start_server(servicio.atender, host, port)
+    print(f"Servicio escuchando en http://{host}:{port}")
+    log.info(f"Servicio HTTP en {host}:{port} con límites {servicio.limites}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await conexiones.cerrar_async()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP JSON con las consultas de las tres bases.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Dirección de escucha")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Puerto de escucha")
+    parser.add_argument("--limite", action="append", default=[],
+                        help="Peticiones simultáneas de un endpoint, p. ej. ventas-por-rango=4")
+    args = parser.parse_args(argv)
+    log.setLevel('INFO')
+    handler = logging.FileHandler('unified_system.log')
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    log.addHandler(handler)
+    limites = parse_limites(os.getenv('SERVICE_LIMITS'))
+    limites.update(parse_limites(",".join(args.limite)))
+    asyncio.run(servir(args.host, args.port, limites))
+
+
+if __name__ == "__main__":
+    main()
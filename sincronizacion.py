@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+import conexiones
+import ingesta
+import modelcassandra
+import modeldgraph
+import modelpython
+import populate
+
+# Set logger
+log = logging.getLogger()
+
+# Manifiesto local con el hash de cada fila de restaurantes.csv ya aplicada
+MANIFEST_FILE = os.getenv('SYNC_MANIFEST', 'manifest_sync.json')
+MANIFEST_VERSION = 2
+
+ALMACENES = ("mongodb", "cassandra", "dgraph")
+
+# Campos de la fila que usa cada almacén: un cambio en otro campo no genera escrituras en él
+CAMPOS = {
+    "mongodb": ("nombre", "categoria", "rating", "ventas"),
+    "cassandra": ("nombre", "categoria", "ventas"),
+    "dgraph": ("nombre", "categoria", "rating"),
+}
+
+# Filas agregadas (registros), modificadas ((entrada anterior, registro)) y eliminadas ((id, entrada anterior))
+Delta = namedtuple("Delta", ["agregados", "modificados", "eliminados"])
+
+
+def hash_registro(record):
+    contenido = json.dumps([record["nombre"], record["categoria"], record["rating"], record["ventas"]],
+                           ensure_ascii=False)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+
+def manifiesto_vacio():
+    # Sin manifiesto ningún almacén está sincronizado: la primera ejecución es una carga completa
+    return {"version": MANIFEST_VERSION, "almacenes": [], "restaurantes": {}}
+
+
+def leer_manifiesto(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return manifiesto_vacio()
+    with open(path, "r", encoding="utf-8") as file:
+        manifiesto = json.load(file)
+    if manifiesto.get("version") != MANIFEST_VERSION:
+        log.warning(f"Manifiesto {path} con otra versión; se hará una carga completa")
+        return manifiesto_vacio()
+    return manifiesto
+
+
+def guardar_manifiesto(manifiesto, path=MANIFEST_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifiesto, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def borrar_manifiesto(path=MANIFEST_FILE):
+    # Tras borrar los datos, la próxima sincronización tiene que ser una carga completa
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def nuevo_manifiesto(registros, almacenes):
+    return {
+        "version": MANIFEST_VERSION,
+        "almacenes": [almacen for almacen in ALMACENES if almacen in almacenes],
+        "restaurantes": {
+            id_: {"hash": hash_registro(record), "nombre": record["nombre"], "categoria": record["categoria"],
+                  "rating": record["rating"], "ventas": record["ventas"]}
+            for id_, record in registros.items()
+        },
+    }
+
+
+def manifiesto_sink(registros):
+    """
+    Destino para ingesta.ejecutar que junta las filas de la carga en registros {id (str): registro},
+    así el manifiesto sale de la misma lectura del CSV; si un id se repite gana la última fila.
+    """
+    def cargar(restaurantes):
+        for record in restaurantes:
+            if str(record["id"]) in registros:
+                log.warning(f"Id {record['id']} repetido, se usa la última aparición")
+            registros[str(record["id"])] = record
+    return cargar
+
+
+def registrar_carga_completa(reporte, registros, path=MANIFEST_FILE):
+    """
+    Reescribe el manifiesto después de una carga completa (ingesta.cargar_todo) con los
+    registros juntados por manifiesto_sink y el reporte de la ingesta: quedan al día los
+    almacenes que cargaron sin error.
+    """
+    almacenes = [almacen for almacen, stats in reporte.items() if stats["error"] is None]
+    guardar_manifiesto(nuevo_manifiesto(registros, almacenes), path)
+
+
+def leer_restaurantes(restaurantes_csv):
+    """
+    Lee el CSV completo y devuelve {id (str): registro}; si un id se repite gana la última fila.
+    """
+    registros = {}
+    for line_number, row in enumerate(ingesta.leer_csv(restaurantes_csv), start=2):
+        try:
+            record = ingesta.parse_restaurante(row)
+        except (ValueError, SyntaxError, KeyError) as e:
+            log.error(f"Fila {line_number} de restaurantes no válida: {e}")
+            continue
+        if str(record["id"]) in registros:
+            log.warning(f"Fila {line_number}: id {record['id']} repetido, se usa la última aparición")
+        registros[str(record["id"])] = record
+    return registros
+
+
+def calcular_delta(anteriores, registros):
+    """
+    Compara los hashes del manifiesto con las filas actuales.
+    """
+    agregados, modificados = [], []
+    for id_, record in registros.items():
+        entrada = anteriores.get(id_)
+        if entrada is None:
+            agregados.append(record)
+        elif entrada["hash"] != hash_registro(record):
+            modificados.append((entrada, record))
+    eliminados = [(id_, entrada) for id_, entrada in anteriores.items() if id_ not in registros]
+    return Delta(agregados, modificados, eliminados)
+
+
+def _cambia(almacen, entrada, record):
+    return any(entrada[campo] != record[campo] for campo in CAMPOS[almacen])
+
+
+def aplicar_mongo(database, delta):
+    upserts = delta.agregados + [record for entrada, record in delta.modificados if _cambia("mongodb", entrada, record)]
+    removed_ids = [int(id_) for id_, _ in delta.eliminados]
+    zona_ids = [zona["id"] for zona in database[populate.ZONAS_COLLECTION].find({}, {"id": 1})]
+    return populate.apply_restaurantes_delta(database, upserts, removed_ids, zona_ids)
+
+
+def aplicar_cassandra(session, delta):
+    cambios = [(entrada, record) for entrada, record in delta.modificados if _cambia("cassandra", entrada, record)]
+    removed = [entrada for _, entrada in delta.eliminados] + [entrada for entrada, _ in cambios]
+    added = delta.agregados + [record for _, record in cambios]
+    exitosas, errores = modelcassandra.apply_sales_delta(session, removed, added)
+    if errores:
+        raise RuntimeError(f"{len(errores)} escrituras fallidas en Cassandra: {errores[0]}")
+    return exitosas
+
+
+def aplicar_dgraph(client, delta):
+    agregados = [modeldgraph.restaurante_nodo(record) for record in delta.agregados]
+    modificados = [modeldgraph.restaurante_nodo(record) for entrada, record in delta.modificados
+                   if _cambia("dgraph", entrada, record)]
+    eliminados = [f"restaurante{id_}" for id_, _ in delta.eliminados]
+    return modeldgraph.aplicar_cambios_restaurantes(client, agregados, modificados, eliminados)
+
+
+def _cargas_completas(pendientes, dgraph_client, mongo_database, cassandra_session, restaurantes_csv,
+                      usuarios_csv, zonas_csv):
+    """
+    Carga completa, con una sola lectura del CSV, de los almacenes que no están al día con
+    el manifiesto (primera ejecución o una sincronización anterior que falló en ellos).
+    """
+    zonas = list(ingesta.leer_csv(zonas_csv))
+    sinks = {}
+    if "mongodb" in pendientes:
+        sinks["mongodb"] = ingesta.mongo_sink(mongo_database, zonas)
+    if "cassandra" in pendientes:
+        sinks["cassandra"] = ingesta.cassandra_sink(cassandra_session)
+    if "dgraph" in pendientes:
+        # drop_all quita los nodos que ya no están en los CSV; también borra el esquema, que se vuelve a aplicar
+        modeldgraph.drop_all(dgraph_client)
+        modeldgraph.ensure_schema(dgraph_client)
+        sinks["dgraph"] = ingesta.dgraph_sink(dgraph_client, list(ingesta.leer_csv(usuarios_csv)), zonas)
+    return ingesta.ejecutar(restaurantes_csv, sinks)
+
+
+def sincronizar(dgraph_client, mongo_database, cassandra_session, restaurantes_csv="restaurantes.csv",
+                usuarios_csv="usuarios.csv", zonas_csv="zonas.csv", manifest_path=MANIFEST_FILE):
+    """
+    Sincronización incremental por el id del CSV: compara el hash de cada fila con el
+    manifiesto y aplica en cada almacén solo las filas agregadas, modificadas y eliminadas.
+    Un almacén que falla queda fuera del manifiesto y recibe una carga completa la próxima vez.
+    Devuelve el reporte por almacén.
+    """
+    inicio = time.perf_counter()
+    manifiesto = leer_manifiesto(manifest_path)
+    anteriores = manifiesto["restaurantes"]
+    registros = leer_restaurantes(restaurantes_csv)
+    delta = calcular_delta(anteriores, registros)
+    log.info(f"Sincronización: {len(delta.agregados)} agregados, {len(delta.modificados)} modificados, "
+             f"{len(delta.eliminados)} eliminados de {len(registros)} filas")
+
+    pendientes = [almacen for almacen in ALMACENES if almacen not in manifiesto["almacenes"]]
+    al_dia = []
+    reporte = {}
+
+    if pendientes:
+        cargas = _cargas_completas(pendientes, dgraph_client, mongo_database, cassandra_session, restaurantes_csv,
+                                   usuarios_csv, zonas_csv)
+        for almacen, stats in cargas.items():
+            reporte[almacen] = {"modo": "completa", "seconds": stats["seconds"], "error": stats["error"]}
+            if stats["error"] is None:
+                al_dia.append(almacen)
+
+    aplicar = {
+        "mongodb": lambda: aplicar_mongo(mongo_database, delta),
+        "cassandra": lambda: aplicar_cassandra(cassandra_session, delta),
+        "dgraph": lambda: aplicar_dgraph(dgraph_client, delta),
+    }
+    for almacen in ALMACENES:
+        if almacen in pendientes:
+            continue
+        inicio_almacen = time.perf_counter()
+        error = None
+        try:
+            if any(delta):
+                aplicar[almacen]()
+            al_dia.append(almacen)
+        except Exception as e:
+            error = str(e)
+            log.error(f"Error al sincronizar {almacen}: {error}")
+        reporte[almacen] = {"modo": "incremental", "seconds": time.perf_counter() - inicio_almacen, "error": error}
+
+    guardar_manifiesto(nuevo_manifiesto(registros, al_dia), manifest_path)
+
+    print(f"Sincronización: {len(delta.agregados)} agregados, {len(delta.modificados)} modificados, "
+          f"{len(delta.eliminados)} eliminados ({time.perf_counter() - inicio:.2f}s)")
+    for almacen, stats in reporte.items():
+        estado = f"ERROR: {stats['error']}" if stats["error"] else "OK"
+        print(f"- {almacen}: carga {stats['modo']} en {stats['seconds']:.2f}s {estado}")
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica a las tres bases solo los cambios de los CSV.")
+    parser.add_argument("--restaurantes", default="restaurantes.csv", help="CSV de restaurantes")
+    parser.add_argument("--usuarios", default="usuarios.csv", help="CSV de usuarios (solo para cargas completas)")
+    parser.add_argument("--zonas", default="zonas.csv", help="CSV de zonas (solo para cargas completas)")
+    parser.add_argument("--manifiesto", default=MANIFEST_FILE, help="Archivo del manifiesto")
+    args = parser.parse_args()
+    try:
+        session = conexiones.cassandra_session()
+        modelcassandra.ensure_schema(session, conexiones.CASSANDRA_KEYSPACE, conexiones.CASSANDRA_REPLICATION_FACTOR)
+        database = conexiones.mongo_database()
+        modelpython.ensure_schema(database)
+        client = conexiones.dgraph_client()
+        modeldgraph.ensure_schema(client)
+        sincronizar(client, database, session, args.restaurantes, args.usuarios, args.zonas, args.manifiesto)
+    finally:
+        conexiones.cerrar()
@@ -0,0 +1,72 @@
+import ingesta
+import sincronizacion
+
+
+def registro(id_, nombre="Pizzeria", categoria="Italiana", rating=4.5, ventas=None):
+    return {"id": id_, "nombre": nombre, "categoria": categoria, "rating": rating,
+            "ventas": ventas if ventas is not None else [10] * 12}
+
+
+def manifiesto(*records):
+    return sincronizacion.nuevo_manifiesto({str(r["id"]): r for r in records}, sincronizacion.ALMACENES)
+
+
+def test_sin_cambios():
+    anteriores = manifiesto(registro(1), registro(2))["restaurantes"]
+    delta = sincronizacion.calcular_delta(anteriores, {"1": registro(1), "2": registro(2)})
+    assert not any(delta)
+
+
+def test_fila_agregada():
+    anteriores = manifiesto(registro(1))["restaurantes"]
+    delta = sincronizacion.calcular_delta(anteriores, {"1": registro(1), "2": registro(2, nombre="Sushi")})
+    assert delta.agregados == [registro(2, nombre="Sushi")]
+    assert delta.modificados == []
+    assert delta.eliminados == []
+
+
+def test_fila_modificada():
+    anteriores = manifiesto(registro(1), registro(2))["restaurantes"]
+    delta = sincronizacion.calcular_delta(anteriores, {"1": registro(1), "2": registro(2, rating=3.0)})
+    assert delta.agregados == []
+    assert delta.eliminados == []
+    [(entrada, record)] = delta.modificados
+    assert entrada["rating"] == 4.5
+    assert record == registro(2, rating=3.0)
+    # rating no es un campo de Cassandra: el cambio no genera escrituras en ella
+    assert sincronizacion._cambia("mongodb", entrada, record)
+    assert not sincronizacion._cambia("cassandra", entrada, record)
+
+
+def test_fila_eliminada():
+    anteriores = manifiesto(registro(1), registro(2))["restaurantes"]
+    delta = sincronizacion.calcular_delta(anteriores, {"1": registro(1)})
+    assert delta.agregados == []
+    assert delta.modificados == []
+    assert [id_ for id_, _ in delta.eliminados] == ["2"]
+    assert delta.eliminados[0][1]["nombre"] == "Pizzeria"
+
+
+def test_manifiesto_borrado_es_carga_completa(tmp_path):
+    path = tmp_path / "manifest.json"
+    sincronizacion.guardar_manifiesto(manifiesto(registro(1)), path)
+    assert sincronizacion.leer_manifiesto(path)["almacenes"] == list(sincronizacion.ALMACENES)
+    sincronizacion.borrar_manifiesto(path)
+    assert sincronizacion.leer_manifiesto(path) == sincronizacion.manifiesto_vacio()
+
+
+def test_carga_completa_registra_las_filas_del_flujo(tmp_path):
+    csv_path = tmp_path / "restaurantes.csv"
+    csv_path.write_text("id,nombre,categoria,rating,ventas\n"
+                        "1,Pizzeria,Italiana,4.5,\"[10, 10]\"\n"
+                        "2,Sushi,Japonesa,4.0,\"[5, 5]\"\n", encoding="utf-8")
+    registros = {}
+    reporte = ingesta.ejecutar(str(csv_path), {"mongodb": lambda restaurantes: list(restaurantes),
+                                               "cassandra": lambda restaurantes: 1 / 0,
+                                               "manifiesto": sincronizacion.manifiesto_sink(registros)})
+    path = tmp_path / "manifest.json"
+    sincronizacion.registrar_carga_completa(reporte, registros, path)
+    manifiesto = sincronizacion.leer_manifiesto(path)
+    assert manifiesto["almacenes"] == ["mongodb"]
+    assert sorted(manifiesto["restaurantes"]) == ["1", "2"]
+    assert manifiesto["restaurantes"]["2"]["ventas"] == [5, 5]